@@ -0,0 +1,154 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Lower
+from django.utils.module_loading import import_string
+
+from api.cache import get_version
+from api.snapshots import ingredients_snapshot
+from recipes.models import Ingredient
+
+FIELDS = ('id', 'name', 'measurement_unit')
+
+
+def get_trigrams(text):
+    """Триграммы слов строки, как в pg_trgm: слово дополняется
+    двумя пробелами слева и одним справа."""
+    trigrams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        trigrams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2)
+        )
+    return trigrams
+
+
+class IngredientIndex:
+    """Индекс каталога ингредиентов в памяти процесса.
+
+    Названия хранятся в нижнем регистре и отсортированы, поэтому
+    совпадения по началу строки находятся бинарным поиском. Для
+    поиска по подстроке и опечаткам используется индекс триграмм.
+    """
+
+    def __init__(self, ingredients):
+        self.items = sorted(
+            ingredients, key=lambda item: (item['name'].casefold(), item['id'])
+        )
+        self.names = [item['name'].casefold() for item in self.items]
+        self.item_trigrams = [get_trigrams(name) for name in self.names]
+        self.trigrams = defaultdict(list)
+        for position, trigrams in enumerate(self.item_trigrams):
+            for trigram in trigrams:
+                self.trigrams[trigram].append(position)
+
+    def prefix(self, query):
+        position = bisect_left(self.names, query)
+        while (position < len(self.names)
+               and self.names[position].startswith(query)):
+            yield position
+            position += 1
+
+    def similar(self, query):
+        """Позиции, упорядоченные по (вхождение подстроки, похожесть)."""
+        query_trigrams = get_trigrams(query)
+        if not query_trigrams:
+            return []
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self.trigrams.get(trigram, ()):
+                shared[position] += 1
+        ranked = []
+        for position, count in shared.items():
+            similarity = count / len(
+                query_trigrams | self.item_trigrams[position]
+            )
+            infix = query in self.names[position]
+            if infix or similarity >= settings.INGREDIENT_SIMILARITY:
+                ranked.append((not infix, -similarity, position))
+        ranked.sort()
+        return [position for _, _, position in ranked]
+
+    def search(self, query, limit):
+        query = query.casefold()
+        positions = list(islice(self.prefix(query), limit))
+        if not positions:
+            positions = self.similar(query)[:limit]
+        return [self.items[position] for position in positions]
+
+
+class MemoryIngredientSearch:
+    """Поиск по индексу в памяти, перестраивается по версии данных."""
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get_index(self):
+        version = get_version(ingredients_snapshot.version_key)
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.index = IngredientIndex(
+                        Ingredient.objects.values(*FIELDS)
+                    )
+                    self.version = version
+        return self.index
+
+    def search(self, query, limit):
+        return self.get_index().search(query, limit)
+
+
+class PostgresIngredientSearch:
+    """Поиск средствами PostgreSQL: индекс UPPER(name) text_pattern_ops
+    для начала строки и GIN-индекс pg_trgm для подстрок и опечаток."""
+
+    def search(self, query, limit):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        prefix = list(
+            Ingredient.objects.filter(
+                name__istartswith=query
+            ).order_by(Lower('name'), 'id').values(*FIELDS)[:limit]
+        )
+        if prefix:
+            return prefix
+        return list(
+            Ingredient.objects.annotate(
+                infix=Case(
+                    When(name__icontains=query, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField()
+                ),
+                similarity=TrigramSimilarity('name', query)
+            ).filter(
+                Q(name__icontains=query)
+                | Q(similarity__gte=settings.INGREDIENT_SIMILARITY)
+            ).order_by('-infix', '-similarity', 'name').values(
+                *FIELDS
+            )[:limit]
+        )
+
+
+backends = {}
+
+
+def get_search_backend():
+    path = settings.INGREDIENT_SEARCH_BACKEND
+    if path not in backends:
+        backends[path] = import_string(path)()
+    return backends[path]
+
+
+def search_ingredients(query):
+    """Совпадения по началу названия; если их нет - по подстроке
+    и похожести (опечатки). Не больше INGREDIENT_SEARCH_LIMIT.
+    query - без пробелов по краям и непустой."""
+    return get_search_backend().search(
+        query, settings.INGREDIENT_SEARCH_LIMIT
+    )
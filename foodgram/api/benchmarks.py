@@ -0,0 +1,337 @@
+import base64
+import gc
+import io
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.cache import bump_recipes_version
+from recipes.models import Ingredient, Recipe, ShoppingCart, Tag
+from users.models import User
+
+# Допуски сверху к порогу в процентах: на очень быстрых запросах
+# случайный разброс больше порога.
+LATENCY_TOLERANCE_MS = 1
+MEMORY_TOLERANCE_KIB = 64
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'peak_kib')
+SAMPLE_SIZE = 20
+RECIPE_INGREDIENTS = 10
+
+# user: anonymous, reader (самая большая корзина) или author
+# (больше всего рецептов); cold - сбрасывать кэш ответов перед запросом.
+Scenario = namedtuple(
+    'Scenario', 'name method user get_request status cold',
+    defaults=(200, False)
+)
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+
+def get_host():
+    """Хост из ALLOWED_HOSTS: тестовый клиент проходит проверку хоста."""
+    for host in settings.ALLOWED_HOSTS:
+        if host and host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def make_image():
+    output = io.BytesIO()
+    Image.new('RGB', (100, 100), (200, 120, 40)).save(output, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        output.getvalue()
+    ).decode()
+
+
+class BenchmarkContext:
+    """Пользователи и параметры запросов, выбранные по данным в базе.
+
+    Выбор детерминирован: на одних и тех же данных (generate_fake_data
+    с тем же seed) сценарии выполняют одни и те же запросы.
+    """
+
+    def __init__(self):
+        self.reader = self.get_top_user(ShoppingCart, 'user_id')
+        self.author = self.get_top_user(Recipe, 'author_id')
+        if self.reader is None or self.author is None:
+            raise ValueError(
+                'В базе нет данных: запустите generate_fake_data '
+                'или используйте --generate'
+            )
+        self.recipe_ids = list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)[:SAMPLE_SIZE])
+        self.own_recipe_id = Recipe.objects.filter(
+            author=self.author
+        ).order_by('-pub_date', '-id').values_list('id', flat=True).first()
+        self.author_ids = [
+            author_id for author_id, _ in self.count_by(
+                Recipe, 'author_id'
+            )[:SAMPLE_SIZE]
+        ]
+        self.tag_slugs = list(
+            Tag.objects.order_by('id').values_list('slug', flat=True)
+        )
+        self.tag_ids = list(
+            Tag.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.ingredient_ids = list(Ingredient.objects.order_by(
+            'id'
+        ).values_list('id', flat=True)[:RECIPE_INGREDIENTS * 2])
+        self.ingredient_prefixes = [
+            name[:3] for name in Ingredient.objects.order_by(
+                'id'
+            ).values_list('name', flat=True)[:SAMPLE_SIZE]
+        ]
+        self.search_terms = [
+            max(name.split(), key=len) for name in Recipe.objects.filter(
+                id__in=self.recipe_ids
+            ).order_by('id').values_list('name', flat=True)
+        ]
+        self.image = make_image()
+
+    @staticmethod
+    def count_by(model, field):
+        return model.objects.values_list(field).annotate(
+            count=Count('id')
+        ).order_by('-count', field)
+
+    def get_top_user(self, model, field):
+        """Пользователь с наибольшим числом строк model."""
+        row = self.count_by(model, field).first()
+        return row and User.objects.get(id=row[0])
+
+    def get_client(self, user):
+        client = APIClient(HTTP_HOST=get_host())
+        if user != 'anonymous':
+            token, _ = Token.objects.get_or_create(user=getattr(self, user))
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def get_recipe_data(self, number):
+        """Тело создания или изменения рецепта; чётные и нечётные номера
+        отличаются набором ингредиентов."""
+        shift = number % 2 * RECIPE_INGREDIENTS // 2
+        ingredient_ids = self.ingredient_ids[
+            shift:shift + RECIPE_INGREDIENTS
+        ]
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': number % 100 + 1}
+                for ingredient_id in ingredient_ids
+            ],
+            'tags': self.tag_ids[:2],
+            'image': self.image,
+            'name': f'Бенчмарк {number}',
+            'text': 'Рецепт для замера производительности',
+            'cooking_time': number % 60 + 1,
+        }
+
+
+def rotate(items, number):
+    return items[number % len(items)]
+
+
+SCENARIOS = (
+    Scenario(
+        'recipes-anonymous', 'get', 'anonymous',
+        lambda context, number: ('/api/recipes/', None)
+    ),
+    Scenario(
+        'recipes-anonymous-uncached', 'get', 'anonymous',
+        lambda context, number: ('/api/recipes/', None), cold=True
+    ),
+    Scenario(
+        'recipes-authenticated', 'get', 'reader',
+        lambda context, number: ('/api/recipes/', None)
+    ),
+    Scenario(
+        'recipes-tags', 'get', 'reader',
+        lambda context, number: ('/api/recipes/', {
+            'tags': [rotate(context.tag_slugs, number),
+                     rotate(context.tag_slugs, number + 1)]
+        })
+    ),
+    Scenario(
+        'recipes-author', 'get', 'reader',
+        lambda context, number: ('/api/recipes/', {
+            'author': rotate(context.author_ids, number)
+        })
+    ),
+    Scenario(
+        'recipes-favorited', 'get', 'reader',
+        lambda context, number: ('/api/recipes/', {'is_favorited': 1})
+    ),
+    Scenario(
+        'recipes-in-shopping-cart', 'get', 'reader',
+        lambda context, number: (
+            '/api/recipes/', {'is_in_shopping_cart': 1}
+        )
+    ),
+    Scenario(
+        'recipes-search', 'get', 'reader',
+        lambda context, number: ('/api/recipes/', {
+            'search': rotate(context.search_terms, number)
+        })
+    ),
+    Scenario(
+        'recipe-detail', 'get', 'reader',
+        lambda context, number: (
+            f'/api/recipes/{rotate(context.recipe_ids, number)}/', None
+        )
+    ),
+    Scenario(
+        'ingredients-search', 'get', 'anonymous',
+        lambda context, number: ('/api/ingredients/', {
+            'name': rotate(context.ingredient_prefixes, number)
+        })
+    ),
+    Scenario(
+        'subscriptions', 'get', 'reader',
+        lambda context, number: (
+            '/api/users/subscriptions/', {'recipes_limit': 3}
+        )
+    ),
+    Scenario(
+        'recipe-create', 'post', 'author',
+        lambda context, number: (
+            '/api/recipes/', context.get_recipe_data(number)
+        ),
+        status=201
+    ),
+    Scenario(
+        'recipe-update', 'patch', 'author',
+        lambda context, number: (
+            f'/api/recipes/{context.own_recipe_id}/',
+            context.get_recipe_data(number)
+        )
+    ),
+    Scenario(
+        'shopping-cart-txt', 'get', 'reader',
+        lambda context, number: (
+            '/api/recipes/download_shopping_cart/', {'format': 'txt'}
+        )
+    ),
+    Scenario(
+        'shopping-cart-pdf', 'get', 'reader',
+        lambda context, number: (
+            '/api/recipes/download_shopping_cart/', {'format': 'pdf'}
+        )
+    ),
+)
+
+
+class QueryTimer:
+    """Обёртка выполнения SQL: количество запросов и их общее время."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+def send(client, scenario, context, number):
+    """Выполняет запрос и читает ответ целиком, включая потоковый."""
+    path, data = scenario.get_request(context, number)
+    if scenario.method == 'get':
+        response = client.get(path, data)
+    else:
+        response = getattr(client, scenario.method)(path, data, format='json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    if response.status_code != scenario.status:
+        raise ValueError(
+            f'{scenario.name}: {path} вернул {response.status_code}'
+        )
+    return response
+
+
+def run_scenario(scenario, context, repeat, warmup):
+    """Задержка и SQL по repeat запросам, пик памяти - по отдельному
+    запросу: tracemalloc заметно замедляет выполнение."""
+    client = context.get_client(scenario.user)
+    gc.collect()
+    for number in range(warmup):
+        send(client, scenario, context, number)
+    timings, query_counts, query_times = [], [], []
+    for number in range(warmup, warmup + repeat):
+        if scenario.cold:
+            bump_recipes_version()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            send(client, scenario, context, number)
+            timings.append((time.perf_counter() - started) * 1000)
+        query_counts.append(timer.count)
+        query_times.append(timer.time * 1000)
+    if scenario.cold:
+        bump_recipes_version()
+    tracemalloc.start()
+    try:
+        send(client, scenario, context, warmup + repeat)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'queries': max(query_counts),
+        'sql_ms': round(statistics.median(query_times), 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def get_dataset():
+    """Размер данных: базовые замеры сравнимы только на тех же данных."""
+    return {
+        'vendor': connection.vendor,
+        'users': User.objects.count(),
+        'recipes': Recipe.objects.count(),
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """Сценарии, ставшие хуже базовых замеров больше чем на threshold
+    (доля); количество SQL-запросов не должно расти вовсе."""
+    regressions = []
+    tolerances = {
+        'p50_ms': LATENCY_TOLERANCE_MS,
+        'p95_ms': LATENCY_TOLERANCE_MS,
+        'peak_kib': MEMORY_TOLERANCE_KIB,
+    }
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{name}: queries {base["queries"]} -> {result["queries"]}'
+            )
+        for metric in COMPARED_METRICS:
+            limit = max(
+                base[metric] * (1 + threshold),
+                base[metric] + tolerances[metric]
+            )
+            if result[metric] > limit:
+                regressions.append(
+                    f'{name}: {metric} {base[metric]} -> {result[metric]}'
+                )
+    return regressions
@@ -0,0 +1,85 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+RECIPES_VERSION_KEY = 'recipes:version'
+# Параметры, с которыми ответ кэшируется; с любыми другими - нет.
+CACHED_QUERY_PARAMS = frozenset((
+    'author', 'cursor', 'is_favorited', 'is_in_shopping_cart', 'limit',
+    'page', 'search', 'tags'
+))
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE]
+
+
+def get_version(key):
+    """Текущая версия набора данных, общая для всех процессов."""
+    version = get_cache().get(key)
+    if version is None:
+        get_cache().add(key, time.time_ns(), None)
+        version = get_cache().get(key)
+    return version
+
+
+def bump_version(key):
+    """Делает недействительным всё, что построено по прежней версии."""
+    try:
+        get_cache().incr(key)
+    except ValueError:
+        get_cache().set(key, time.time_ns(), None)
+
+
+def get_recipes_version():
+    return get_version(RECIPES_VERSION_KEY)
+
+
+def bump_recipes_version():
+    bump_version(RECIPES_VERSION_KEY)
+
+
+def get_response_key(request, view):
+    """Ключ кэша по действию, объекту, адресу сайта и всем параметрам
+    запроса: в ответе абсолютные ссылки на картинки и соседние страницы,
+    построенные по ним. None - ответ не кэшируется."""
+    if not CACHED_QUERY_PARAMS.issuperset(request.query_params):
+        return None
+    query = urlencode(sorted(
+        (param, value)
+        for param in request.query_params
+        for value in request.query_params.getlist(param)
+    ))
+    lookup = view.kwargs.get(view.lookup_url_kwarg or view.lookup_field, '')
+    digest = hashlib.md5(
+        f'{view.action}:{lookup}:{request.scheme}://{request.get_host()}:'
+        f'{query}'.encode()
+    ).hexdigest()
+    return f'recipes:response:{get_recipes_version()}:{digest}'
+
+
+def cache_anonymous(method):
+    """Кэширует успешные ответы действия для анонимных пользователей."""
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return method(view, request, *args, **kwargs)
+        key = get_response_key(request, view)
+        if key is None:
+            return method(view, request, *args, **kwargs)
+        data = get_cache().get(key)
+        if data is not None:
+            return Response(data)
+        response = method(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            get_cache().set(
+                key, response.data, settings.RESPONSE_CACHE_TIMEOUT
+            )
+        return response
+    return wrapper
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Кэши, у которых каждый процесс видит только свои записи.
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+SHARED_CACHE_SETTINGS = ('RESPONSE_CACHE', 'RECIPE_STATE_CACHE')
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    """Версии снимков справочников, кэша ответов и наборов состояния
+    меняют другие процессы (воркеры, load_ingredients, load_tags):
+    при кэше в памяти процесса изменения до воркеров не доходят."""
+    warnings = []
+    for name in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, name)
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend in PROCESS_LOCAL_BACKENDS:
+            warnings.append(Warning(
+                f'{name}: кэш {alias!r} ({backend}) не общий для процессов',
+                hint=(
+                    'Задайте CACHE_BACKEND с общим хранилищем: '
+                    'memcached (PyMemcacheCache).'
+                ),
+                id='api.W001',
+            ))
+    return warnings
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.utils import iter_export
+from recipes.models import ShoppingListExport
+from recipes.shopping_list import iter_shopping_list
+
+logger = logging.getLogger(__name__)
+
+
+def get_content_hash(user_id, file_format):
+    """Хэш содержимого списка покупок: по нему узнаём, что файл
+    для неизменившейся корзины уже сформирован."""
+    digest = hashlib.sha256(f'{user_id}:{file_format}'.encode())
+    for item in iter_shopping_list(user_id):
+        digest.update(
+            '\n{name}\t{measurement_unit}\t{amount}'.format(**item).encode()
+        )
+    return digest.hexdigest()
+
+
+def enqueue_export(user, file_format):
+    """Задание на выгрузку текущего списка покупок.
+
+    Если корзина не менялась, возвращается уже существующее задание
+    (готовое или ожидающее), новый файл не формируется.
+    """
+    job, created = ShoppingListExport.objects.get_or_create(
+        user=user,
+        file_format=file_format,
+        content_hash=get_content_hash(user.id, file_format)
+    )
+    missing = (
+        job.status == ShoppingListExport.DONE
+        and not job.file.storage.exists(job.file.name)
+    )
+    if job.status == ShoppingListExport.FAILED or missing:
+        job.status = ShoppingListExport.PENDING
+        job.error = ''
+        job.save(update_fields=('status', 'error', 'updated'))
+        created = True
+    if created:
+        transaction.on_commit(lambda: get_runner().submit(job.id))
+    return job
+
+
+def claim_job(job_id=None):
+    """Переводит одно ожидающее задание в работу и возвращает его.
+
+    Задания, зависшие в работе дольше SHOPPING_LIST_EXPORT_STALE
+    (например, после падения воркера), берутся повторно.
+    """
+    stale = timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_EXPORT_STALE
+    )
+    jobs = ShoppingListExport.objects.filter(
+        Q(status=ShoppingListExport.PENDING)
+        | Q(status=ShoppingListExport.RUNNING, updated__lt=stale)
+    )
+    if job_id is not None:
+        jobs = jobs.filter(id=job_id)
+    with transaction.atomic():
+        job = jobs.select_for_update(skip_locked=True).order_by(
+            'created'
+        ).first()
+        if job is None:
+            return None
+        # Условное обновление: на базах без SELECT ... FOR UPDATE
+        # задание достанется только одному воркеру.
+        claimed = ShoppingListExport.objects.filter(
+            id=job.id, status=job.status, updated=job.updated
+        ).update(status=ShoppingListExport.RUNNING, updated=timezone.now())
+    if not claimed:
+        return None
+    job.status = ShoppingListExport.RUNNING
+    return job
+
+
+def render_job(job):
+    """Формирует файл задания и удаляет прежние выгрузки пользователя
+    в том же формате."""
+    try:
+        with SpooledTemporaryFile(
+            max_size=settings.PDF_SPOOL_MAX_SIZE
+        ) as output:
+            for chunk in iter_export(
+                iter_shopping_list(job.user_id), job.file_format
+            ):
+                output.write(chunk)
+            output.seek(0)
+            # Имя случайное: по хэшу содержимого его можно было бы
+            # вычислить.
+            job.file.save(
+                f'{secrets.token_urlsafe(32)}.{job.file_format}',
+                File(output),
+                save=False
+            )
+    except Exception as error:
+        logger.exception('Не удалось сформировать выгрузку %s', job.id)
+        job.status = ShoppingListExport.FAILED
+        job.error = str(error)
+        job.save(update_fields=('status', 'error', 'updated'))
+        return job
+    job.status = ShoppingListExport.DONE
+    job.save(update_fields=('status', 'file', 'updated'))
+    previous = ShoppingListExport.objects.filter(
+        user_id=job.user_id,
+        file_format=job.file_format,
+        status__in=(ShoppingListExport.DONE, ShoppingListExport.FAILED)
+    ).exclude(id=job.id)
+    for old in previous:
+        old.file.delete(save=False)
+        old.delete()
+    return job
+
+
+def run_job(job_id=None):
+    """Выполняет задание job_id или первое из очереди.
+    Возвращает задание или None, если выполнять нечего."""
+    job = claim_job(job_id)
+    if job is not None:
+        render_job(job)
+    return job
+
+
+def work(interval, once=False):
+    """Цикл воркера: берёт задания из очереди, пока она не пуста;
+    once - выйти, когда заданий не осталось."""
+    try:
+        while True:
+            if run_job() is None:
+                if once:
+                    return
+                time.sleep(interval)
+    finally:
+        connection.close()
+
+
+class ThreadRunner:
+    """Выполняет задания в пуле потоков процесса веб-сервера."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def run(self, job_id):
+        try:
+            run_job(job_id)
+        except Exception:
+            logger.exception('Ошибка выполнения выгрузки %s', job_id)
+        finally:
+            connection.close()
+
+    def submit(self, job_id):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='shopping-list-export'
+                )
+        self.executor.submit(self.run, job_id)
+
+
+class DatabaseRunner:
+    """Задания остаются в очереди в базе, их выполняет
+    management-команда run_export_jobs."""
+
+    def submit(self, job_id):
+        pass
+
+
+runner = None
+
+
+def get_runner():
+    global runner
+    if runner is None:
+        if settings.SHOPPING_LIST_EXPORT_RUNNER == 'db':
+            runner = DatabaseRunner()
+        else:
+            runner = ThreadRunner(settings.SHOPPING_LIST_EXPORT_WORKERS)
+    return runner
@@ -1,13 +1,17 @@
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.exceptions import ValidationError
+
+from api.pagination import KeysetPagination
 
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 User = get_user_model()
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='startswith')
+    name = filters.CharFilter(lookup_expr='istartswith')
 
     class Meta:
         model = Ingredient
@@ -23,6 +27,7 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -37,3 +42,15 @@ class RecipeFilter(FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shoppingcart__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Результаты поиска упорядочены по релевантности, а курсор -
+        по дате: вместе они пропускали бы и повторяли рецепты."""
+        if not value.strip():
+            return queryset
+        if KeysetPagination.cursor_query_param in self.request.query_params:
+            raise ValidationError({
+                'cursor': 'Поиск выводится постранично по номеру '
+                          'страницы (page), курсор не поддерживается.'
+            })
+        return search_recipes(queryset, value)
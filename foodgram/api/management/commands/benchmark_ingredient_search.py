@@ -0,0 +1,74 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.autocomplete import search_ingredients
+from api.serializer import IngredientSerializer
+from recipes.models import Ingredient
+
+
+# python3 manage.py benchmark_ingredient_search - задержка автодополнения
+# ингредиентов по сравнению с фильтром name__startswith
+
+
+def percentile(timings, share):
+    return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+
+class Command(BaseCommand):
+    """Команда для замера задержки поиска ингредиентов"""
+
+    help = 'Сравнение задержки фильтра startswith и автодополнения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def make_queries(self, names, count, rnd):
+        queries = []
+        for _ in range(count):
+            name = rnd.choice(names)
+            kind = rnd.random()
+            if kind < 0.7:
+                queries.append(name[:rnd.randint(1, min(len(name), 6))])
+            elif kind < 0.85 and len(name) > 4:
+                start = rnd.randint(1, len(name) - 3)
+                queries.append(name[start:start + 3])
+            else:
+                position = rnd.randrange(len(name))
+                queries.append(
+                    name[:position] + rnd.choice('аеиоу') + name[position:]
+                )
+        return queries
+
+    def measure(self, search, queries):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        return sorted(timings)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('Каталог ингредиентов пуст')
+        queries = self.make_queries(
+            names, options['queries'], random.Random(options['seed'])
+        )
+
+        def current(query):
+            return IngredientSerializer(
+                Ingredient.objects.filter(name__startswith=query), many=True
+            ).data
+
+        search_ingredients(queries[0])
+        for title, search in (
+            ('startswith', current), ('автодополнение', search_ingredients)
+        ):
+            timings = self.measure(search, queries)
+            self.stdout.write(
+                f'{title:15} p50={percentile(timings, 0.5):.3f} мс '
+                f'p99={percentile(timings, 0.99):.3f} мс'
+            )
@@ -0,0 +1,51 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from api.utils import register_fonts, shopping_list_response
+
+
+# python3 manage.py benchmark_shopping_list_pdf - время, память и размер
+# PDF списка покупок для 10, 100 и 1000 строк
+
+
+class Command(BaseCommand):
+    """Команда для замера генерации PDF списка покупок"""
+
+    help = 'Замер генерации PDF списка покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lines', type=int, nargs='+', default=(10, 100, 1000)
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        register_fonts()
+        for lines in options['lines']:
+            ingredients = [
+                {
+                    'name': f'Ингредиент номер {number}',
+                    'measurement_unit': 'г',
+                    'amount': number,
+                }
+                for number in range(lines)
+            ]
+            timings = []
+            peak = size = 0
+            for _ in range(options['repeat']):
+                tracemalloc.start()
+                started = time.perf_counter()
+                response = shopping_list_response(
+                    ingredients, 'pdf', 'application/pdf'
+                )
+                size = sum(len(chunk) for chunk in response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            self.stdout.write(
+                f'{lines:6} строк: {min(timings):8.1f} мс, '
+                f'пик памяти {peak / 1024:8.0f} КиБ, '
+                f'файл {size / 1024:.0f} КиБ'
+            )
@@ -0,0 +1,120 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.benchmarks import (SCENARIOS, BenchmarkContext, find_regressions,
+                            get_dataset, run_scenario)
+from recipes.fake_data import FakeDataGenerator
+
+
+# python3 manage.py run_benchmarks --save - замер задержки, SQL-запросов
+# и памяти основных запросов API со сравнением с базовыми замерами
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """Команда для замера производительности запросов API"""
+
+    help = ('Замер p50/p95, SQL и пика памяти запросов API через '
+            'тестовый клиент; изменения в базе откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', nargs='+',
+            choices=[scenario.name for scenario in SCENARIOS]
+        )
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--baseline', type=Path, default=settings.BENCHMARK_BASELINE
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Записать результаты как новые базовые замеры'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=settings.BENCHMARK_THRESHOLD,
+            help='Допустимое ухудшение, доля (0.2 - 20%%)'
+        )
+        parser.add_argument(
+            '--generate', action='store_true',
+            help='Сгенерировать данные generate_fake_data перед замером'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                results = self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+        except ValueError as error:
+            raise CommandError(error)
+        if options['save']:
+            options['baseline'].parent.mkdir(parents=True, exist_ok=True)
+            options['baseline'].write_text(json.dumps(
+                results, ensure_ascii=False, indent=2
+            ))
+            self.stdout.write(f'Базовые замеры: {options["baseline"]}')
+            return
+        self.compare(results, options)
+
+    def run(self, options):
+        if options['generate']:
+            FakeDataGenerator(seed=options['seed']).generate(
+                users=options['users'], recipes=options['recipes']
+            )
+        dataset = get_dataset()
+        context = BenchmarkContext()
+        results = {}
+        for scenario in SCENARIOS:
+            if options['only'] and scenario.name not in options['only']:
+                continue
+            result = run_scenario(
+                scenario, context, options['repeat'], options['warmup']
+            )
+            results[scenario.name] = result
+            self.stdout.write(
+                f'{scenario.name:28} p50={result["p50_ms"]:.2f} мс '
+                f'p95={result["p95_ms"]:.2f} мс '
+                f'sql={result["queries"]}/{result["sql_ms"]:.2f} мс '
+                f'peak={result["peak_kib"]:.0f} КиБ'
+            )
+        return {
+            'created': timezone.now().isoformat(),
+            'dataset': dataset,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+
+    def compare(self, results, options):
+        if not options['baseline'].exists():
+            self.stdout.write(
+                'Базовых замеров нет, сравнение пропущено (--save)'
+            )
+            return
+        baseline = json.loads(options['baseline'].read_text())
+        if baseline['dataset'] != results['dataset']:
+            self.stderr.write(
+                f'Данные отличаются от базовых: {baseline["dataset"]}, '
+                f'сейчас {results["dataset"]}'
+            )
+        regressions = find_regressions(
+            results['results'], baseline['results'], options['threshold']
+        )
+        if regressions:
+            raise CommandError(
+                'Ухудшение относительно базовых замеров:\n'
+                + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
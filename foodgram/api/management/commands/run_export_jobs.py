@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.exports import work
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания на выгрузку списка покупок из очереди в базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.SHOPPING_LIST_EXPORT_WORKERS
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Пауза в секундах, когда очередь пуста'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Завершиться, когда очередь опустеет'
+        )
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [
+                pool.submit(work, options['interval'], options['once'])
+                for _ in range(options['workers'])
+            ]
+            for future in futures:
+                future.result()
+        self.stdout.write(self.style.SUCCESS('Очередь выгрузок пуста'))
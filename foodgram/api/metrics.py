@@ -0,0 +1,278 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from hmac import compare_digest
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (
+    256, 1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024,
+    4 * 1024 * 1024
+)
+REQUESTS_TOTAL = 'foodgram_requests_total'
+ARCHIVE_NAME = 'archive.json'
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': (
+        'Полное время обработки запроса', DURATION_BUCKETS
+    ),
+    'foodgram_request_db_seconds': (
+        'Время SQL-запросов за запрос', DURATION_BUCKETS
+    ),
+    'foodgram_request_db_queries': (
+        'Количество SQL-запросов за запрос', QUERY_BUCKETS
+    ),
+    'foodgram_request_serialize_seconds': (
+        'Время рендеринга ответа', DURATION_BUCKETS
+    ),
+    'foodgram_response_size_bytes': (
+        'Размер тела ответа', SIZE_BUCKETS
+    ),
+}
+
+
+class MetricsStore:
+    """Счётчики и гистограммы процесса с общим хранилищем в файлах.
+
+    Каждый процесс (воркер gunicorn) копит значения в памяти и не чаще
+    раза в METRICS_FLUSH_INTERVAL секунд записывает их в свой файл
+    METRICS_DIR/<pid>.json; /metrics складывает файлы всех процессов.
+    Значения завершившихся воркеров переносятся в общий archive.json,
+    а их файлы удаляются: счётчики остаются накопительными.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def reset(self):
+        """Начинает с файла своего pid, если он остался от процесса
+        с тем же номером: счётчики не должны уменьшаться."""
+        self.pid = os.getpid()
+        self.flushed = time.monotonic()
+        self.counters, self.histograms = read_file(self.get_path())
+
+    def get_path(self):
+        return Path(settings.METRICS_DIR) / f'{self.pid}.json'
+
+    def check_pid(self):
+        # После fork (gunicorn --preload) значения родителя не нужны.
+        if self.pid != os.getpid():
+            self.reset()
+
+    def observe(self, view, status, values):
+        """values - {имя гистограммы: значение}."""
+        with self.lock:
+            self.check_pid()
+            key = (view, str(status))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            for name, value in values.items():
+                buckets = HISTOGRAMS[name][1]
+                counts, total = self.histograms.get(
+                    (name, view), ([0] * (len(buckets) + 1), 0)
+                )
+                counts[bisect_left(buckets, value)] += 1
+                self.histograms[name, view] = counts, total + value
+            if (time.monotonic() - self.flushed
+                    >= settings.METRICS_FLUSH_INTERVAL):
+                self.flush()
+
+    def flush(self):
+        self.check_pid()
+        self.flushed = time.monotonic()
+        write_file(self.get_path(), self.counters, self.histograms)
+
+    def flush_safely(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                self.flush()
+
+    def close(self):
+        """При остановке воркера его значения уходят в архив."""
+        with self.lock:
+            if self.pid == os.getpid():
+                self.flush()
+                archive([self.get_path()])
+
+
+def write_file(path, counters, histograms):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix('.tmp')
+    temp_path.write_text(json.dumps({
+        'counters': [
+            [view, status, value]
+            for (view, status), value in counters.items()
+        ],
+        'histograms': [
+            [name, view, counts, total]
+            for (name, view), (counts, total) in histograms.items()
+        ],
+    }))
+    os.replace(temp_path, path)
+
+
+def read_file(path):
+    """Значения из файла процесса; битый или отсутствующий - пустые."""
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}, {}
+    return (
+        {(view, status): value for view, status, value in data['counters']},
+        {
+            (name, view): (counts, total)
+            for name, view, counts, total in data['histograms']
+            if name in HISTOGRAMS
+            and len(counts) == len(HISTOGRAMS[name][1]) + 1
+        },
+    )
+
+
+def merge(counters, histograms, path):
+    """Добавляет к counters и histograms значения из файла."""
+    file_counters, file_histograms = read_file(path)
+    for key, value in file_counters.items():
+        counters[key] = counters.get(key, 0) + value
+    for key, (counts, total) in file_histograms.items():
+        summed, summed_total = histograms.get(key, ([0] * len(counts), 0))
+        histograms[key] = (
+            [a + b for a, b in zip(summed, counts)], summed_total + total
+        )
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def archive(paths):
+    """Переносит значения файлов в archive.json и удаляет файлы.
+
+    Блокировка не даёт двум процессам одновременно переписать архив
+    и учесть один файл дважды.
+    """
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'archive.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        paths = [path for path in paths if path.exists()]
+        if not paths:
+            return
+        archive_path = directory / ARCHIVE_NAME
+        counters, histograms = read_file(archive_path)
+        for path in paths:
+            merge(counters, histograms, path)
+        write_file(archive_path, counters, histograms)
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+
+def find_dead():
+    """Файлы процессов, которые завершились, не успев их архивировать
+    (например, убитых по таймауту)."""
+    return [
+        path for path in Path(settings.METRICS_DIR).glob('*.json')
+        if path.stem.isdigit() and not is_alive(int(path.stem))
+    ]
+
+
+def collect():
+    """Сумма значений всех процессов."""
+    store.flush_safely()
+    dead = find_dead()
+    if dead:
+        archive(dead)
+    counters, histograms = {}, {}
+    for path in sorted(Path(settings.METRICS_DIR).glob('*.json')):
+        merge(counters, histograms, path)
+    return counters, histograms
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(counters, histograms):
+    """Текстовый формат Prometheus."""
+    lines = [
+        f'# HELP {REQUESTS_TOTAL} Количество запросов',
+        f'# TYPE {REQUESTS_TOTAL} counter',
+    ]
+    for (view, status), value in sorted(counters.items()):
+        lines.append(
+            f'{REQUESTS_TOTAL}{{view="{escape(view)}",status="{status}"}} '
+            f'{value}'
+        )
+    for name, (documentation, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, view), (counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            label = f'view="{escape(view)}"'
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{label},le="{format_number(bound)}"}} '
+                    f'{cumulative}'
+                )
+            lines.append(f'{name}_sum{{{label}}} {format_number(total)}')
+            lines.append(f'{name}_count{{{label}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_allowed(request):
+    """Prometheus передаёт METRICS_TOKEN в заголовке
+    Authorization: Bearer; сотрудники видят метрики со своим токеном
+    или сессией."""
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, value = header.partition(' ')
+    if (
+        settings.METRICS_TOKEN and scheme == 'Bearer'
+        and compare_digest(value.encode(), settings.METRICS_TOKEN.encode())
+    ):
+        return True
+    if request.user.is_staff:
+        return True
+    try:
+        credentials = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return credentials is not None and credentials[0].is_staff
+
+
+def metrics_view(request):
+    """Метрики всех воркеров для Prometheus. Наружу через nginx
+    не публикуется: Prometheus забирает их из сети docker."""
+    if not is_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(*collect()), content_type=CONTENT_TYPE)
+
+
+store = MetricsStore()
+# Значения последних секунд перед остановкой воркера переносятся в архив.
+atexit.register(store.close)
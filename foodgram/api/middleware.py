@@ -0,0 +1,222 @@
+import logging
+import random
+import time
+from hmac import compare_digest
+
+import structlog
+from django.conf import settings
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.metrics import store
+from api.profiling import ProfileSession
+from recipes.models import RequestProfile
+
+UNRESOLVED_VIEW = 'unresolved'
+
+logger = structlog.wrap_logger(
+    logging.getLogger(__name__),
+    processors=[
+        structlog.stdlib.filter_by_level,
+        structlog.processors.TimeStamper(fmt='iso', utc=True),
+        structlog.processors.JSONRenderer(ensure_ascii=False),
+    ],
+    wrapper_class=structlog.stdlib.BoundLogger,
+    cache_logger_on_first_use=True,
+)
+
+
+def get_view_name(view_func, method):
+    """Имя вида «RecipeViewSet.list»: класс и действие, для функций -
+    их имя. Неизвестные методы сводятся к other, чтобы число меток
+    в метриках не зависело от запросов."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', type(view_func).__name__)
+    actions = getattr(view_func, 'actions', None)
+    if actions is not None:
+        return f'{cls.__name__}.{actions.get(method, "other")}'
+    if method not in cls.http_method_names:
+        method = 'other'
+    return f'{cls.__name__}.{method}'
+
+
+class RequestTimer:
+    """Замеры одного запроса: SQL через execute_wrapper, рендеринг -
+    от process_template_response до конца render()."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = UNRESOLVED_VIEW
+        self.queries = 0
+        self.db_time = 0
+        self.render_started = None
+        self.render_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.stop_render)
+
+    def stop_render(self, response):
+        self.render_time = time.perf_counter() - self.render_started
+
+
+def get_response_size(response):
+    """Размер тела; у потоковых ответов известен только из заголовка."""
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length else None
+    return len(response.content)
+
+
+class PerformanceMiddleware:
+    """Время запроса, SQL, рендеринг и размер ответа по видам.
+
+    Замеры уходят в заголовок Server-Timing, строкой JSON в лог
+    api.middleware и в гистограммы для /metrics (api.metrics).
+    Подключается первым, чтобы учитывать всю обработку запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = request.performance_timer = RequestTimer()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - timer.started
+        size = get_response_size(response)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'total;dur={duration * 1000:.1f}, '
+                f'db;dur={timer.db_time * 1000:.1f};'
+                f'desc="{timer.queries} queries", '
+                f'serialize;dur={timer.render_time * 1000:.1f}'
+            )
+        values = {
+            'foodgram_request_duration_seconds': duration,
+            'foodgram_request_db_seconds': timer.db_time,
+            'foodgram_request_db_queries': timer.queries,
+            'foodgram_request_serialize_seconds': timer.render_time,
+        }
+        if size is not None:
+            values['foodgram_response_size_bytes'] = size
+        store.observe(timer.view, response.status_code, values)
+        logger.info(
+            'request',
+            view=timer.view,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+            duration_ms=round(duration * 1000, 2),
+            db_queries=timer.queries,
+            db_ms=round(timer.db_time * 1000, 2),
+            serialize_ms=round(timer.render_time * 1000, 2),
+            size=size,
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance_timer.view = get_view_name(
+            view_func, request.method.lower()
+        )
+
+    def process_template_response(self, request, response):
+        request.performance_timer.start_render(response)
+        return response
+
+
+class ProfilingMiddleware:
+    """Профиль запроса с журналом SQL и EXPLAIN самых долгих запросов.
+
+    Заголовок X-Profile от сотрудника (сессия админки или токен API)
+    или со значением PROFILE_TOKEN включает cProfile; номер профиля
+    возвращается в X-Profile-Id. Доля PROFILE_SAMPLE_RATE остальных
+    запросов профилируется выборкой стека, а сохраняется, только если
+    запрос дольше PROFILE_SLOW_THRESHOLD секунд. Профили смотрят и
+    скачивают в админке (RequestProfile).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_saved = None
+
+    def __call__(self, request):
+        trigger = self.get_trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        session = request.profile_session = ProfileSession(trigger)
+        with session.active():
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                session, request, response, response.streaming_content
+            )
+        else:
+            profile = self.save(session, request, response)
+            if profile is not None and trigger == RequestProfile.HEADER:
+                response['X-Profile-Id'] = profile.id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        session = getattr(request, 'profile_session', None)
+        if session is not None:
+            session.view = get_view_name(view_func, request.method.lower())
+
+    def get_trigger(self, request):
+        value = request.META.get('HTTP_X_PROFILE')
+        if value and self.is_allowed(request, value):
+            return RequestProfile.HEADER
+        if (
+            settings.PROFILE_SAMPLE_RATE
+            and random.random() < settings.PROFILE_SAMPLE_RATE
+            and (
+                self.slow_saved is None
+                or time.monotonic() - self.slow_saved
+                >= settings.PROFILE_SLOW_COOLDOWN
+            )
+        ):
+            return RequestProfile.SLOW
+        return None
+
+    @staticmethod
+    def is_allowed(request, value):
+        if settings.PROFILE_TOKEN and compare_digest(
+            value.encode(), settings.PROFILE_TOKEN.encode()
+        ):
+            return True
+        if request.user.is_staff:
+            return True
+        try:
+            credentials = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+    def stream(self, session, request, response, content):
+        """Тело потокового ответа формируется при отдаче: профилируем
+        и его, а сохраняем после последнего куска."""
+        try:
+            with session.active():
+                yield from content
+        finally:
+            self.save(session, request, response)
+
+    def save(self, session, request, response):
+        if session.trigger == RequestProfile.SLOW:
+            if session.elapsed < settings.PROFILE_SLOW_THRESHOLD:
+                return None
+            # Не больше одного профиля медленного запроса за
+            # PROFILE_SLOW_COOLDOWN: при общей деградации профили
+            # похожи, а их запись нагружает базу.
+            self.slow_saved = time.monotonic()
+        return session.save(request, response)
@@ -1,8 +1,198 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from django.conf import settings
 
 
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по курсору (keyset).
+
+    Страница выбирается условием на ключ сортировки последней записи
+    предыдущей страницы, поэтому время ответа не зависит от глубины
+    и не требует COUNT(*). Ключ сортировки берётся из атрибута
+    cursor_ordering представления, все поля - по убыванию.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = settings.PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    @staticmethod
+    def get_field(queryset, name):
+        """Поле ключа: поле модели или аннотация запроса."""
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        """Позиция и направление из курсора. Значения приводятся
+        к типам полей ключа: подделанный курсор - 404, а не ошибка
+        базы."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            tokens = parse.parse_qs(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'),
+                strict_parsing=True
+            )
+            position = tokens['p']
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        try:
+            for name, value in zip(self.fields, position):
+                field = self.get_field(queryset, name)
+                value = field.to_python(value)
+                field.run_validators(value)
+                values.append(value)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, instance, reverse):
+        position = [str(getattr(instance, field)) for field in self.fields]
+        querystring = parse.urlencode(
+            {'p': position, 'r': int(reverse)}, doseq=True
+        )
+        encoded = urlsafe_b64encode(querystring.encode('ascii'))
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded.decode('ascii')
+        )
+
+    def position_filter(self, position, reverse):
+        """Лексикографическое условие (a, b) < (x, y) по полям ключа."""
+        lookup = '__gt' if reverse else '__lt'
+        condition = Q()
+        for index, field in enumerate(self.fields):
+            condition |= Q(
+                **dict(zip(self.fields[:index], position[:index])),
+                **{field + lookup: position[index]}
+            )
+        return condition
+
+    def fetch(self, queryset, position, reverse, limit):
+        """Первые limit записей после позиции в порядке обхода."""
+        ordering = self.ordering
+        if reverse:
+            ordering = self.fields
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, reverse))
+        return list(queryset[:limit])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset)
+        results = self.fetch(queryset, position, reverse, page_size + 1)
+        return self.set_page(results, page_size, position, reverse)
+
+    def set_page(self, results, page_size, position, reverse):
+        page = results[:page_size]
+        has_more = len(results) > page_size
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """Keyset по нескольким запросам с общим ключом сортировки.
+
+    Страница выбирается из каждого запроса по его индексу, и страницы
+    сливаются по ключу; запись, найденная в нескольких запросах
+    (с тем же ключом), выводится один раз.
+    """
+
+    def paginate_queryset(self, querysets, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, querysets[0])
+        results = {}
+        for queryset in querysets:
+            for instance in self.fetch(
+                queryset, position, reverse, page_size + 1
+            ):
+                results.setdefault(
+                    tuple(getattr(instance, field) for field in self.fields),
+                    instance
+                )
+        # Все поля ключа - по убыванию, при обходе назад - по возрастанию.
+        results = [
+            results[key] for key in sorted(results, reverse=not reverse)
+        ]
+        return self.set_page(
+            results[:page_size + 1], page_size, position, reverse
+        )
+
+
 class CustomPagination(PageNumberPagination):
+    """Постраничный вывод по номеру страницы.
+
+    Если представление объявляет cursor_ordering и в запросе передан
+    параметр cursor (для первой страницы - пустой), используется
+    KeysetPagination.
+    """
     page_size_query_param = 'limit'
     page_size = settings.PAGE_SIZE
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if (ordering
+                and KeysetPagination.cursor_query_param
+                in request.query_params):
+            self.keyset = KeysetPagination(ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
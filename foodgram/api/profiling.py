@@ -0,0 +1,264 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from recipes.models import RequestProfile
+
+EXPLAINED_STATEMENTS = ('SELECT', 'WITH')
+
+
+@lru_cache(maxsize=None)
+def get_label(code):
+    """Подпись кадра: функция и два последних элемента пути к файлу."""
+    path = os.path.join(*Path(code.co_filename).parts[-2:])
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+
+def get_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(get_label(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+class StackSampler:
+    """Выборка стеков потоков, обрабатывающих запросы.
+
+    Один фоновый поток на процесс раз в PROFILE_SAMPLE_INTERVAL секунд
+    снимает стеки зарегистрированных потоков; пока регистраций нет,
+    он спит. Накладные расходы не зависят от числа вызовов функций,
+    поэтому выборкой профилируются запросы без явного запроса профиля.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.sessions = {}
+        self.pid = None
+
+    def add(self, thread_id, stacks):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Поток не переживает fork: запускаем свой в каждом воркере.
+                self.pid = os.getpid()
+                self.sessions = {}
+                threading.Thread(target=self.run, daemon=True).start()
+            self.sessions[thread_id] = stacks
+            self.wakeup.set()
+
+    def remove(self, thread_id):
+        with self.lock:
+            self.sessions.pop(thread_id, None)
+            if not self.sessions:
+                self.wakeup.clear()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(settings.PROFILE_SAMPLE_INTERVAL)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.sessions.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[get_stack(frame)] += 1
+
+
+class QueryLog:
+    """Обёртка выполнения SQL: время и текст запросов. Параметры
+    нужны только для EXPLAIN и в отчёт не попадают."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.time += duration
+            if len(self.queries) < settings.PROFILE_MAX_QUERIES:
+                self.queries.append((duration, sql, params, many))
+
+
+def explain(sql, params):
+    """План запроса; в отдельной транзакции, чтобы ошибка не сломала
+    транзакцию запроса."""
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params
+            )
+            return '\n'.join(
+                ' '.join(str(value) for value in row)
+                for row in cursor.fetchall()
+            )
+    except DatabaseError as error:
+        return f'EXPLAIN не выполнен: {error}'
+
+
+class ProfileSession:
+    """Профилирование одного запроса.
+
+    Для запроса по заголовку - cProfile, для выборочных - стеки
+    StackSampler. Сессия может включаться несколько раз: у потоковых
+    ответов тело (например, PDF из ReportLab) формируется уже после
+    выхода из представления.
+    """
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.view = ''
+        self.elapsed = 0
+        self.queries = QueryLog()
+        if trigger == RequestProfile.HEADER:
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = None
+            self.stacks = Counter()
+
+    @contextmanager
+    def active(self):
+        thread_id = threading.get_ident()
+        started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        else:
+            sampler.add(thread_id, self.stacks)
+        try:
+            with connection.execute_wrapper(self.queries):
+                yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+            else:
+                sampler.remove(thread_id)
+            self.elapsed += time.perf_counter() - started
+
+    def get_profile(self):
+        """Содержимое файла профиля и его текстовая сводка."""
+        if self.profiler is not None:
+            output = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=output)
+            stats.sort_stats('cumulative').print_stats(
+                settings.PROFILE_TOP_FUNCTIONS
+            )
+            return marshal.dumps(stats.stats), output.getvalue()
+        total = sum(self.stacks.values())
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                inclusive[label] += count
+        lines = [
+            f'Выборок: {total}, интервал '
+            f'{settings.PROFILE_SAMPLE_INTERVAL * 1000:g} мс',
+        ]
+        for title, counter in (
+            ('С вложенными вызовами', inclusive),
+            ('Собственное время', own),
+        ):
+            lines.append(f'\n{title}:')
+            for label, count in counter.most_common(
+                settings.PROFILE_TOP_FUNCTIONS
+            ):
+                lines.append(f'{count / total:7.1%} {count:6} {label}')
+        folded = ''.join(
+            f'{";".join(stack)} {count}\n'
+            for stack, count in self.stacks.most_common()
+        )
+        return folded.encode(), '\n'.join(lines)
+
+    def get_sql_report(self):
+        lines = [
+            f'SQL: {self.queries.count} запросов, '
+            f'{self.queries.time * 1000:.1f} мс',
+        ]
+        slowest = sorted(
+            (query for query in self.queries.queries if not query[3]
+             and query[1].lstrip().upper().startswith(EXPLAINED_STATEMENTS)),
+            key=lambda query: query[0],
+            reverse=True,
+        )[:settings.PROFILE_EXPLAIN_QUERIES]
+        for number, (duration, sql, params, _) in enumerate(slowest, 1):
+            lines.append(
+                f'\n{number}. {duration * 1000:.1f} мс\n{sql}\n'
+                f'{explain(sql, params)}'
+            )
+        lines.append('\nЖурнал SQL:')
+        lines.extend(
+            f'{duration * 1000:8.1f} мс  {sql}'
+            for duration, sql, _, _ in self.queries.queries
+        )
+        if self.queries.count > len(self.queries.queries):
+            lines.append(
+                f'... и ещё {self.queries.count - len(self.queries.queries)}'
+            )
+        return '\n'.join(lines)
+
+    def save(self, request, response):
+        """Сохраняет профиль и удаляет вышедшие за пределы хранения."""
+        profile, summary = self.get_profile()
+        user = getattr(request, 'user', None)
+        duration = self.elapsed * 1000
+        header = (
+            f'{request.method} {request.get_full_path()} -> '
+            f'{response.status_code}, {duration:.1f} мс, '
+            f'{self.view or "вид не найден"}'
+        )
+        saved = RequestProfile.objects.create(
+            user=user if user is not None and user.is_authenticated else None,
+            trigger=self.trigger,
+            method=request.method,
+            path=request.get_full_path(),
+            view=self.view[:settings.NAME_MAX_LENGTH],
+            status=response.status_code,
+            duration=duration,
+            query_count=self.queries.count,
+            query_time=self.queries.time * 1000,
+            profile_format=(
+                RequestProfile.PSTATS if self.profiler is not None
+                else RequestProfile.FOLDED
+            ),
+            profile=profile,
+            report='\n\n'.join((header, self.get_sql_report(), summary)),
+        )
+        prune_profiles()
+        return saved
+
+
+def prune_profiles():
+    """Хранятся не дольше PROFILE_RETENTION секунд и не больше
+    PROFILE_MAX_COUNT последних профилей."""
+    RequestProfile.objects.filter(
+        created__lt=timezone.now() - timedelta(
+            seconds=settings.PROFILE_RETENTION
+        )
+    ).delete()
+    extra_ids = list(RequestProfile.objects.values_list(
+        'id', flat=True
+    )[settings.PROFILE_MAX_COUNT:])
+    if extra_ids:
+        RequestProfile.objects.filter(id__in=extra_ids).delete()
+
+
+sampler = StackSampler()
@@ -0,0 +1,53 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class FileRenderer(BaseRenderer):
+    """Рендерер для выбора формата выгрузки.
+
+    Сам файл формирует представление; рендерер нужен для согласования
+    формата по ?format= и заголовку Accept. Ошибки отдаются в JSON.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class PDFRenderer(FileRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class PlainTextRenderer(FileRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(FileRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONFileRenderer(FileRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+
+FILE_RENDERERS = {
+    renderer.format: renderer
+    for renderer in (PDFRenderer, PlainTextRenderer, CSVRenderer,
+                     JSONFileRenderer)
+}
+
+
+def get_content_type(renderer):
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type += f'; charset={renderer.charset}'
+    return content_type
@@ -1,30 +1,91 @@
-import base64
+import logging
 
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.db import transaction
+from django.urls import reverse
 from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.serializers import ModelSerializer
 from rest_framework.validators import UniqueTogetherValidator
 
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListExport,
+                            ShoppingListItem, Tag)
+from recipes.images import (ImageError, check_dimensions, decode_base64,
+                            schedule_variants)
+from recipes.signals import ingredients_bulk_changed
+from recipes.user_state import get_following, mark_recipes
 from users.models import Follow, User
 
+logger = logging.getLogger(__name__)
+
 
 class Base64ImageField(serializers.ImageField):
-    """Сериализатор декодирования картинки."""
+    """Сериализатор декодирования картинки.
+
+    Размер и разрешение проверяются до полной обработки картинки.
+    При редактировании рецепта та же картинка (её URL или те же байты
+    в base64) не проверяется и не сохраняется заново: возвращается
+    текущий файл.
+    """
+
+    def get_current_file(self):
+        instance = getattr(self.parent, 'instance', None)
+        if instance is None:
+            return None
+        return getattr(instance, self.source, None) or None
+
+    def is_current_file(self, current, file):
+        try:
+            if current.storage.size(current.name) != file.size:
+                return False
+            with current.storage.open(current.name) as current_file:
+                for chunk in file.chunks():
+                    if current_file.read(len(chunk)) != chunk:
+                        return False
+            return True
+        except OSError:
+            return False
+        finally:
+            file.seek(0)
 
     def to_internal_value(self, data):
+        current = self.get_current_file()
+        if (current is not None and isinstance(data, str)
+                and data.endswith(current.url)):
+            return current
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            content_type = format[len('data:'):]
+            ext = content_type.split('/')[-1]
+            try:
+                data = decode_base64(imgstr, 'temp.' + ext, content_type)
+                check_dimensions(data)
+            except ImageError as error:
+                raise ValidationError(str(error))
+            if current is not None and self.is_current_file(current, data):
+                return current
         return super().to_internal_value(data)
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URL уменьшенных копий картинки: {ширина: url}."""
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {}
+        for width, name in variants.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[width] = url
+        return urls
+
+
 class UserSerializer(UserCreateSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
@@ -34,13 +95,14 @@ class UserSerializer(UserCreateSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, author):
+        is_subscribed = getattr(author, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
-        return (
+        return bool(
             request
             and request.user.is_authenticated
-            and Follow.objects.filter(
-                user=request.user,
-                author=author).exists()
+            and author.id in get_following(request)
         )
 
 
@@ -58,11 +120,77 @@ class IngredientSerializer(ModelSerializer):
         fields = '__all__'
 
 
+def get_objects(queryset, ids, message):
+    """Объекты по списку id одним запросом IN, в порядке ids.
+
+    Все неизвестные id попадают в одну ошибку.
+    """
+    objects = queryset.in_bulk(set(ids))
+    missing = [pk for pk in dict.fromkeys(ids) if pk not in objects]
+    if missing:
+        raise ValidationError(
+            message.format(', '.join(str(pk) for pk in missing))
+        )
+    return [objects[pk] for pk in ids]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список id, который разрешается одним запросом."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return get_objects(
+            self.child_relation.get_queryset(),
+            [self.child_relation.to_pk(item) for item in data],
+            self.child_relation.error_messages['does_not_exist_bulk']
+        )
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который при many=True проверяет все id
+    одним запросом вместо запроса на каждый id."""
+    default_error_messages = {
+        'does_not_exist_bulk': 'Объекты с id {} не существуют.',
+    }
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class IngredientInRecipeListSerializer(serializers.ListSerializer):
+    """Заменяет id ингредиентов объектами одним запросом IN."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = get_objects(
+            Ingredient.objects.all(),
+            [item['id'] for item in items],
+            'Ингредиенты с id {} не существуют.'
+        )
+        for item, ingredient in zip(items, ingredients):
+            item['id'] = ingredient
+        return items
+
+
 class IngredientInRecipeCreateSerializer(ModelSerializer):
     """Сериализатор для проверки количество ингрединта в рецепте"""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         min_value=settings.MIN_VALUE, max_value=settings.MAX_VALUE
     )
@@ -70,6 +198,7 @@ class IngredientInRecipeCreateSerializer(ModelSerializer):
     class Meta:
         model = IngredientInRecipe
         fields = ('amount', 'id')
+        list_serializer_class = IngredientInRecipeListSerializer
 
 
 class IngredientInRecipeSerializer(ModelSerializer):
@@ -84,6 +213,39 @@ class IngredientInRecipeSerializer(ModelSerializer):
         fields = ('name', 'id', 'amount', 'measurement_unit')
 
 
+class ShoppingListItemSerializer(ModelSerializer):
+    """Сериализатор для вывода сводного списка покупок."""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class ShoppingListExportSerializer(ModelSerializer):
+    """Сериализатор для задания на выгрузку списка покупок.
+
+    file - адрес скачивания готового файла, доступный только владельцу.
+    """
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShoppingListExport
+        fields = ('id', 'file_format', 'status', 'file', 'created')
+        read_only_fields = fields
+
+    def get_file(self, job):
+        if job.status != ShoppingListExport.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(reverse(
+            'api:recipes-shopping_cart_export_file',
+            kwargs={'job_id': job.id}
+        ))
+
+
 class RecipeReadSerializer(ModelSerializer):
     """Сериализатор для вывода рецепта."""
     tags = TagSerializer(many=True)
@@ -97,11 +259,12 @@ class RecipeReadSerializer(ModelSerializer):
     is_favorited = serializers.BooleanField(
         default=False, read_only=True
     )
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'text', 'image',
+            'id', 'text', 'image', 'image_variants',
             'cooking_time', 'tags', 'ingredients',
             'is_in_shopping_cart', 'is_favorited', 'name',
             'author'
@@ -112,7 +275,7 @@ class RecipeCreateSerializer(ModelSerializer):
     """Сериализатор для создания рецептов"""
     ingredients = IngredientInRecipeCreateSerializer(many=True)
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all()
     )
 
@@ -160,6 +323,16 @@ class RecipeCreateSerializer(ModelSerializer):
             )
         return value
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл большой картинки хранилище перемещает,
+            # закрываем его явно, а не при сборке мусора.
+            image = self.validated_data.get('image')
+            if isinstance(image, TemporaryUploadedFile):
+                image.close()
+
     @staticmethod
     def create_update_ingredients(ingredient_data, recipe):
         ingredient_create = []
@@ -172,6 +345,56 @@ class RecipeCreateSerializer(ModelSerializer):
             ingredient_create.append(new_ingredient)
         IngredientInRecipe.objects.bulk_create(ingredient_create)
 
+    @staticmethod
+    def diff_ingredients(ingredient_data, recipe, existing):
+        """Приводит ингредиенты рецепта к ingredient_data, удаляя,
+        изменяя и добавляя только отличающиеся строки.
+
+        existing - текущие строки {ingredient_id: IngredientInRecipe}.
+        Возвращает число затронутых строк по видам изменений.
+        """
+        new_amounts = {
+            item['id'].id: item['amount'] for item in ingredient_data
+        }
+        to_delete = [
+            item.id for ingredient_id, item in existing.items()
+            if ingredient_id not in new_amounts
+        ]
+        to_update, to_create = [], []
+        old_amounts, changed_amounts = {}, {}
+        for ingredient in ingredient_data:
+            item = existing.get(ingredient['id'].id)
+            if item is None:
+                to_create.append(IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient=ingredient['id'],
+                    amount=ingredient['amount']
+                ))
+            elif item.amount != ingredient['amount']:
+                old_amounts[item.ingredient_id] = item.amount
+                item.amount = ingredient['amount']
+                to_update.append(item)
+            else:
+                continue
+            changed_amounts[ingredient['id'].id] = ingredient['amount']
+        IngredientInRecipe.objects.filter(id__in=to_delete).delete()
+        IngredientInRecipe.objects.bulk_update(to_update, ('amount',))
+        IngredientInRecipe.objects.bulk_create(to_create)
+        # Удаление отправляет post_delete по строкам, bulk_update и
+        # bulk_create - нет: об этих строках сообщаем одним сигналом.
+        if changed_amounts:
+            ingredients_bulk_changed.send(
+                sender=IngredientInRecipe,
+                recipe_id=recipe.id,
+                old_amounts=old_amounts,
+                new_amounts=changed_amounts,
+            )
+        return {
+            'deleted': len(to_delete),
+            'updated': len(to_update),
+            'created': len(to_create),
+        }
+
     @transaction.atomic
     def create(self, validated_data):
         ingredient_data = validated_data.pop('ingredients')
@@ -183,21 +406,57 @@ class RecipeCreateSerializer(ModelSerializer):
         )
         self.create_update_ingredients(ingredient_data, recipe)
         recipe.tags.set(tags_data)
+        schedule_variants(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredient_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
-        instance.ingredients.clear()
-        instance.tags.set(tags_data)
-        self.create_update_ingredients(ingredient_data, instance)
-        return super().update(instance, validated_data)
+        if validated_data.get('image') is instance.image:
+            validated_data.pop('image')
+        image_changed = 'image' in validated_data
+        if image_changed:
+            validated_data['image_variants'] = {}
+        existing = {
+            item.ingredient_id: item
+            for item in IngredientInRecipe.objects.filter(recipe=instance)
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in existing.items()
+        }
+        write_stats = {'deleted': 0, 'updated': 0, 'created': 0}
+        new_amounts = {
+            item['id'].id: item['amount'] for item in ingredient_data
+        }
+        if new_amounts != old_amounts:
+            write_stats = self.diff_ingredients(
+                ingredient_data, instance, existing
+            )
+        tag_ids = {tag.id for tag in tags_data}
+        if tag_ids != set(instance.tags.values_list('id', flat=True)):
+            instance.tags.set(tags_data)
+            write_stats['tags'] = len(tag_ids)
+        instance = super().update(instance, validated_data)
+        if image_changed:
+            schedule_variants(instance)
+        self.write_stats = write_stats
+        logger.info(
+            'Рецепт %s обновлён, строк ингредиентов: удалено %s, '
+            'изменено %s, добавлено %s',
+            instance.id, write_stats['deleted'], write_stats['updated'],
+            write_stats['created']
+        )
+        return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
-        return RecipeReadSerializer(instance,
+        recipe = Recipe.objects.with_related().get(pk=instance.pk)
+        if request is not None:
+            mark_recipes((recipe,), request.user)
+        return RecipeReadSerializer(recipe,
                                     context=context).data
 
 
@@ -251,16 +510,34 @@ class FollowSerializer(UserSerializer):
         )
 
     def get_recipes(self, author):
-        request = self.context.get('request')
-        if request is not None:
-            limit = request.query_params.get('recipes_limit')
-        recipes = author.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes = getattr(author, 'recipe_previews', None)
+        if recipes is None:
+            recipes = author.recipes.all()
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                recipes = recipes[:limit]
         return ShortRecipeSerializer(recipes, many=True, ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    def get_recipes_count(self, author):
+        recipes_count = getattr(author, 'recipes_count', None)
+        if recipes_count is not None:
+            return recipes_count
+        return author.recipes.count()
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    """Проверка параметра recipes_limit."""
+    recipes_limit = serializers.IntegerField(
+        min_value=0, max_value=settings.RECIPES_LIMIT_MAX, required=False
+    )
+
+
+class ShoppingCartDownloadSerializer(serializers.Serializer):
+    """Проверка параметра async: выгрузка в фоне для 1, true, yes, on."""
+
+    def get_fields(self):
+        # async - ключевое слово, поле нельзя объявить атрибутом класса.
+        return {'async': serializers.BooleanField(default=False)}
 
 
 class FollowCreateSerializer(ModelSerializer):
@@ -287,6 +564,8 @@ class FollowCreateSerializer(ModelSerializer):
 
 class ShortRecipeSerializer(ModelSerializer):
     """Дополнительный сериализатор для рецептов """
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'cooking_time', 'image', 'name')
+        fields = ('id', 'cooking_time', 'image', 'image_variants', 'name')
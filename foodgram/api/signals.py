@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from api.cache import bump_recipes_version
+from api.snapshots import ingredients_snapshot, tags_snapshot
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.signals import recipes_bulk_created, reference_data_loaded
+from users.models import User
+
+# Поля пользователя в author рецепта (UserSerializer).
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(recipes_bulk_created)
+def invalidate_recipes(sender, **kwargs):
+    transaction.on_commit(bump_recipes_version)
+
+
+@receiver(pre_save, sender=User)
+def check_author_change(sender, instance, update_fields=None, **kwargs):
+    """Отмечает изменение полей автора, которые выводятся в рецептах;
+    регистрация, вход и смена пароля кэш рецептов не сбрасывают."""
+    instance.author_changed = False
+    fields = set(AUTHOR_FIELDS)
+    if update_fields is not None:
+        fields &= set(update_fields)
+    if instance.pk is None or not fields:
+        return
+    saved = User.objects.filter(pk=instance.pk).values(*fields).first()
+    instance.author_changed = saved is not None and any(
+        saved[field] != getattr(instance, field) for field in fields
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipes_on_author_change(sender, instance, **kwargs):
+    if getattr(instance, 'author_changed', False):
+        transaction.on_commit(bump_recipes_version)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(reference_data_loaded)
+def invalidate_reference_snapshot(sender, **kwargs):
+    snapshot = {Tag: tags_snapshot, Ingredient: ingredients_snapshot}[sender]
+    transaction.on_commit(snapshot.invalidate)
@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from api.cache import bump_version, get_version
+from api.serializer import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+Snapshot = namedtuple('Snapshot', ('version', 'etag', 'encodings'))
+
+
+def parse_accept_encoding(header):
+    """Кодировки из Accept-Encoding, которые клиент не запретил (q=0)."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        try:
+            if params.startswith('q=') and float(params[2:]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class ReferenceSnapshot:
+    """Снимок справочника, заранее сериализованный и сжатый.
+
+    Снимок строится в процессе один раз на версию данных и отдаётся
+    без обращения к базе. Версия хранится в общем кэше и меняется при
+    изменении таблицы, в том числе командами загрузки в отдельном
+    процессе, поэтому воркеры перестраивают снимок сами. Кэш в памяти
+    процесса для этого не подходит (проверка api.W001).
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        self.version_key = f'reference:{name}:version'
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        bump_version(self.version_key)
+
+    def build(self, version):
+        data = self.serializer_class(self.queryset.all(), many=True).data
+        body = JSONRenderer().render(data)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        encodings = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            encodings['br'] = brotli.compress(body)
+        return Snapshot(version, digest, encodings)
+
+    def get(self):
+        version = get_version(self.version_key)
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version != version:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.version != version:
+                    snapshot = self.snapshot = self.build(version)
+        return snapshot
+
+    def response(self, request):
+        snapshot = self.get()
+        accepted = parse_accept_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        encoding = next(
+            (coding for coding in ('br', 'gzip')
+             if coding in accepted and coding in snapshot.encodings),
+            'identity'
+        )
+        etag = f'"{snapshot.etag}-{encoding}"'
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                snapshot.encodings[encoding], content_type='application/json'
+            )
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Cache-Control'] = (
+            f'public, max-age={settings.REFERENCE_CACHE_MAX_AGE}'
+        )
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+tags_snapshot = ReferenceSnapshot('tags', Tag.objects.all(), TagSerializer)
+ingredients_snapshot = ReferenceSnapshot(
+    'ingredients', Ingredient.objects.all(), IngredientSerializer
+)
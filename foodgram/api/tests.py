@@ -0,0 +1,1187 @@
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from base64 import b64encode, urlsafe_b64encode
+from importlib import import_module
+from unittest import mock, skipUnless
+from io import BytesIO, StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.cache import get_recipes_version
+from api.checks import check_shared_caches
+from api.exports import run_job
+from api.metrics import ARCHIVE_NAME, collect, write_file
+from recipes.loader import copy_rows
+from recipes.media_gc import collect_garbage
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag, TimelineEntry)
+from recipes.search import get_search_backend
+from recipes.shopping_list import (diff_shopping_list, iter_shopping_list,
+                                   rebuild_shopping_list)
+from recipes.signals import recipes_bulk_created
+from recipes.storage import recipe_image_storage
+from recipes.timeline import rebuild_timelines
+from recipes.user_state import favorites
+from users.models import Follow, User
+
+RECIPE_COUNT = 110
+INGREDIENTS_PER_RECIPE = 3
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, ALLOWED_HOSTS=['testserver'])
+class APITestCase(TestCase):
+    """Данные для проверки числа запросов: страница limit=100 заполнена
+    целиком, у рецептов разные авторы, теги и ингредиенты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Читателев', password='pass'
+        )
+        # SQLite не возвращает id из bulk_create: объекты читаются заново.
+        User.objects.bulk_create(
+            User(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                first_name='Автор', last_name=str(number)
+            ) for number in range(10)
+        )
+        cls.authors = list(
+            User.objects.filter(username__startswith='author').order_by('id')
+        )
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag{number}',
+                color=f'#00000{number}')
+            for number in range(3)
+        )
+        cls.tags = list(Tag.objects.order_by('id'))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(10)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.authors[number % len(cls.authors)],
+                name=f'Рецепт {number}', text='Описание',
+                image='recipes_images/test.jpg', cooking_time=10
+            ) for number in range(RECIPE_COUNT)
+        )
+        cls.recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(
+                recipe=recipe, tag=cls.tags[number % len(cls.tags)]
+            ) for number, recipe in enumerate(cls.recipes)
+        )
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient=cls.ingredients[
+                    (number + shift) % len(cls.ingredients)
+                ],
+                amount=shift + 1
+            )
+            for number, recipe in enumerate(cls.recipes)
+            for shift in range(INGREDIENTS_PER_RECIPE)
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::3]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::5]
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.user, author=author)
+            for author in cls.authors[::2]
+        )
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        # Кэш ответов и наборов состояния не должен скрывать запросы.
+        caches['default'].clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def use_temp_media(self):
+        """MEDIA_ROOT и каталог выгрузок во временном каталоге, копии
+        строятся сразу."""
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        media_root = os.path.join(root, 'media')
+        overrides = override_settings(
+            MEDIA_ROOT=media_root, IMAGE_PROCESSING='sync',
+            SHOPPING_LIST_EXPORT_ROOT=os.path.join(root, 'private')
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        return media_root
+
+    def get(self, client, path, queries, data=None):
+        caches['default'].clear()
+        with self.assertNumQueries(queries):
+            response = client.get(path, data)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+
+class RecipeQueryCountTest(APITestCase):
+    """Число запросов списка и карточки рецепта не зависит от размера
+    страницы, создания рецепта - от числа ингредиентов и тегов."""
+
+    def test_list_anonymous(self):
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                response = self.get(
+                    self.anonymous, '/api/recipes/', 4, {'limit': limit}
+                )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_authenticated(self):
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                response = self.get(
+                    self.client, '/api/recipes/', 8, {'limit': limit}
+                )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_detail_anonymous(self):
+        self.get(self.anonymous, f'/api/recipes/{self.recipes[0].id}/', 3)
+
+    def test_detail_authenticated(self):
+        response = self.get(
+            self.client, f'/api/recipes/{self.recipes[0].id}/', 7
+        )
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def create_payload(self, ingredient_ids, tag_ids):
+        output = BytesIO()
+        Image.new('RGB', (10, 10), 'orange').save(output, 'PNG')
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 2}
+                for ingredient_id in ingredient_ids
+            ],
+            'tags': tag_ids,
+            'image': 'data:image/png;base64,'
+                     + b64encode(output.getvalue()).decode(),
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 5,
+        }
+
+    def test_create(self):
+        # Ингредиенты и теги проверяются одним запросом IN на связь.
+        self.use_temp_media()
+        for count in (1, len(self.ingredients)):
+            with self.subTest(count=count):
+                payload = self.create_payload(
+                    [ingredient.id for ingredient in self.ingredients[:count]],
+                    [tag.id for tag in self.tags[:min(count, 3)]]
+                )
+                caches['default'].clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post(
+                        '/api/recipes/', payload, format='json'
+                    )
+                self.assertEqual(response.status_code, 201, response.content)
+                self.assertEqual(len(queries), 18)
+                for table in ('recipes_ingredient', 'recipes_tag'):
+                    self.assertEqual(len([
+                        query for query in queries.captured_queries
+                        if query['sql'].startswith('SELECT')
+                        and f'FROM "{table}" WHERE' in query['sql']
+                    ]), 1, table)
+
+    def test_unknown_ids(self):
+        valid_ingredient, valid_tag = self.ingredients[0].id, self.tags[0].id
+        for payload, field in (
+            (self.create_payload([valid_ingredient, 99999, 99998],
+                                 [valid_tag]), 'ingredients'),
+            (self.create_payload([valid_ingredient], [valid_tag, 99999,
+                                                      99998]), 'tags'),
+        ):
+            with self.subTest(field=field):
+                response = self.client.post(
+                    '/api/recipes/', payload, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('99999, 99998', str(response.data[field]))
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+
+
+def make_cursor(position, reverse=0):
+    return urlsafe_b64encode(
+        urlencode({'p': position, 'r': reverse}, doseq=True).encode()
+    ).decode()
+
+
+class KeysetPaginationTest(APITestCase):
+    """Постраничный вывод по курсору: переход по ссылкам и ответ 404
+    на повреждённый курсор."""
+
+    def test_next_link(self):
+        first = self.client.get('/api/recipes/', {'cursor': '', 'limit': 50})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(second.status_code, 200)
+        ids = [
+            recipe['id']
+            for response in (first, second)
+            for recipe in response.data['results']
+        ]
+        self.assertEqual(len(set(ids)), 100)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_invalid_cursor(self):
+        recipe = self.recipes[0]
+        for path, cursor in (
+            ('/api/recipes/', 'не base64'),
+            ('/api/recipes/', make_cursor(['вчера', recipe.id])),
+            ('/api/recipes/', make_cursor([str(recipe.pub_date), 'abc'])),
+            ('/api/recipes/', make_cursor([str(recipe.pub_date)])),
+            ('/api/recipes/', make_cursor(
+                [str(recipe.pub_date), recipe.id], reverse='x'
+            )),
+            ('/api/users/subscriptions/', make_cursor(['abc'])),
+        ):
+            with self.subTest(path=path, cursor=cursor):
+                response = self.client.get(path, {'cursor': cursor})
+                self.assertEqual(
+                    response.status_code, 404, response.content
+                )
+
+
+class RecipeStateTest(APITestCase):
+    """Признаки избранного и корзины сразу после изменения."""
+
+    def get_recipe(self, recipe):
+        return self.client.get(f'/api/recipes/{recipe.id}/').data
+
+    def test_favorite_and_cart(self):
+        recipe = self.recipes[1]
+        self.assertFalse(self.get_recipe(recipe)['is_favorited'])
+        for action, field in (
+            ('favorite', 'is_favorited'),
+            ('shopping_cart', 'is_in_shopping_cart'),
+        ):
+            with self.subTest(action=action):
+                path = f'/api/recipes/{recipe.id}/{action}/'
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(path)
+                self.assertTrue(self.get_recipe(recipe)[field])
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.delete(path)
+                self.assertFalse(self.get_recipe(recipe)[field])
+
+    def test_marked_only_for_retrieve(self):
+        recipe = self.recipes[0]
+        author = APIClient()
+        author.force_authenticate(self.authors[0])
+        path = f'/api/recipes/{recipe.id}/'
+        with mock.patch('api.views.mark_recipes') as mark_recipes:
+            author.get(path)
+            self.assertEqual(mark_recipes.call_count, 1)
+            author.patch(path, {'cooking_time': 5}, format='json')
+            author.delete(path)
+            self.assertEqual(mark_recipes.call_count, 1)
+        self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_stale_load_is_not_read(self):
+        """Набор, загруженный до изменения и записанный после него,
+        остаётся под старой версией."""
+        version = favorites.get_version(self.user.id)
+        stale = favorites.get(self.user.id).to_bytes()
+        Favorite.objects.create(user=self.user, recipe=self.recipes[1])
+        favorites.invalidate(self.user.id)
+        favorites.cache.set(favorites.get_key(self.user.id, version), stale)
+        self.assertIn(self.recipes[1].id, favorites.get(self.user.id))
+
+
+class ReferenceSnapshotTest(APITestCase):
+    """Снимки справочников обновляются после команды загрузки."""
+
+    def test_load_ingredients_changes_etag(self):
+        before = self.anonymous.get('/api/ingredients/')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_ingredients', stdout=StringIO())
+        after = self.anonymous.get('/api/ingredients/')
+        self.assertNotEqual(before['ETag'], after['ETag'])
+        self.assertGreater(len(after.json()), len(before.json()))
+
+    def test_process_local_cache_warning(self):
+        self.assertEqual(
+            [warning.id for warning in check_shared_caches(None)],
+            ['api.W001', 'api.W001']
+        )
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '/tmp/foodgram_test_cache',
+        }}):
+            self.assertEqual(check_shared_caches(None), [])
+
+
+class ShoppingListTest(APITestCase):
+    """Сводный список покупок следует за изменениями состава рецептов
+    в корзине, откуда бы они ни пришли."""
+
+    def setUp(self):
+        super().setUp()
+        rebuild_shopping_list(self.user.id)
+        self.recipe = self.recipes[0]
+
+    def assertListMatchesCart(self):
+        self.assertEqual(diff_shopping_list(self.user.id), {})
+
+    def test_api_update(self):
+        author = APIClient()
+        author.force_authenticate(self.recipe.author)
+        ingredients = self.ingredients
+        response = author.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'ingredients': [
+                    {'id': ingredients[0].id, 'amount': 7},
+                    {'id': ingredients[1].id, 'amount': 2},
+                    {'id': ingredients[5].id, 'amount': 4},
+                ],
+                'tags': [self.tags[0].id],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertListMatchesCart()
+
+    def test_model_changes(self):
+        row = self.recipe.ingredient_list.order_by('id').first()
+        row.amount += 10
+        row.save()
+        self.assertListMatchesCart()
+        row.ingredient = self.ingredients[9]
+        row.save()
+        self.assertListMatchesCart()
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.ingredients[8], amount=5
+        )
+        self.assertListMatchesCart()
+        row.delete()
+        self.assertListMatchesCart()
+
+    def test_recipe_delete(self):
+        self.recipe.delete()
+        self.assertListMatchesCart()
+
+
+class SubscriptionsTest(APITestCase):
+    """Параметр recipes_limit страницы подписок."""
+
+    def get_recipe_counts(self, recipes_limit):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': recipes_limit}
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return [len(author['recipes']) for author in response.data['results']]
+
+    def test_recipes_limit(self):
+        per_author = RECIPE_COUNT // len(self.authors)
+        self.assertEqual(set(self.get_recipe_counts(2)), {2})
+        self.assertEqual(set(self.get_recipe_counts(0)), {per_author})
+
+
+class ShoppingCartDownloadTest(APITestCase):
+    """Параметр async выгрузки списка покупок разбирается как флаг."""
+
+    def test_async_flag(self):
+        path = '/api/recipes/download_shopping_cart/'
+        for value, status_code in (
+            ('0', 200), ('false', 200), ('1', 202), ('true', 202),
+            ('maybe', 400),
+        ):
+            with self.subTest(value=value):
+                response = self.client.get(
+                    path, {'async': value, 'format': 'txt'}
+                )
+                self.assertEqual(response.status_code, status_code)
+
+    def download(self, data=None, **headers):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', data, **headers
+        )
+        if response.status_code != 200:
+            return response, None
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_formats(self):
+        rebuild_shopping_list(self.user.id)
+        rows = len(list(iter_shopping_list(self.user.id)))
+        self.assertGreater(rows, 0)
+        response, content = self.download({'format': 'txt'})
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; charset=utf-8'
+        )
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0], 'Ингредиенты:')
+        self.assertEqual(len(lines), rows + 1)
+        response, content = self.download({'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        table = list(csv.reader(StringIO(content.decode())))
+        self.assertEqual(
+            table[0], ['Ингредиент', 'Единица измерения', 'Количество']
+        )
+        self.assertEqual(len(table), rows + 1)
+        response, content = self.download({'format': 'json'})
+        self.assertEqual(
+            response['Content-Type'], 'application/json; charset=utf-8'
+        )
+        self.assertEqual(len(json.loads(content)), rows)
+        response, content = self.download({'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_negotiation(self):
+        for headers, content_type in (
+            ({}, 'application/pdf'),
+            ({'HTTP_ACCEPT': 'text/csv'}, 'text/csv; charset=utf-8'),
+            ({'HTTP_ACCEPT': 'application/json'},
+             'application/json; charset=utf-8'),
+            ({'HTTP_ACCEPT': 'text/html, text/plain;q=0.9'},
+             'text/plain; charset=utf-8'),
+        ):
+            with self.subTest(headers=headers):
+                response, _ = self.download(**headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], content_type)
+        response, _ = self.download({'format': 'csv'}, HTTP_ACCEPT='*/*')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        for data, headers in (
+            ({}, {'HTTP_ACCEPT': 'image/png'}),
+            ({'format': 'csv'}, {'HTTP_ACCEPT': 'application/pdf'}),
+        ):
+            with self.subTest(data=data, headers=headers):
+                response, _ = self.download(data, **headers)
+                self.assertEqual(response.status_code, 406)
+                self.assertEqual(
+                    response['Content-Type'], 'application/json'
+                )
+        response, _ = self.download({'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_pdf_pages(self):
+        # 10 строк из данных класса и 60 новых: 24 строки на первой
+        # странице после заголовка, по 25 на следующих.
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Добавка {number}', measurement_unit='г')
+            for number in range(60)
+        )
+        recipe = self.recipes[1]
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in Ingredient.objects.filter(
+                name__startswith='Добавка'
+            )
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        rebuild_shopping_list(self.user.id)
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'pdf'}
+        )
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', content)), 3)
+
+    def test_export_file_is_private(self):
+        media_root = self.use_temp_media()
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            {'async': 1, 'format': 'txt'}
+        )
+        self.assertEqual(response.status_code, 202)
+        job = run_job(response.data['id'])
+        self.assertFalse(job.file.path.startswith(media_root))
+        self.assertNotIn(job.content_hash, job.file.name)
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, 303)
+        path = response['Location']
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            b''.join(response.streaming_content).startswith(
+                'Ингредиенты'.encode()
+            )
+        )
+        stranger = APIClient()
+        stranger.force_authenticate(self.authors[0])
+        self.assertEqual(stranger.get(path).status_code, 404)
+        self.assertEqual(self.anonymous.get(path).status_code, 401)
+        with override_settings(
+            SHOPPING_LIST_EXPORT_ACCEL_PREFIX='/private/shopping_lists/'
+        ):
+            response = self.client.get(path)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            f'/private/shopping_lists/{job.file.name}'
+        )
+
+
+class DedupeRecipeImagesTest(APITestCase):
+    """Перевод фотографий на имена по содержимому вместе с копиями."""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temp_media()
+
+    def test_variants_follow_new_name(self):
+        output = BytesIO()
+        Image.new('RGB', (1600, 900), 'orange').save(output, 'PNG')
+        duplicates = self.recipes[:2]
+        for number, recipe in enumerate(duplicates):
+            recipe.image = default_storage.save(
+                f'recipes_images/old{number}.png',
+                ContentFile(output.getvalue())
+            )
+            recipe.image_variants = {'320': 'recipes_images/variants/x.webp'}
+            recipe.save(update_fields=('image', 'image_variants'))
+        stdout = StringIO()
+        call_command(
+            'dedupe_recipe_images', stdout=stdout, stderr=StringIO()
+        )
+        self.assertIn('переименованы', stdout.getvalue())
+        first, second = (
+            Recipe.objects.get(id=recipe.id) for recipe in duplicates
+        )
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotIn('old', first.image.name)
+        self.assertEqual(first.image_variants, second.image_variants)
+        self.assertEqual(set(first.image_variants), {'320', '640', '1280'})
+        for name in (first.image.name, *first.image_variants.values()):
+            self.assertTrue(default_storage.exists(name), name)
+        self.assertFalse(default_storage.exists('recipes_images/old0.png'))
+
+
+class MediaGarbageTest(APITestCase):
+    """Повторная загрузка файла защищает его от сборки мусора."""
+
+    def test_reupload_refreshes_file(self):
+        self.use_temp_media()
+        content = ContentFile(b'image', name='photo.jpg')
+        name = recipe_image_storage.save('recipes_images/photo.jpg', content)
+        path = recipe_image_storage.path(name)
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(path, (old, old))
+        self.assertEqual(
+            recipe_image_storage.save('recipes_images/again.jpg', content),
+            name
+        )
+        self.assertEqual(collect_garbage(60 * 60, 100), (0, 0))
+        self.assertTrue(os.path.exists(path))
+        os.utime(path, (old, old))
+        self.assertEqual(collect_garbage(60 * 60, 100)[0], 1)
+        self.assertFalse(os.path.exists(path))
+
+
+class GenerateFakeDataTest(APITestCase):
+    """Генерация данных; на PostgreSQL --copy вставляет через COPY."""
+
+    def test_generate_with_copy(self):
+        users, recipes = User.objects.count(), Recipe.objects.count()
+        call_command(
+            'generate_fake_data', users=5, recipes=20, seed=1, copy=True,
+            stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), users + 5)
+        self.assertEqual(Recipe.objects.count(), recipes + 20)
+        self.assertTrue(
+            IngredientInRecipe.objects.exclude(
+                recipe__in=self.recipes
+            ).exists()
+        )
+        self.assertEqual(
+            sum(User.objects.values_list('followers_count', flat=True)),
+            Follow.objects.count()
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY есть в PostgreSQL')
+    def test_copy_rows_twice_in_transaction(self):
+        for number in range(2):
+            copy_rows(Tag, ('name', 'slug', 'color'), [
+                (f'Копия {number}', f'copy{number}', '#123456'),
+            ])
+        self.assertEqual(
+            Tag.objects.filter(slug__startswith='copy').count(), 2
+        )
+
+
+class UserQueryCountTest(APITestCase):
+    """Число запросов страниц пользователей и подписок не зависит
+    от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User.objects.bulk_create(
+            User(
+                username=f'user{number}', email=f'user{number}@example.com',
+                first_name='Пользователь', last_name=str(number)
+            ) for number in range(100)
+        )
+        cls.follower = User.objects.create_user(
+            username='follower', email='follower@example.com',
+            first_name='Подписчик', last_name='Подписчиков', password='pass'
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.follower, author=author)
+            for author in User.objects.exclude(id=cls.follower.id)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.follower_client = APIClient()
+        self.follower_client.force_authenticate(self.follower)
+
+    def test_list(self):
+        for client, queries in ((self.anonymous, 2), (self.client, 4)):
+            for limit in (6, 50, 100):
+                with self.subTest(authenticated=client is self.client,
+                                  limit=limit):
+                    response = self.get(
+                        client, '/api/users/', queries, {'limit': limit}
+                    )
+                    self.assertEqual(len(response.data['results']), limit)
+
+    def test_me(self):
+        response = self.get(self.client, '/api/users/me/', 2)
+        self.assertEqual(response.data['id'], self.user.id)
+
+    def test_subscriptions(self):
+        for limit in (6, 50, 100):
+            with self.subTest(limit=limit):
+                response = self.get(
+                    self.follower_client, '/api/users/subscriptions/', 3,
+                    {'limit': limit, 'recipes_limit': 3}
+                )
+                self.assertEqual(len(response.data['results']), limit)
+                for author in response.data['results']:
+                    self.assertTrue(author['is_subscribed'])
+                    self.assertLessEqual(len(author['recipes']), 3)
+
+    def test_recipe_authors(self):
+        followed = {author.id for author in self.authors[::2]}
+        response = self.get(self.client, '/api/recipes/', 8, {'limit': 100})
+        for recipe in response.data['results']:
+            author = recipe['author']
+            self.assertEqual(author['is_subscribed'], author['id'] in followed)
+            self.assertEqual(
+                set(author),
+                {'email', 'id', 'username', 'first_name', 'last_name',
+                 'is_subscribed'}
+            )
+
+
+class FeedTest(APITestCase):
+    """Лента подписок: страницы по курсору из ленты и рецептов
+    «знаменитостей»."""
+
+    def setUp(self):
+        super().setUp()
+        rebuild_timelines()
+        followed = {author.id for author in self.authors[::2]}
+        self.expected = [
+            recipe.id for recipe in sorted(
+                (recipe for recipe in self.recipes
+                 if recipe.author_id in followed),
+                key=lambda recipe: (recipe.pub_date, recipe.id),
+                reverse=True
+            )
+        ]
+
+    def walk(self, data=None):
+        ids = []
+        response = self.client.get('/api/recipes/feed/', {
+            'limit': 10, **(data or {})
+        })
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            if response.data['next'] is None:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_followers_count(self):
+        self.assertEqual(
+            User.objects.get(id=self.authors[0].id).followers_count, 1
+        )
+        Follow.objects.create(user=self.authors[1], author=self.authors[0])
+        self.assertEqual(
+            User.objects.get(id=self.authors[0].id).followers_count, 2
+        )
+        Follow.objects.filter(user=self.authors[1]).delete()
+        self.assertEqual(
+            User.objects.get(id=self.authors[0].id).followers_count, 1
+        )
+
+    def test_timeline(self):
+        ids, last = self.walk()
+        self.assertEqual(ids, self.expected)
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in previous.data['results']],
+            self.expected[-15:-5]
+        )
+
+    def test_celebrities(self):
+        # Записи ленты остались, а авторы стали «знаменитостями»:
+        # рецепты из обоих источников выводятся один раз.
+        with override_settings(FEED_FANOUT_LIMIT=1):
+            self.assertEqual(self.walk()[0], self.expected)
+            rebuild_timelines()
+            self.assertEqual(self.walk()[0], self.expected)
+
+    def test_tag_filter(self):
+        tagged = {
+            recipe.id for number, recipe in enumerate(self.recipes)
+            if number % len(self.tags) == 0
+        }
+        ids, _ = self.walk({'tags': self.tags[0].slug})
+        self.assertEqual(
+            ids, [recipe_id for recipe_id in self.expected
+                  if recipe_id in tagged]
+        )
+
+    def timeline(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by(
+            '-pub_date', '-recipe_id'
+        ).values_list('recipe_id', flat=True))
+
+    def create_recipe(self, author):
+        return Recipe.objects.create(
+            author=author, name='Новый рецепт', text='Описание',
+            image='recipes_images/test.jpg', cooking_time=10
+        )
+
+    @override_settings(FEED_BACKFILL_SIZE=5)
+    def test_timeline_cap(self):
+        rebuild_timelines()
+        self.assertEqual(self.timeline(self.user), self.expected[:5])
+        recipe = self.create_recipe(self.authors[0])
+        self.assertEqual(
+            self.timeline(self.user), [recipe.id, *self.expected[:4]]
+        )
+        Follow.objects.create(user=self.user, author=self.authors[1])
+        self.assertEqual(len(self.timeline(self.user)), 5)
+
+    def test_author_below_fanout_limit(self):
+        # Рецепт вышел, пока у автора было FEED_FANOUT_LIMIT
+        # подписчиков, и появляется в лентах после отписки одного из них.
+        with override_settings(FEED_FANOUT_LIMIT=2):
+            Follow.objects.create(
+                user=self.authors[1], author=self.authors[0]
+            )
+            recipe = self.create_recipe(self.authors[0])
+            self.assertNotIn(recipe.id, self.timeline(self.user))
+            Follow.objects.filter(user=self.authors[1]).delete()
+            self.assertEqual(self.timeline(self.user)[0], recipe.id)
+
+    def test_migration_fill(self):
+        expected = set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'author_id', 'pub_date'
+        ))
+        TimelineEntry.objects.all().delete()
+        migration = import_module('recipes.migrations.0009_timelineentry')
+        migration.fill_timelines(apps, SimpleNamespace(
+            quote_name=connection.ops.quote_name, connection=connection
+        ))
+        self.assertEqual(set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'author_id', 'pub_date'
+        )), expected)
+
+    def test_query_count(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                response = self.get(
+                    self.client, '/api/recipes/feed/', 9, {'limit': limit}
+                )
+                self.assertEqual(len(response.data['results']), limit)
+
+
+class ResponseCacheTest(APITestCase):
+    """Кэш ответов для анонимных пользователей."""
+
+    def test_links_follow_request(self):
+        first = self.anonymous.get(
+            '/api/recipes/', {'limit': 6, 'page': 1, 'utm': 'x'}
+        )
+        self.assertIn('utm=x', first.data['next'])
+        response = self.anonymous.get('/api/recipes/', {'limit': 6})
+        self.assertNotIn('utm', response.data['next'])
+        with override_settings(ALLOWED_HOSTS=['testserver', 'mirror']):
+            mirror = self.anonymous.get(
+                '/api/recipes/', {'limit': 6}, HTTP_HOST='mirror'
+            )
+        self.assertTrue(mirror.data['next'].startswith('http://mirror/'))
+        response = self.anonymous.get('/api/recipes/', {'limit': 6})
+        self.assertTrue(
+            response.data['next'].startswith('http://testserver/')
+        )
+
+    def test_user_saves(self):
+        version = get_recipes_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(
+                username='newcomer', email='newcomer@example.com',
+                first_name='Новый', last_name='Пользователь',
+                password='pass'
+            )
+            user.set_password('other')
+            user.save()
+            user.last_login = user.date_joined
+            user.save(update_fields=('last_login',))
+        self.assertEqual(get_recipes_version(), version)
+        author = User.objects.get(id=self.authors[0].id)
+        author.first_name = 'Переименованный'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertNotEqual(get_recipes_version(), version)
+
+
+class MetricsTest(APITestCase):
+    """Доступ к /metrics и перенос файлов завершившихся воркеров."""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = override_settings(METRICS_DIR=root, METRICS_TOKEN='t0')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.root = Path(root)
+
+    def test_access(self):
+        self.assertEqual(self.anonymous.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(
+            self.anonymous.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer t1'
+            ).status_code,
+            403
+        )
+        response = self.anonymous.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer t0'
+        )
+        self.assertEqual(response.status_code, 200)
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_dead_workers_archived(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        dead = self.root / f'{process.pid}.json'
+        write_file(dead, {('DeadView', '200'): 5}, {})
+        for _ in range(2):
+            counters, _ = collect()
+            self.assertEqual(counters[('DeadView', '200')], 5)
+        self.assertFalse(dead.exists())
+        self.assertTrue((self.root / ARCHIVE_NAME).exists())
+        self.assertTrue((self.root / f'{os.getpid()}.json').exists())
+
+
+class SearchTest(APITestCase):
+    """Поиск рецептов: порядок по релевантности, совпадение слов
+    и обновление индекса после изменений в обход сериализатора."""
+
+    def setUp(self):
+        super().setUp()
+        get_search_backend().postings = None
+        self.borscht = self.create_recipe('Борщ красный', 'Суп')
+        self.soup = self.create_recipe('Суп', 'Почти борщ')
+        self.dressing = Ingredient.objects.create(
+            name='Борщевая заправка', measurement_unit='г'
+        )
+        self.cabbage_soup = self.create_recipe('Щи', 'Суп', self.dressing)
+
+    def create_recipe(self, name, text, ingredient=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.authors[0], name=name, text=text,
+                image='recipes_images/test.jpg', cooking_time=10
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient or self.ingredients[0],
+                amount=1
+            )
+        return recipe
+
+    def search(self, query):
+        response = self.anonymous.get(
+            '/api/recipes/', {'search': query, 'limit': 10}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranking(self):
+        # Название весит больше ингредиентов, ингредиенты - описания.
+        self.assertEqual(
+            self.search('борщ'),
+            [self.borscht.id, self.cabbage_soup.id, self.soup.id]
+        )
+
+    def test_tokens(self):
+        self.assertEqual(self.search('БОРЩ Красный'), [self.borscht.id])
+        self.assertEqual(self.search('крас'), [self.borscht.id])
+        self.assertEqual(self.search('борщ щи'), [self.cabbage_soup.id])
+        self.assertEqual(self.search('борщ зелёный'), [])
+
+    def test_index_updates(self):
+        self.search('борщ')
+        self.soup.name = 'Борщ'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.save()
+        self.assertEqual(self.search('борщ')[0], self.soup.id)
+        self.dressing.name = 'Капуста'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dressing.save()
+        self.assertEqual(self.search('заправка'), [])
+        self.assertEqual(self.search('капуста'), [self.cabbage_soup.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipe.objects.filter(
+                recipe=self.cabbage_soup
+            ).delete()
+        self.assertEqual(self.search('капуста'), [])
+        Recipe.objects.bulk_create([Recipe(
+            author=self.authors[0], name='Борщ зелёный', text='Суп',
+            image='recipes_images/test.jpg', cooking_time=10
+        )])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes_bulk_created.send(sender=Recipe)
+        self.assertEqual(len(self.search('зелёный')), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.borscht.delete()
+        self.assertEqual(self.search('красный'), [])
+
+    def test_cursor_rejected(self):
+        response = self.anonymous.get(
+            '/api/recipes/', {'search': 'борщ', 'cursor': ''}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+
+class RecipeImageTest(APITestCase):
+    """Загрузка картинки рецепта в base64: ограничения и копии."""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temp_media()
+
+    def post(self, size=(800, 400), wrap=False):
+        output = BytesIO()
+        Image.new('RGB', size, 'orange').save(output, 'PNG')
+        encoded = b64encode(output.getvalue()).decode()
+        if wrap:
+            encoded = '\n'.join(
+                encoded[start:start + 76]
+                for start in range(0, len(encoded), 76)
+            ) + '\n'
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            'tags': [self.tags[0].id],
+            'image': f'data:image/png;base64,{encoded}',
+            'name': 'С картинкой', 'text': 'Описание', 'cooking_time': 5,
+        }, format='json')
+
+    def test_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post()
+        self.assertEqual(response.status_code, 201, response.content)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        # Копия шире оригинала (1280 px) не делается.
+        self.assertEqual(set(recipe.image_variants), {'320', '640'})
+        for name in recipe.image_variants.values():
+            with default_storage.open(name) as file:
+                self.assertIn(Image.open(file).width, (320, 640))
+
+    def test_wrapped_base64(self):
+        for memory_size in (settings.FILE_UPLOAD_MAX_MEMORY_SIZE, 100):
+            with self.subTest(memory_size=memory_size):
+                with override_settings(
+                    FILE_UPLOAD_MAX_MEMORY_SIZE=memory_size
+                ):
+                    response = self.post(wrap=True)
+                self.assertEqual(
+                    response.status_code, 201, response.content
+                )
+
+    def test_limits(self):
+        with override_settings(IMAGE_MAX_SIZE=100):
+            response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        with override_settings(IMAGE_MAX_DIMENSION=500):
+            response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertEqual(self.post(size=(500, 500)).status_code, 201)
+        response = self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            'tags': [self.tags[0].id],
+            'image': 'data:image/png;base64,не-base64',
+            'name': 'С картинкой', 'text': 'Описание', 'cooking_time': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+
+class IngredientSearchTest(APITestCase):
+    """Подсказки ингредиентов: начало названия, затем подстрока
+    и опечатки, не больше INGREDIENT_SEARCH_LIMIT."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit='г')
+                for name in ('Соль', 'Соевый соус', 'Сахар', 'Морская соль')
+            )
+
+    def search(self, name):
+        response = self.anonymous.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [
+            ingredient['name'] for ingredient in json.loads(response.content)
+        ]
+
+    def test_prefix(self):
+        self.assertEqual(self.search('со'), ['Соевый соус', 'Соль'])
+        self.assertEqual(self.search('СОЛ'), ['Соль'])
+
+    def test_similar(self):
+        self.assertEqual(self.search('ская'), ['Морская соль'])
+        self.assertEqual(self.search('сохар'), ['Сахар'])
+        self.assertEqual(self.search('ль'), ['Соль', 'Морская соль'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=1)
+    def test_limit(self):
+        self.assertEqual(self.search('со'), ['Соевый соус'])
+        self.assertEqual(len(self.search('ль')), 1)
+
+    def test_blank_name(self):
+        self.assertEqual(
+            len(self.search('  ')), Ingredient.objects.count()
+        )
+
+
+class ReferenceLoaderTest(APITestCase):
+    """Загрузка справочников: форматы, повторный запуск и ошибки."""
+
+    def setUp(self):
+        super().setUp()
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, content):
+        path = self.root / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def load(self, *args):
+        stdout = StringIO()
+        call_command(*args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_ingredient_formats(self):
+        # Первая запись уже есть в базе, остальные добавляются.
+        files = (
+            self.write('ingredients.csv', (
+                'name,measurement_unit\n'
+                'Ингредиент 0,г\nМука,г\n"Соль, морская",г\n'
+            )),
+            self.write('ingredients.json', json.dumps([
+                {'name': 'Ингредиент 0', 'measurement_unit': 'г'},
+                {'name': 'Молоко', 'measurement_unit': 'мл'},
+                {'name': 'Яйцо', 'measurement_unit': 'шт'},
+            ], ensure_ascii=False)),
+            self.write('ingredients.ndjson', (
+                '{"name": "Ингредиент 0", "measurement_unit": "г"}\n\n'
+                '{"name": "Сахар", "measurement_unit": "г"}\n'
+                '{"name": "Сахар", "measurement_unit": "кг"}\n'
+            )),
+        )
+        for path in files:
+            with self.subTest(path=Path(path).name):
+                count = Ingredient.objects.count()
+                output = self.load(
+                    'load_reference_data', 'ingredients', path,
+                    '--batch-size', '1'
+                )
+                self.assertIn('Прочитано строк: 3, добавлено записей: 2',
+                              output)
+                self.assertEqual(Ingredient.objects.count(), count + 2)
+                output = self.load('load_reference_data', 'ingredients', path)
+                self.assertIn('Прочитано строк: 3, добавлено записей: 0',
+                              output)
+                self.assertEqual(Ingredient.objects.count(), count + 2)
+        self.assertTrue(Ingredient.objects.filter(
+            name='Соль, морская', measurement_unit='г'
+        ).exists())
+
+    def test_tags_and_format_option(self):
+        path = self.write('tags.txt', (
+            'Завтрак,breakfast,#E26C2D\nОбед,lunch,#49B64E\n'
+        ))
+        for added in (2, 0):
+            output = self.load('load_tags', path, '--format', '.csv')
+            self.assertIn(f'добавлено записей: {added}', output)
+        self.assertEqual(Tag.objects.count(), len(self.tags) + 2)
+        self.assertEqual(Tag.objects.get(slug='lunch').color, '#49B64E')
+
+    def test_bad_rows(self):
+        count = Ingredient.objects.count()
+        for name, content, message in (
+            ('missing.json', json.dumps(
+                [{'name': 'Мука', 'measurement_unit': 'г'}, {'name': 'Соль'}]
+            ), 'Запись 2'),
+            ('object.json', '{"name": "Мука"}', 'JSON-массив'),
+            ('unfinished.json', '[{"name": "Мука", "measurement_unit": "г"}',
+             'не закончен'),
+            ('broken.ndjson', '{"name": "Мука",\n', ''),
+        ):
+            with self.subTest(name=name):
+                with self.assertRaisesMessage(CommandError, message):
+                    self.load(
+                        'load_reference_data', 'ingredients',
+                        self.write(name, content)
+                    )
+        with self.assertRaises(CommandError):
+            self.load(
+                'load_reference_data', 'ingredients',
+                str(self.root / 'absent.csv')
+            )
+        self.assertEqual(Ingredient.objects.count(), count)
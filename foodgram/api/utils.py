@@ -1,27 +1,155 @@
-from django.http import HttpResponse
+import csv
+import json
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
-FILE_NAME = 'shopping-list.txt'
-
-
-def to_pdf(ingredients):
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename={FILE_NAME}'
-    pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-    c = canvas.Canvas(response)
-    c.setFont('DejaVu', 17)
-    WIDTH = 60
-    HEIGHT = 770
-    c.drawString(WIDTH, HEIGHT, "  Ингредиенты: ")
-    for new_string in ingredients:
-        HEIGHT -= 30
-        name = new_string['ingredient__name']
-        measurement_unit = new_string['ingredient__measurement_unit']
-        amount = new_string['sum']
-        string = f'{name}  -  {amount}({measurement_unit})'
-        c.drawString(WIDTH, HEIGHT, string)
+FILE_NAME = 'shopping-list'
+FONT_NAME = 'DejaVu'
+FONT_FILE = 'DejaVuSans.ttf'
+FONT_SIZE = 17
+LINE_HEIGHT = 30
+WIDTH = 60
+TOP = 770
+BOTTOM = 50
+CHUNK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    """Загружает и регистрирует шрифт один раз на процесс."""
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+    return FONT_NAME
+
+
+def render_pdf(ingredients, output):
+    """Пишет список покупок в output, перенося строки на новые
+    страницы. Возвращает количество страниц."""
+    font = register_fonts()
+    c = canvas.Canvas(output, pagesize=A4)
+    c.setFont(font, FONT_SIZE)
+    height = TOP
+    c.drawString(WIDTH, height, "  Ингредиенты: ")
+    for item in ingredients:
+        height -= LINE_HEIGHT
+        if height < BOTTOM:
+            c.showPage()
+            c.setFont(font, FONT_SIZE)
+            height = TOP
+        string = (
+            f'{item["name"]}  -  {item["amount"]}'
+            f'({item["measurement_unit"]})'
+        )
+        c.drawString(WIDTH, height, string)
+    pages = c.getPageNumber()
     c.showPage()
     c.save()
+    return pages
+
+
+def iter_file(file, chunk_size=CHUNK_SIZE):
+    with file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_pdf(ingredients):
+    """PDF по кускам.
+
+    ReportLab записывает таблицу ссылок только в конце документа,
+    поэтому файл сначала собирается во временном буфере (больше
+    PDF_SPOOL_MAX_SIZE - на диске), а затем отправляется по кускам.
+    """
+    output = SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_SIZE)
+    render_pdf(ingredients, output)
+    output.seek(0)
+    yield from iter_file(output)
+
+
+def iter_txt(ingredients):
+    yield 'Ингредиенты:\n'
+    for item in ingredients:
+        yield (
+            f'{item["name"]} - {item["amount"]} '
+            f'({item["measurement_unit"]})\n'
+        )
+
+
+class Echo:
+    """Файлоподобный объект для csv.writer: возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for item in ingredients:
+        yield writer.writerow(
+            (item['name'], item['measurement_unit'], item['amount'])
+        )
+
+
+def iter_json(ingredients):
+    separator = '['
+    for item in ingredients:
+        yield separator + json.dumps(item, ensure_ascii=False)
+        separator = ',\n'
+    yield '[]' if separator == '[' else ']'
+
+
+EXPORTERS = {
+    'pdf': iter_pdf,
+    'txt': iter_txt,
+    'csv': iter_csv,
+    'json': iter_json,
+}
+
+
+def iter_export(ingredients, file_format):
+    """Содержимое файла в выбранном формате кусками байтов.
+
+    ingredients - итератор словарей name, measurement_unit, amount;
+    ни один формат не держит весь список в памяти.
+    """
+    for chunk in EXPORTERS[file_format](ingredients):
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+def shopping_list_response(ingredients, file_format, content_type):
+    """Потоковая выгрузка списка покупок в выбранном формате."""
+    response = StreamingHttpResponse(
+        iter_export(ingredients, file_format), content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename={FILE_NAME}.{file_format}'
+    )
     return response
+
+
+def export_file_response(job, content_type):
+    """Файл фоновой выгрузки: через nginx (X-Accel-Redirect), если задан
+    SHOPPING_LIST_EXPORT_ACCEL_PREFIX, иначе чтением файла в Django."""
+    filename = f'{FILE_NAME}.{job.file_format}'
+    prefix = settings.SHOPPING_LIST_EXPORT_ACCEL_PREFIX
+    if prefix:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f'{prefix.rstrip("/")}/{job.file.name}'
+        response['Content-Disposition'] = (
+            f'attachment; filename={filename}'
+        )
+        return response
+    return FileResponse(
+        job.file.open('rb'), as_attachment=True, filename=filename,
+        content_type=content_type
+    )
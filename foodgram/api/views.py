@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db.models import Count, F, Value
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
@@ -8,19 +10,32 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from api.autocomplete import search_ingredients
+from api.cache import cache_anonymous
+from api.exports import enqueue_export
 from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import CustomPagination
+from api.pagination import CustomPagination, MergedKeysetPagination
 from api.permissions import IsOwnerOrReadOnly
+from api.snapshots import ingredients_snapshot, tags_snapshot
 from api.serializer import (FavoriteSerializer, FollowCreateSerializer,
                             FollowSerializer,
                             IngredientSerializer,
                             RecipeCreateSerializer, RecipeReadSerializer,
-                            ShoppingCartSerializer, TagSerializer,
+                            RecipesLimitSerializer,
+                            ShoppingCartDownloadSerializer,
+                            ShoppingCartSerializer,
+                            ShoppingListExportSerializer,
+                            ShoppingListItemSerializer, TagSerializer,
                             UserSerializer
                             )
-from api.utils import to_pdf
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+from api.renderers import (FILE_RENDERERS, CSVRenderer, JSONFileRenderer,
+                           PDFRenderer, PlainTextRenderer, get_content_type)
+from api.utils import export_file_response, shopping_list_response
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListExport, ShoppingListItem, Tag)
+from recipes.shopping_list import iter_shopping_list
+from recipes.timeline import get_feed_sources
+from recipes.user_state import mark_recipes
 from users.models import Follow
 
 
@@ -34,18 +49,39 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     pagination_class = CustomPagination
     permission_classes = (IsOwnerOrReadOnly,)
+    cursor_ordering = ('-pub_date', '-id')
+    feed_cursor_ordering = ('-pub_date', '-recipe_id')
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        user = self.request.user
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.with_related()
+        return super().get_queryset()
+
+    @cache_anonymous
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_anonymous
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-        if user.is_authenticated:
-            queryset = Recipe.objects.add_annotations(user)
-        return queryset
+    def get_object(self):
+        recipe = super().get_object()
+        # Флаги избранного и корзины нужны только для вывода рецепта:
+        # изменение и удаление их не читают.
+        if self.action == 'retrieve':
+            mark_recipes((recipe,), self.request.user)
+        return recipe
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            mark_recipes(page, self.request.user)
+        return page
 
     def get_serializer_class(self):
         """Метод для вызова определенного сериализатора. """
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
@@ -107,21 +143,126 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(PDFRenderer, PlainTextRenderer, CSVRenderer,
+                          JSONFileRenderer),
         url_path='download_shopping_cart',
         url_name='download_shopping_cart',
     )
     def download_shopping_cart(self, request):
         """Метод для загрузки ингредиентов и их количества
                  для выбранных рецептов"""
-        ingredients = (IngredientInRecipe.objects.filter(
-            recipe__shoppingcart__user_id=request.user.id
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(sum=Sum('amount')).order_by(
-            'ingredient__name'
-        ))
-        return to_pdf(ingredients=ingredients)
+        renderer = request.accepted_renderer
+        params = ShoppingCartDownloadSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if params.validated_data['async']:
+            job = enqueue_export(request.user, renderer.format)
+            return Response(
+                ShoppingListExportSerializer(
+                    job, context={'request': request}
+                ).data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': request.build_absolute_uri(reverse(
+                    'api:recipes-shopping_cart_export',
+                    kwargs={'job_id': job.id}
+                ))}
+            )
+        return shopping_list_response(
+            iter_shopping_list(request.user.id),
+            renderer.format,
+            get_content_type(renderer)
+        )
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        url_path=r'download_shopping_cart/(?P<job_id>\d+)',
+        url_name='shopping_cart_export',
+    )
+    def shopping_cart_export(self, request, job_id):
+        """Состояние фоновой выгрузки; готовый файл - редиректом."""
+        job = get_object_or_404(
+            ShoppingListExport, id=job_id, user=request.user
+        )
+        if job.status == ShoppingListExport.DONE:
+            return Response(
+                status=status.HTTP_303_SEE_OTHER,
+                headers={'Location': request.build_absolute_uri(reverse(
+                    'api:recipes-shopping_cart_export_file',
+                    kwargs={'job_id': job.id}
+                ))}
+            )
+        headers = {}
+        if job.status != ShoppingListExport.FAILED:
+            headers['Retry-After'] = 1
+        return Response(
+            ShoppingListExportSerializer(
+                job, context={'request': request}
+            ).data,
+            headers=headers
+        )
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        url_path=r'download_shopping_cart/(?P<job_id>\d+)/file',
+        url_name='shopping_cart_export_file',
+    )
+    def shopping_cart_export_file(self, request, job_id):
+        """Готовый файл выгрузки; чужие и неготовые - 404."""
+        job = get_object_or_404(
+            ShoppingListExport, id=job_id, user=request.user,
+            status=ShoppingListExport.DONE
+        )
+        if not job.file or not job.file.storage.exists(job.file.name):
+            raise Http404
+        return export_file_response(
+            job, get_content_type(FILE_RENDERERS[job.file_format])
+        )
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+    )
+    def feed(self, request):
+        """Метод для вывода новых рецептов авторов из подписок.
+
+        Страница (всегда по курсору) выбирается по индексу ленты
+        пользователя, затем загружаются её рецепты.
+        """
+        recipes = self.filter_queryset(Recipe.objects.all())
+        paginator = MergedKeysetPagination(self.feed_cursor_ordering)
+        entries = paginator.paginate_queryset(get_feed_sources(
+            request.user.id,
+            recipes if recipes.query.has_filters() else None
+        ), request, self)
+        recipes = Recipe.objects.with_related().in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        page = [
+            recipes[entry.recipe_id] for entry in entries
+            if entry.recipe_id in recipes
+        ]
+        mark_recipes(page, request.user)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_list',
+        url_name='shopping_list',
+    )
+    def shopping_list(self, request):
+        """Метод для вывода сводного списка покупок."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
@@ -130,6 +271,11 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == 'json':
+            return tags_snapshot.response(request)
+        return super().list(request, *args, **kwargs)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для обработки запросов, связанных с ингредиентами."""
@@ -139,12 +285,34 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        # Пустое после strip название, как и в IngredientFilter,
+        # не фильтрует: отдаётся весь справочник.
+        name = request.query_params.get('name', '').strip()
+        if name:
+            return Response(search_ingredients(name))
+        return ingredients_snapshot.response(request)
+
 
 class UserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPagination
 
+    @property
+    def cursor_ordering(self):
+        if self.action == 'subscriptions':
+            return ('-subscription_id',)
+        return None
+
+    def get_recipes_limit(self):
+        serializer = RecipesLimitSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        # Как и раньше, 0 означает «без ограничения».
+        return serializer.validated_data.get('recipes_limit') or None
+
     def get_permissions(self):
         if self.action == 'me':
             return [IsAuthenticated()]
@@ -156,11 +324,22 @@ class UserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(follow__user=user)
-        pages = self.paginate_queryset(queryset)
+        """Подписки с превью рецептов: число запросов не зависит
+        от размера страницы."""
+        recipes_limit = self.get_recipes_limit()
+        queryset = User.objects.filter(follow__user=request.user).annotate(
+            subscription_id=F('follow__id'),
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True)
+        ).order_by('-subscription_id')
+        authors = self.paginate_queryset(queryset)
+        previews = Recipe.objects.previews(
+            [author.id for author in authors], recipes_limit
+        )
+        for author in authors:
+            author.recipe_previews = previews[author.id]
         serializer = FollowSerializer(
-            pages, many=True, context={'request': request}
+            authors, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
@@ -173,6 +352,7 @@ class UserViewSet(UserViewSet):
         user = request.user
         author = get_object_or_404(User, id=id)
         if request.method == 'POST':
+            recipes_limit = self.get_recipes_limit()
             data = {
                 'user': user.id,
                 'author': id
@@ -180,7 +360,11 @@ class UserViewSet(UserViewSet):
             subscribe = FollowCreateSerializer(data=data)
             subscribe.is_valid(raise_exception=True)
             subscribe.save()
-            serializer = FollowSerializer(author, context={'request': request})
+            author.is_subscribed = True
+            serializer = FollowSerializer(author, context={
+                'request': request,
+                'recipes_limit': recipes_limit
+            })
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         deleted_count, _ = (
             Follow.objects.filter(user=user, author=author).delete()
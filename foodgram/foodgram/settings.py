@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -16,6 +17,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'rest_framework',
     'django_filters',
@@ -27,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -35,6 +38,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -75,6 +79,28 @@ DATABASES = {
     }
 }
 
+# Кэш хранит версии и наборы, общие для всех воркеров gunicorn,
+# контейнеров (backend, export_worker) и команд manage.py, поэтому
+# по умолчанию это memcached из docker-compose. Под manage.py test -
+# кэш в памяти процесса.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.memcached.PyMemcacheCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'memcached:11211'),
+    }
+}
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    SILENCED_SYSTEM_CHECKS = ['api.W001']
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -152,6 +178,8 @@ CORS_ORIGIN_WHITELIST = [
 CSV_FILES_DIR = BASE_DIR / 'data'
 
 PAGE_SIZE = 6
+# Наибольшее значение recipes_limit в подписках
+RECIPES_LIMIT_MAX = 100
 NAME_MAX_LENGTH = 200
 SLUG_MAX_LENGTH = 100
 COLOR_MAX_LENGTH = 7
@@ -159,3 +187,123 @@ NAME_MAX_LENGTH_USER = 150
 NAME_MAX_LENGTH_EMAIL = 254
 MAX_VALUE = 32767
 MIN_VALUE = 1
+RECIPE_STATE_CACHE = 'default'
+RECIPE_STATE_CACHE_TIMEOUT = 60 * 60
+RESPONSE_CACHE = 'default'
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+REFERENCE_CACHE_MAX_AGE = 60 * 10
+# api.autocomplete.PostgresIngredientSearch - поиск средствами PostgreSQL
+INGREDIENT_SEARCH_BACKEND = os.getenv(
+    'INGREDIENT_SEARCH_BACKEND', 'api.autocomplete.MemoryIngredientSearch'
+)
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SIMILARITY = 0.3
+RECIPE_SEARCH_CONFIG = 'russian'
+PDF_SPOOL_MAX_SIZE = 1024 * 1024
+# Фоновая выгрузка списка покупок: thread - пул потоков в процессе
+# веб-сервера, db - очередь в базе, задания выполняет run_export_jobs.
+SHOPPING_LIST_EXPORT_RUNNER = os.getenv('SHOPPING_LIST_EXPORT_RUNNER', 'thread')
+SHOPPING_LIST_EXPORT_WORKERS = int(
+    os.getenv('SHOPPING_LIST_EXPORT_WORKERS', 2)
+)
+# Готовые выгрузки лежат вне MEDIA_ROOT под случайными именами и
+# отдаются только владельцу: через nginx (X-Accel-Redirect с префиксом
+# внутреннего location SHOPPING_LIST_EXPORT_ACCEL_PREFIX) или, если
+# префикс пуст, самим Django.
+SHOPPING_LIST_EXPORT_ROOT = os.getenv(
+    'SHOPPING_LIST_EXPORT_ROOT', str(BASE_DIR / 'private' / 'shopping_lists')
+)
+SHOPPING_LIST_EXPORT_ACCEL_PREFIX = os.getenv(
+    'SHOPPING_LIST_EXPORT_ACCEL_PREFIX', ''
+)
+SHOPPING_LIST_EXPORT_STALE = 60 * 10
+# Лента подписок: рецепты авторов, у которых подписчиков не меньше
+# FEED_FANOUT_LIMIT, не раскладываются по лентам, а читаются напрямую.
+# Лента хранит не больше FEED_BACKFILL_SIZE последних записей, столько же
+# рецептов автора добавляется при подписке.
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 100
+# Картинки рецептов: ограничения загрузки и уменьшенные копии.
+# IMAGE_PROCESSING: process - копии строятся в пуле процессов,
+# sync - сразу после сохранения рецепта.
+IMAGE_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_DIMENSION = 6000
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMAT = 'WEBP'
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_PROCESSING = os.getenv('IMAGE_PROCESSING', 'process')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Сборка мусора в media: файлы моложе MEDIA_GC_GRACE секунд не
+# трогаются (рецепт с ними может быть ещё не сохранён). Если задан
+# MEDIA_GC_QUARANTINE_DIR, файлы переносятся туда, а не удаляются.
+MEDIA_GC_GRACE = 60 * 60 * 24
+MEDIA_GC_QUARANTINE_DIR = os.getenv('MEDIA_GC_QUARANTINE_DIR', '')
+# Замеры run_benchmarks: базовые результаты и допустимое ухудшение.
+BENCHMARK_BASELINE = BASE_DIR / 'benchmarks' / 'baseline.json'
+BENCHMARK_THRESHOLD = 0.2
+# Замеры запросов (api.middleware.PerformanceMiddleware): заголовок
+# Server-Timing, строка в логе api.middleware и метрики /metrics.
+# Каждый воркер gunicorn пишет свои значения в METRICS_DIR не чаще
+# раза в METRICS_FLUSH_INTERVAL секунд; METRICS_DIR у каждого контейнера
+# свой, иначе файлы живых воркеров соседа сочтутся файлами завершившихся.
+# /metrics отдаётся сотрудникам и по заголовку
+# Authorization: Bearer <METRICS_TOKEN>.
+SERVER_TIMING = True
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/foodgram_metrics')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Строка JSON на запрос: PERFORMANCE_LOG_LEVEL=WARNING её отключает,
+# PERFORMANCE_LOG_HANDLER=file пишет в PERFORMANCE_LOG_FILE вместо
+# stderr. Под manage.py test строка не пишется.
+PERFORMANCE_LOG_HANDLERS = {
+    'console': {
+        'class': 'logging.StreamHandler',
+        'formatter': 'message',
+    },
+    'file': {
+        'class': 'logging.handlers.WatchedFileHandler',
+        'formatter': 'message',
+        'filename': os.getenv(
+            'PERFORMANCE_LOG_FILE', '/tmp/foodgram_requests.log'
+        ),
+    },
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'performance': PERFORMANCE_LOG_HANDLERS[
+            os.getenv('PERFORMANCE_LOG_HANDLER', 'console')
+        ],
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['performance'],
+            'level': 'WARNING' if TESTING else os.getenv(
+                'PERFORMANCE_LOG_LEVEL', 'INFO'
+            ),
+            'propagate': False,
+        },
+    },
+}
+# Профилирование запросов (api.middleware.ProfilingMiddleware):
+# заголовок X-Profile от сотрудника или со значением PROFILE_TOKEN
+# включает cProfile; доля PROFILE_SAMPLE_RATE запросов (по умолчанию 0,
+# выборка выключена) профилируется выборкой стека раз
+# в PROFILE_SAMPLE_INTERVAL секунд и сохраняется,
+# если запрос дольше PROFILE_SLOW_THRESHOLD секунд (не чаще раза
+# в PROFILE_SLOW_COOLDOWN секунд на процесс). Хранятся не больше
+# PROFILE_MAX_COUNT профилей не дольше PROFILE_RETENTION секунд.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_SLOW_THRESHOLD = float(os.getenv('PROFILE_SLOW_THRESHOLD', 1))
+PROFILE_SLOW_COOLDOWN = 60
+PROFILE_EXPLAIN_QUERIES = 5
+PROFILE_MAX_QUERIES = 1000
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_MAX_COUNT = 200
+PROFILE_RETENTION = 60 * 60 * 24 * 7
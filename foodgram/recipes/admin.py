@@ -1,8 +1,14 @@
 
 from django.contrib.admin import ModelAdmin, register
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     RequestProfile, ShoppingCart, ShoppingListExport,
+                     ShoppingListItem, Tag, TimelineEntry)
 
 
 @register(Recipe)
@@ -45,3 +51,84 @@ class IngredientAdmin(ModelAdmin):
 class ShoppingCart(ModelAdmin):
     list_display = ('id', 'user', 'recipe')
     search_fields = ('user', 'recipe')
+
+
+@register(ShoppingListItem)
+class ShoppingListItemAdmin(ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    search_fields = ('user__username', 'ingredient__name')
+
+
+@register(ShoppingListExport)
+class ShoppingListExportAdmin(ModelAdmin):
+    list_display = ('id', 'user', 'file_format', 'status', 'created')
+    list_filter = ('status', 'file_format')
+    search_fields = ('user__username',)
+
+
+@register(TimelineEntry)
+class TimelineEntryAdmin(ModelAdmin):
+    list_display = ('id', 'user', 'recipe', 'pub_date')
+    search_fields = ('user__username',)
+
+
+@register(RequestProfile)
+class RequestProfileAdmin(ModelAdmin):
+    list_display = (
+        'created', 'method', 'path', 'view', 'status', 'duration',
+        'query_count', 'trigger', 'download'
+    )
+    list_filter = ('trigger', 'view', 'status')
+    search_fields = ('path', 'view')
+    exclude = ('profile',)
+    readonly_fields = (
+        'created', 'user', 'trigger', 'method', 'path', 'view', 'status',
+        'duration', 'query_count', 'query_time', 'profile_format',
+        'download', 'report_text'
+    )
+    extensions = {
+        RequestProfile.PSTATS: 'prof',
+        RequestProfile.FOLDED: 'folded',
+    }
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('profile', 'report')
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:profile_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='recipes_requestprofile_download',
+            ),
+        ] + super().get_urls()
+
+    def download_view(self, request, profile_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_object_or_404(RequestProfile, id=profile_id)
+        response = HttpResponse(
+            bytes(profile.profile), content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename=profile-{profile.id}.'
+            f'{self.extensions[profile.profile_format]}'
+        )
+        return response
+
+    def download(self, obj):
+        return format_html('<a href="{}">{}</a>', reverse(
+            'admin:recipes_requestprofile_download', args=(obj.id,)
+        ), obj.get_profile_format_display())
+
+    download.short_description = 'Файл профиля'
+
+    def report_text(self, obj):
+        return format_html(
+            '<pre style="white-space: pre-wrap">{}</pre>', obj.report
+        )
+
+    report_text.short_description = 'Отчёт'
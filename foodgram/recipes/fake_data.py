@@ -0,0 +1,299 @@
+import io
+import json
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from PIL import Image, ImageDraw
+
+from recipes.images import render_variants, store_variants
+from recipes.loader import batches, copy_rows, insert_batch
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag,
+                            TimelineEntry)
+from recipes.search import get_search_backend
+from recipes.shopping_list import fill_shopping_lists
+from recipes.timeline import fill_timelines, update_followers_counts
+from users.models import Follow, User
+
+LOCALE = 'ru_RU'
+# Названия и описания рецептов берутся из заранее созданного набора:
+# Faker на каждую строку заметно медленнее вставки.
+TEXT_POOL_SIZE = 1000
+IMAGE_COUNT = 8
+IMAGE_SIZE = (1280, 960)
+PUB_DATE_DAYS = 365
+COOKING_TIME = (5, 180)
+AMOUNT = (1, 1000)
+MAX_RECIPE_TAGS = 3
+FILL_BATCH_SIZE = 1000
+
+USER_FIELDS = (
+    'id', 'password', 'is_superuser', 'username', 'first_name',
+    'last_name', 'email', 'is_staff', 'is_active', 'date_joined',
+    'followers_count'
+)
+RECIPE_FIELDS = (
+    'id', 'author_id', 'name', 'text', 'image', 'image_variants',
+    'cooking_time', 'pub_date'
+)
+
+
+def get_cum_weights(count, skew):
+    """Накопленные веса степенного распределения: элемент с номером k
+    по популярности выбирается в k ** skew раз реже первого."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class FakeDataGenerator:
+    """Генератор данных для нагрузочных тестов, детерминированный по seed.
+
+    Популярность авторов, рецептов и ингредиентов подчиняется
+    степенному закону: немногие авторы пишут большую часть рецептов и
+    собирают большую часть подписок, немногие рецепты - большую часть
+    избранного и корзин. Строки вставляются пачками напрямую, минуя
+    модели и сигналы; производные таблицы (списки покупок, ленты,
+    поисковый индекс) заполняются в конце.
+    """
+
+    def __init__(self, seed=0, skew=1.0, batch_size=10000, use_copy=False,
+                 progress=None):
+        self.random = random.Random(seed)
+        self.faker = Faker(LOCALE)
+        self.faker.seed_instance(seed)
+        self.skew = skew
+        self.batch_size = batch_size
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.progress = progress or (lambda table, count: None)
+        self.now = timezone.now()
+        self.counts = {}
+
+    def insert(self, model, fields, rows):
+        table = model._meta.db_table
+        self.counts[table] = 0
+
+        def counted(rows):
+            for row in rows:
+                self.counts[table] += 1
+                yield row
+
+        if self.use_copy:
+            copy_rows(model, fields, counted(rows))
+            self.progress(table, self.counts[table])
+            return
+        for batch in batches(counted(rows), self.batch_size):
+            insert_batch(model, fields, batch)
+            self.progress(table, self.counts[table])
+
+    def rank(self, ids):
+        """Случайный порядок популярности и веса для random.choices."""
+        ids = list(ids)
+        self.random.shuffle(ids)
+        return ids, get_cum_weights(len(ids), self.skew)
+
+    def pick(self, ranked, count):
+        """До count разных элементов с учётом популярности."""
+        ids, cum_weights = ranked
+        if not count or not ids:
+            return set()
+        return set(self.random.choices(ids, cum_weights=cum_weights, k=count))
+
+    def get_count(self, mean):
+        """Количество со средним около mean и длинным хвостом."""
+        if mean <= 0:
+            return 0
+        return int(self.random.expovariate(1 / mean))
+
+    def get_date(self):
+        seconds = self.random.random() * PUB_DATE_DAYS * 24 * 60 * 60
+        return connection.ops.adapt_datetimefield_value(
+            self.now - timedelta(seconds=seconds)
+        )
+
+    @staticmethod
+    def get_next_id(model):
+        return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def create_images(self):
+        """Несколько картинок на все рецепты: в хранилище с именами по
+        содержимому каждая лежит один раз, копии строятся сразу."""
+        field = Recipe._meta.get_field('image')
+        images = []
+        for _ in range(IMAGE_COUNT):
+            image = Image.new('RGB', IMAGE_SIZE, self.get_color())
+            width, height = IMAGE_SIZE
+            ImageDraw.Draw(image).ellipse(
+                (width // 4, height // 4, width * 3 // 4, height * 3 // 4),
+                fill=self.get_color()
+            )
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=85)
+            content = output.getvalue()
+            name = field.storage.save(
+                field.generate_filename(None, 'fake.jpg'),
+                ContentFile(content)
+            )
+            variants = store_variants(name, render_variants(
+                content,
+                settings.IMAGE_VARIANT_WIDTHS,
+                settings.IMAGE_VARIANT_FORMAT,
+                settings.IMAGE_VARIANT_QUALITY
+            ))
+            images.append((name, json.dumps(variants)))
+        return images
+
+    def get_color(self):
+        return tuple(self.random.randrange(256) for _ in range(3))
+
+    def create_users(self, count, password):
+        start = self.get_next_id(User)
+        password = make_password(password)
+
+        def rows():
+            for user_id in range(start, start + count):
+                username = f'{self.faker.user_name()}{user_id}'
+                yield (
+                    user_id, password, False, username,
+                    self.faker.first_name(), self.faker.last_name(),
+                    f'{username}@{self.faker.free_email_domain()}',
+                    False, True, self.get_date(), 0
+                )
+
+        self.insert(User, USER_FIELDS, rows())
+        return range(start, start + count)
+
+    def create_recipes(self, count, authors):
+        start = self.get_next_id(Recipe)
+        images = self.create_images()
+        names = [
+            self.faker.sentence(nb_words=3).rstrip('.')[
+                :settings.NAME_MAX_LENGTH
+            ] for _ in range(TEXT_POOL_SIZE)
+        ]
+        texts = [
+            self.faker.paragraph(nb_sentences=5)
+            for _ in range(TEXT_POOL_SIZE)
+        ]
+        author_ids, cum_weights = authors
+
+        def rows():
+            for recipe_id in range(start, start + count):
+                (author_id,) = self.random.choices(
+                    author_ids, cum_weights=cum_weights
+                )
+                image, variants = self.random.choice(images)
+                yield (
+                    recipe_id, author_id, self.random.choice(names),
+                    self.random.choice(texts), image, variants,
+                    self.random.randint(*COOKING_TIME), self.get_date()
+                )
+
+        self.insert(Recipe, RECIPE_FIELDS, rows())
+        return range(start, start + count)
+
+    def create_recipe_ingredients(self, recipe_ids, mean):
+        ingredients = self.rank(
+            Ingredient.objects.values_list('id', flat=True)
+        )
+
+        def rows():
+            for recipe_id in recipe_ids:
+                count = self.random.randint(1, max(2 * mean - 1, 1))
+                for ingredient_id in self.pick(ingredients, count):
+                    yield (
+                        recipe_id, ingredient_id,
+                        self.random.randint(*AMOUNT)
+                    )
+
+        self.insert(
+            IngredientInRecipe, ('recipe_id', 'ingredient_id', 'amount'),
+            rows()
+        )
+
+    def create_recipe_tags(self, recipe_ids):
+        tag_ids = list(Tag.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+
+        def rows():
+            for recipe_id in recipe_ids:
+                count = self.random.randint(
+                    1, min(MAX_RECIPE_TAGS, len(tag_ids))
+                )
+                for tag_id in self.random.sample(tag_ids, count):
+                    yield recipe_id, tag_id
+
+        self.insert(Recipe.tags.through, ('recipe_id', 'tag_id'), rows())
+
+    def create_follows(self, user_ids, authors, mean):
+        def rows():
+            for user_id in user_ids:
+                author_ids = self.pick(authors, self.get_count(mean))
+                author_ids.discard(user_id)
+                for author_id in author_ids:
+                    yield user_id, author_id
+
+        self.insert(Follow, ('user_id', 'author_id'), rows())
+
+    def create_user_recipes(self, model, user_ids, recipes, mean):
+        """Избранное или корзина: (пользователь, рецепт)."""
+        def rows():
+            for user_id in user_ids:
+                for recipe_id in self.pick(recipes, self.get_count(mean)):
+                    yield user_id, recipe_id
+
+        self.insert(model, ('user_id', 'recipe_id'), rows())
+
+    @staticmethod
+    def reset_sequences():
+        """PostgreSQL: id вставлялись явно, последовательности нужно
+        передвинуть за них."""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), (User, Recipe)
+            ):
+                cursor.execute(sql)
+
+    def generate(self, users=1000, recipes=10000, ingredients=8, follows=20,
+                 favorites=30, cart=5, password='foodgram'):
+        """Создаёт данные; ingredients, follows, favorites и cart -
+        средние количества на рецепт или пользователя.
+        Возвращает {таблица: вставлено строк}."""
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            raise ValueError(
+                'Сначала загрузите справочники: load_ingredients, load_tags'
+            )
+        with transaction.atomic():
+            user_ids = self.create_users(users, password)
+            authors = self.rank(user_ids)
+            recipe_ids = self.create_recipes(recipes, authors)
+            self.create_recipe_ingredients(recipe_ids, ingredients)
+            self.create_recipe_tags(recipe_ids)
+            self.create_follows(user_ids, authors, follows)
+            update_followers_counts()
+            popular_recipes = self.rank(recipe_ids)
+            self.create_user_recipes(
+                Favorite, user_ids, popular_recipes, favorites
+            )
+            self.create_user_recipes(
+                ShoppingCart, user_ids, popular_recipes, cart
+            )
+            self.reset_sequences()
+            for table, fill in (
+                (ShoppingListItem._meta.db_table, fill_shopping_lists),
+                (TimelineEntry._meta.db_table, fill_timelines),
+            ):
+                self.counts[table] = 0
+                for batch in batches(user_ids, FILL_BATCH_SIZE):
+                    self.counts[table] += fill(batch)
+                    self.progress(table, self.counts[table])
+        get_search_backend().rebuild()
+        return self.counts
@@ -0,0 +1,202 @@
+import base64
+import io
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Длина куска base64 кратна 4, поэтому куски декодируются независимо.
+BASE64_CHUNK = 64 * 1024
+
+
+class ImageError(ValueError):
+    """Картинка не прошла проверку размера или формата."""
+
+
+def get_decoded_size(data):
+    return len(data) * 3 // 4 - data[-2:].count('=')
+
+
+def decode_base64(data, name, content_type):
+    """Декодирует base64 в файл, не держа в памяти лишних копий.
+
+    Размер проверяется до декодирования. Большие картинки
+    (больше FILE_UPLOAD_MAX_MEMORY_SIZE) декодируются по кускам
+    во временный файл на диске, как обычные загрузки Django.
+    Переводы строк и пробелы (base64 по 76 символов в строке)
+    убираются до проверки.
+    """
+    data = ''.join(data.split())
+    size = get_decoded_size(data)
+    if size > settings.IMAGE_MAX_SIZE:
+        raise ImageError(
+            'Размер картинки не должен превышать '
+            f'{settings.IMAGE_MAX_SIZE // (1024 * 1024)} МБ.'
+        )
+    try:
+        if size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            return ContentFile(base64.b64decode(data, validate=True), name)
+        file = TemporaryUploadedFile(name, content_type, size, None)
+        for start in range(0, len(data), BASE64_CHUNK):
+            file.write(base64.b64decode(
+                data[start:start + BASE64_CHUNK], validate=True
+            ))
+    except ValueError:
+        # binascii.Error или символы не из ASCII.
+        raise ImageError('Некорректная строка base64.')
+    file.seek(0)
+    return file
+
+
+def check_dimensions(file):
+    """Проверяет ширину и высоту по заголовку картинки, не декодируя
+    её целиком. Нераспознанные файлы отклонит ImageField."""
+    message = (
+        'Ширина и высота картинки не должны превышать '
+        f'{settings.IMAGE_MAX_DIMENSION} px.'
+    )
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise ImageError(message)
+    except OSError:
+        return
+    finally:
+        file.seek(0)
+    if max(width, height) > settings.IMAGE_MAX_DIMENSION:
+        raise ImageError(message)
+
+
+def render_variants(content, widths, image_format, quality):
+    """Уменьшенные копии картинки: [(ширина, байты)].
+
+    Выполняется в отдельном процессе, поэтому не обращается к Django.
+    Копии шире оригинала не делаются.
+    """
+    variants = []
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        mode = 'RGBA' if 'A' in image.getbands() else 'RGB'
+        if image_format == 'JPEG':
+            mode = 'RGB'
+        image = image.convert(mode)
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+            height = max(round(image.height * width / image.width), 1)
+            output = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(
+                output, image_format, quality=quality
+            )
+            variants.append((width, output.getvalue()))
+    return variants
+
+
+def get_variant_name(name, width):
+    path = PurePosixPath(name)
+    extension = settings.IMAGE_VARIANT_FORMAT.lower()
+    return str(path.parent / 'variants' / f'{path.stem}-{width}.{extension}')
+
+
+def store_variants(name, variants):
+    """Записывает копии в хранилище: {ширина: имя файла}."""
+    names = {}
+    for width, content in variants:
+        variant_name = get_variant_name(name, width)
+        if not default_storage.exists(variant_name):
+            variant_name = default_storage.save(
+                variant_name, ContentFile(content)
+            )
+        names[str(width)] = variant_name
+    return names
+
+
+def save_variants(recipe_id, name, variants):
+    """Сохраняет копии и записывает их в рецепт, если картинка рецепта
+    за это время не сменилась."""
+    names = store_variants(name, variants)
+    # Копии не удаляются, даже если рецепт сменил картинку: та же
+    # картинка может быть у другого рецепта.
+    recipe = Recipe.objects.filter(id=recipe_id, image=name).first()
+    if recipe is None:
+        return
+    recipe.image_variants = names
+    recipe.save(update_fields=('image_variants',))
+
+
+def read_image(name):
+    with default_storage.open(name) as file:
+        return file.read()
+
+
+def render_image(name):
+    return render_variants(
+        read_image(name),
+        settings.IMAGE_VARIANT_WIDTHS,
+        settings.IMAGE_VARIANT_FORMAT,
+        settings.IMAGE_VARIANT_QUALITY
+    )
+
+
+def build_variants(recipe_id, name):
+    """Строит копии в текущем процессе."""
+    save_variants(recipe_id, name, render_image(name))
+
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS
+            )
+    return executor
+
+
+def on_rendered(recipe_id, name, future):
+    try:
+        save_variants(recipe_id, name, future.result())
+    except Exception:
+        logger.exception('Не удалось сохранить копии картинки %s', name)
+    finally:
+        connection.close()
+
+
+def submit(recipe_id, name):
+    if settings.IMAGE_PROCESSING == 'sync':
+        build_variants(recipe_id, name)
+        return
+    future = get_executor().submit(
+        render_variants,
+        read_image(name),
+        settings.IMAGE_VARIANT_WIDTHS,
+        settings.IMAGE_VARIANT_FORMAT,
+        settings.IMAGE_VARIANT_QUALITY
+    )
+    future.add_done_callback(
+        lambda future: on_rendered(recipe_id, name, future)
+    )
+
+
+def schedule_variants(recipe):
+    """После коммита строит уменьшенные копии картинки рецепта
+    в пуле процессов (IMAGE_PROCESSING='process') или сразу ('sync')."""
+    recipe_id, name = recipe.id, recipe.image.name
+    transaction.on_commit(lambda: submit(recipe_id, name))
@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+from itertools import islice
+from pathlib import Path
+
+from django.db import connection, transaction
+
+from recipes.models import Ingredient, Tag
+
+# Поля справочников в порядке колонок CSV.
+REFERENCE_MODELS = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit')),
+    'tags': (Tag, ('name', 'slug', 'color')),
+}
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(file, fields):
+    """Строки CSV без заголовка (или с заголовком из имён полей)."""
+    for row in csv.reader(file):
+        if not row or tuple(row) == fields:
+            continue
+        yield dict(zip(fields, row))
+
+
+def iter_ndjson(file, fields):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json(file, fields):
+    """Элементы JSON-массива по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = finished = False
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        while not finished:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise ValueError('Ожидался JSON-массив')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer.startswith(','):
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith(']'):
+                finished = True
+                break
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            yield item
+            buffer = buffer[end:]
+    if not finished:
+        raise ValueError('JSON-массив не закончен')
+
+
+READERS = {
+    '.csv': iter_csv,
+    '.json': iter_json,
+    '.ndjson': iter_ndjson,
+    '.jsonl': iter_ndjson,
+}
+
+
+def iter_rows(path, fields, file_format=None):
+    """Записи файла как кортежи значений fields."""
+    reader = READERS[file_format or Path(path).suffix.lower()]
+    with open(path, encoding='utf-8', newline='') as file:
+        for number, item in enumerate(reader(file, fields), 1):
+            try:
+                yield tuple(str(item[field]).strip() for field in fields)
+            except (KeyError, TypeError):
+                raise ValueError(
+                    f'Запись {number}: нужны поля {", ".join(fields)}'
+                )
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_columns(model, fields):
+    return ', '.join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+
+
+def insert_batch(model, fields, rows):
+    """INSERT ... ON CONFLICT DO NOTHING: уже загруженные строки
+    пропускаются, поэтому загрузку можно повторять.
+
+    Запрос собирается напрямую, без создания объектов моделей:
+    для миллиона строк это основная часть времени загрузки.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = get_columns(model, fields)
+    if connection.vendor == 'postgresql':
+        from psycopg2.extras import execute_values
+
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor.cursor,
+                f'INSERT INTO {table} ({columns}) VALUES %s '
+                'ON CONFLICT DO NOTHING',
+                rows,
+                page_size=len(rows)
+            )
+    elif connection.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(fields))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+                'ON CONFLICT DO NOTHING',
+                rows
+            )
+    else:
+        model.objects.bulk_create(
+            (model(**dict(zip(fields, row))) for row in rows),
+            ignore_conflicts=True
+        )
+
+
+class RowsFile:
+    """Файлоподобный объект с CSV-представлением строк для COPY."""
+
+    def __init__(self, rows):
+        self.chunks = self.iter_chunks(rows)
+        self.buffer = b''
+
+    @staticmethod
+    def iter_chunks(rows):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for batch in batches(rows, 1000):
+            writer.writerows(batch)
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_rows(model, fields, rows):
+    """PostgreSQL: COPY во временную таблицу и перенос в справочник
+    одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+
+    Внутри внешней транзакции (generate_fake_data) atomic - только точка
+    сохранения и ON COMMIT DROP срабатывает лишь в конце, поэтому
+    временная таблица удаляется явно после переноса.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = get_columns(model, fields)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE reference_staging ON COMMIT DROP '
+            f'AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY reference_staging ({columns}) FROM STDIN WITH CSV',
+            RowsFile(rows)
+        )
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT DISTINCT {columns} FROM reference_staging '
+            'ON CONFLICT DO NOTHING'
+        )
+        cursor.execute('DROP TABLE reference_staging')
+
+
+def load_reference_data(name, path, file_format=None, batch_size=5000,
+                        use_copy=False, progress=None):
+    """Загружает справочник из CSV, JSON или NDJSON пачками.
+
+    Повторный запуск безопасен: существующие записи не меняются.
+    Возвращает (прочитано строк, добавлено записей).
+    """
+    model, fields = REFERENCE_MODELS[name]
+    before = model.objects.count()
+    read = 0
+
+    def counted(rows):
+        nonlocal read
+        for read, row in enumerate(rows, 1):
+            if progress is not None and read % batch_size == 0:
+                progress(read)
+            yield row
+
+    rows = counted(iter_rows(path, fields, file_format))
+    if use_copy and connection.vendor == 'postgresql':
+        copy_rows(model, fields, rows)
+    else:
+        for batch in batches(rows, batch_size):
+            with transaction.atomic():
+                insert_batch(model, fields, batch)
+    return read, model.objects.count() - before
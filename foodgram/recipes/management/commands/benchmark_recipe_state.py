@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from recipes.user_state import favorites, mark_recipes, shopping_cart
+from users.models import User
+
+
+# python3 manage.py benchmark_recipe_state --recipes 100000 - сравнение
+# подзапросов Exists и кэша id рецептов пользователя
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """Команда для сравнения способов отметки избранного и покупок"""
+
+    help = ('Сравнение подзапросов Exists и кэша id рецептов '
+            'на синтетических данных (данные откатываются)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--marked', type=int, default=2000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, recipes, marked, page_size, repeat, seed, **options):
+        rnd = random.Random(seed)
+        user = User.objects.create(
+            username='benchmark', email='benchmark@example.com'
+        )
+        Recipe.objects.bulk_create(
+            (Recipe(author=user, name=f'Рецепт {number}', text='-',
+                    image='recipes_images/benchmark.png', cooking_time=1)
+             for number in range(recipes)),
+            batch_size=5000
+        )
+        recipe_ids = list(
+            Recipe.objects.filter(author=user).values_list('id', flat=True)
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                (model(user=user, recipe_id=recipe_id)
+                 for recipe_id in rnd.sample(recipe_ids, marked)),
+                batch_size=5000
+            )
+        self.stdout.write(
+            f'Рецептов: {recipes}, отмечено: {marked}, страница: {page_size}'
+        )
+        pages = [
+            rnd.randrange(max(recipes - page_size, 1)) for _ in range(repeat)
+        ]
+        queryset = Recipe.objects.filter(author=user).order_by('id')
+
+        def subqueries(offset):
+            return list(queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe_id=OuterRef('id'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe_id=OuterRef('id')))
+            )[offset:offset + page_size])
+
+        def cached(offset):
+            page = list(queryset[offset:offset + page_size])
+            mark_recipes(page, user)
+            return page
+
+        favorites.get(user.id)
+        shopping_cart.get(user.id)
+        for name, fetch in (('Exists', subqueries), ('кэш', cached)):
+            timings = []
+            for offset in pages:
+                started = time.perf_counter()
+                fetch(offset)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{name:8} p50={statistics.median(timings):.2f} мс '
+                f'p95={timings[int(len(timings) * 0.95) - 1]:.2f} мс'
+            )
+        favorites.invalidate(user.id)
+        shopping_cart.invalidate(user.id)
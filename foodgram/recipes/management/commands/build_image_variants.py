@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+# python3 manage.py build_image_variants - команда для построения
+# уменьшенных копий фотографий рецептов
+
+
+class Command(BaseCommand):
+    """Команда для построения уменьшенных копий фотографий рецептов"""
+
+    help = 'Построение уменьшенных копий фотографий рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Перестроить копии и у рецептов, где они уже есть'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.values_list('id', 'image')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        count = 0
+        for recipe_id, name in recipes.iterator():
+            try:
+                build_variants(recipe_id, name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                continue
+            count += 1
+        print(f'Обработано рецептов: {count}')
@@ -0,0 +1,45 @@
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCart, ShoppingListItem
+from recipes.shopping_list import diff_shopping_list, rebuild_shopping_list
+
+
+# python3 manage.py check_shopping_lists [--fix] - команда для сверки
+# сводных списков покупок с корзинами пользователей
+
+
+class Command(BaseCommand):
+    """Команда для проверки сводных списков покупок"""
+
+    help = 'Сверка сводных списков покупок с корзинами пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Пересобрать списки, в которых найдены расхождения'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = set(chain(
+            ShoppingCart.objects.values_list('user_id', flat=True),
+            ShoppingListItem.objects.values_list('user_id', flat=True)
+        ))
+        broken = 0
+        for user_id in sorted(user_ids):
+            diff = diff_shopping_list(user_id)
+            if not diff:
+                continue
+            broken += 1
+            for ingredient_id, (stored, live) in sorted(diff.items()):
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id} '
+                    f'в таблице={stored} по корзине={live}'
+                )
+            if options['fix']:
+                rebuild_shopping_list(user_id)
+        self.stdout.write(
+            f'Проверено списков: {len(user_ids)}, с расхождениями: {broken}'
+            + (' (исправлены)' if options['fix'] and broken else '')
+        )
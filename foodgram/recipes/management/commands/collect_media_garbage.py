@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.media_gc import collect_garbage
+
+
+# python3 manage.py collect_media_garbage [--dry-run] [--interval N] -
+# команда для удаления фотографий, на которые не ссылаются рецепты
+
+
+class Command(BaseCommand):
+    """Команда для удаления неиспользуемых фотографий рецептов"""
+
+    help = 'Удаление фотографий рецептов, на которые нет ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько файлов будет удалено'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=settings.MEDIA_GC_GRACE,
+            help='Не трогать файлы моложе стольких секунд'
+        )
+        parser.add_argument(
+            '--quarantine', default=settings.MEDIA_GC_QUARANTINE_DIR,
+            help='Переносить файлы в этот каталог вместо удаления'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько файлов проверять одним запросом'
+        )
+        parser.add_argument(
+            '--interval', type=int,
+            help='Повторять каждые столько секунд'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count, size = collect_garbage(
+                options['grace'],
+                options['batch_size'],
+                dry_run=options['dry_run'],
+                quarantine=options['quarantine'] or None
+            )
+            action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+            self.stdout.write(
+                f'{action} файлов: {count}, {size // 1024} КиБ'
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import render_image, store_variants
+from recipes.models import Recipe
+from recipes.storage import recipe_image_storage
+
+
+# python3 manage.py dedupe_recipe_images - команда для перевода
+# фотографий рецептов на имена по содержимому
+
+
+class Command(BaseCommand):
+    """Команда для удаления дубликатов фотографий рецептов"""
+
+    help = (
+        'Переименовывает фотографии рецептов по sha256 содержимого, '
+        'удаляет дубликаты и обновляет пути в рецептах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет сделано'
+        )
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        recipes = defaultdict(list)
+        for recipe_id, name in Recipe.objects.exclude(
+            image=''
+        ).values_list('id', 'image').iterator():
+            recipes[name].append(recipe_id)
+        targets = {}
+        for name in recipes:
+            if not storage.exists(name):
+                self.stderr.write(f'Файл не найден: {name}')
+                continue
+            with storage.open(name) as file:
+                targets[name] = storage.get_content_name(name, file)
+        renamed = [name for name, target in targets.items() if name != target]
+        sizes = {name: storage.size(name) for name in targets}
+        new_targets = {
+            targets[name]: sizes[name] for name in renamed
+            if not storage.exists(targets[name])
+        }
+        freed = sum(sizes[name] for name in renamed) - sum(
+            new_targets.values()
+        )
+        self.stdout.write(
+            f'Файлов: {len(targets)}, уникальных: '
+            f'{len(set(targets.values()))}, к переименованию: '
+            f'{len(renamed)}, освободится около {freed // 1024} КиБ'
+        )
+        if options['dry_run']:
+            return
+        variants = {}
+        for name in renamed:
+            target = targets[name]
+            with storage.open(name) as file:
+                storage.save(name, file)
+            # Копии старого файла названы по его имени: строим их для
+            # нового имени один раз на файл и записываем во все рецепты.
+            if target not in variants:
+                try:
+                    variants[target] = store_variants(
+                        target, render_image(target)
+                    )
+                except (OSError, ValueError) as error:
+                    self.stderr.write(
+                        f'Копии {target} не построены: {error}'
+                    )
+                    variants[target] = {}
+            for recipe in Recipe.objects.filter(id__in=recipes[name]):
+                recipe.image = target
+                recipe.image_variants = variants[target]
+                recipe.save(update_fields=('image', 'image_variants'))
+            storage.delete(name)
+        self.stdout.write('Фотографии рецептов переименованы')
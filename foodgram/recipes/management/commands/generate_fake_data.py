@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.fake_data import FakeDataGenerator
+from recipes.models import Recipe
+from recipes.signals import recipes_bulk_created
+
+
+# python3 manage.py generate_fake_data --users 100000 --recipes 1000000
+# - команда для наполнения базы данными для нагрузочных тестов
+
+
+class Command(BaseCommand):
+    """Команда для генерации пользователей, рецептов, подписок,
+    избранного и корзин с реалистичным распределением популярности"""
+
+    help = 'Генерация данных для нагрузочных тестов (повторяемая по --seed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients', type=int, default=8,
+            help='Среднее число ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Среднее число рецептов в избранном'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Среднее число рецептов в корзине'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Показатель степенного закона популярности'
+        )
+        parser.add_argument(
+            '--password', default='foodgram',
+            help='Пароль всех созданных пользователей'
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='PostgreSQL: вставка через COPY во временную таблицу'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['recipes'] < 0:
+            raise CommandError('Нужен хотя бы один пользователь')
+        generator = FakeDataGenerator(
+            seed=options['seed'],
+            skew=options['skew'],
+            batch_size=options['batch_size'],
+            use_copy=options['copy'],
+            progress=lambda table, count: self.stdout.write(
+                f'{table}: {count}'
+            )
+        )
+        started = time.perf_counter()
+        try:
+            counts = generator.generate(
+                users=options['users'],
+                recipes=options['recipes'],
+                ingredients=options['ingredients'],
+                follows=options['follows'],
+                favorites=options['favorites'],
+                cart=options['cart'],
+                password=options['password']
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        recipes_bulk_created.send(sender=Recipe)
+        self.stdout.write(self.style.SUCCESS(
+            f'Вставлено строк: {sum(counts.values())} '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
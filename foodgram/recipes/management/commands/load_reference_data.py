@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.loader import READERS, REFERENCE_MODELS, load_reference_data
+from recipes.signals import reference_data_loaded
+
+
+# python3 manage.py load_reference_data ingredients data/ingredients.json
+# - команда для загрузки справочника из CSV, JSON или NDJSON
+
+
+class Command(BaseCommand):
+    """Команда для загрузки справочников в базу данных"""
+
+    help = 'Загрузка справочника из CSV, JSON или NDJSON (повторяемая)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(REFERENCE_MODELS))
+        parser.add_argument('path')
+        self.add_load_arguments(parser)
+
+    @staticmethod
+    def add_load_arguments(parser):
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла, если его не видно по расширению'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='PostgreSQL: загрузка через COPY во временную таблицу'
+        )
+
+    def load(self, name, path, options):
+        try:
+            read, added = load_reference_data(
+                name,
+                path,
+                file_format=options['format'],
+                batch_size=options['batch_size'],
+                use_copy=options['copy'],
+                progress=lambda count: self.stdout.write(
+                    f'Прочитано строк: {count}'
+                )
+            )
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        reference_data_loaded.send(sender=REFERENCE_MODELS[name][0])
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено записей: {added}'
+        ))
+
+    def handle(self, *args, **options):
+        self.load(options['name'], options['path'], options)
@@ -1,32 +1,23 @@
-import csv
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
-
-from recipes.models import Tag
+from recipes.management.commands.load_reference_data import (
+    Command as LoadReferenceDataCommand
+)
 
 
 # python3 manage.py load_tags - команда для загрузки тегов
 
 
-class Command(BaseCommand):
+class Command(LoadReferenceDataCommand):
     """Команда для загрузки тегов в базу данных """
 
     help = 'Загрузка тегов в базу данных'
 
-    def handle(self, *args, **kwargs):
-        csv_path = "recipes/management/commands/tags.csv"
-        with open(
-                csv_path, encoding='utf-8'
-        ) as file:
-            reader = csv.reader(file)
-            tags = [
-                Tag(
-                    name=row[0],
-                    slug=row[1],
-                    color=row[2]
-                )
-                for row in reader
-            ]
-            Tag.objects.bulk_create(tags)
-        print('Теги в базу данных загружены')
-        print('ADD', Tag.objects.count(), 'Tags')
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=Path(__file__).parent / 'tags.csv'
+        )
+        self.add_load_arguments(parser)
+
+    def handle(self, *args, **options):
+        self.load('tags', options['path'], options)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.search import get_search_backend
+
+
+# python3 manage.py rebuild_search_index - команда для пересборки
+# поискового индекса рецептов
+
+
+class Command(BaseCommand):
+    """Команда для пересборки поискового индекса рецептов"""
+
+    help = 'Пересборка поискового индекса рецептов'
+
+    def handle(self, *args, **kwargs):
+        get_search_backend().rebuild()
+        print('Поисковый индекс рецептов пересобран')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.timeline import rebuild_timelines
+
+
+# python3 manage.py rebuild_timelines - команда для пересборки
+# лент подписок по текущим подпискам
+
+
+class Command(BaseCommand):
+    """Команда для пересборки лент подписок"""
+
+    help = 'Пересборка лент подписок'
+
+    def handle(self, *args, **kwargs):
+        rebuild_timelines()
+        print('Ленты подписок пересобраны')
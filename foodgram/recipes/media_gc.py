@@ -0,0 +1,119 @@
+import os
+import shutil
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+
+from recipes.models import Recipe
+
+IMAGES_DIR = 'recipes_images'
+VARIANTS_DIR = 'variants'
+
+
+def scan_files(path, older_than):
+    """Файлы каталога (без подкаталогов), изменённые раньше older_than.
+    os.scandir не читает весь каталог в память."""
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if (entry.is_file(follow_symlinks=False)
+                    and entry.stat(follow_symlinks=False).st_mtime
+                    < older_than):
+                yield entry
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_extensions(path):
+    """Расширения фотографий в каталоге - обычно два-три."""
+    extensions = set()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                extensions.add(os.path.splitext(entry.name)[1])
+    return extensions
+
+
+def find_orphan_images(path, older_than, batch_size):
+    """Фотографии, на которые не ссылается ни один рецепт.
+
+    Ссылки проверяются пачками одним запросом IN, поэтому память
+    не зависит от числа файлов и рецептов.
+    """
+    for batch in batches(scan_files(path, older_than), batch_size):
+        names = {f'{IMAGES_DIR}/{entry.name}': entry for entry in batch}
+        referenced = set(Recipe.objects.filter(
+            image__in=names
+        ).values_list('image', flat=True))
+        for name, entry in names.items():
+            if name not in referenced:
+                yield entry
+
+
+def find_orphan_variants(path, extensions, older_than, batch_size):
+    """Уменьшенные копии (<имя>-<ширина>.<формат>), у которых
+    фотография-источник больше не используется."""
+    for batch in batches(scan_files(path, older_than), batch_size):
+        sources = {
+            entry: [
+                f'{IMAGES_DIR}/{entry.name.rsplit("-", 1)[0]}{extension}'
+                for extension in extensions
+            ]
+            for entry in batch
+        }
+        referenced = set(Recipe.objects.filter(
+            image__in=[name for names in sources.values() for name in names]
+        ).values_list('image', flat=True))
+        for entry, names in sources.items():
+            if referenced.isdisjoint(names):
+                yield entry
+
+
+def collect_garbage(grace, batch_size, dry_run=False, quarantine=None):
+    """Удаляет (или переносит в quarantine) неиспользуемые фотографии
+    рецептов старше grace секунд. Возвращает (число файлов, байт)."""
+    root = Path(settings.MEDIA_ROOT)
+    images = root / IMAGES_DIR
+    if not images.is_dir():
+        return 0, 0
+    older_than = time.time() - grace
+    extensions = get_extensions(images)
+    orphans = [
+        find_orphan_images(images, older_than, batch_size),
+        find_orphan_variants(
+            images / VARIANTS_DIR, extensions, older_than, batch_size
+        ),
+    ]
+    count = size = 0
+    for entries in orphans:
+        for entry in entries:
+            # Время изменения перечитывается: файл мог быть загружен
+            # заново (ContentAddressedStorage.save) после обхода каталога.
+            try:
+                if os.stat(entry.path).st_mtime >= older_than:
+                    continue
+            except FileNotFoundError:
+                continue
+            count += 1
+            size += entry.stat(follow_symlinks=False).st_size
+            if dry_run:
+                continue
+            if quarantine is None:
+                os.remove(entry.path)
+                continue
+            target = Path(quarantine) / Path(entry.path).relative_to(root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(entry.path, target)
+    return count, size
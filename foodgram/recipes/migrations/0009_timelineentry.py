@@ -0,0 +1,97 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Значения FEED_FANOUT_LIMIT и FEED_BACKFILL_SIZE на момент миграции:
+# последующие изменения настроек не должны менять её результат.
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 100
+FILL_SQL = """
+    INSERT INTO {timeline} (user_id, recipe_id, author_id, pub_date)
+    SELECT follow.user_id, ranked.id, ranked.author_id, ranked.pub_date
+    FROM (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS feed_rank
+        FROM {recipe}
+    ) AS ranked
+    JOIN {follow} AS follow ON follow.author_id = ranked.author_id
+    WHERE ranked.feed_rank <= %s AND follow.author_id IN (
+        SELECT author_id FROM {follow}
+        GROUP BY author_id HAVING COUNT(*) < %s
+    )
+    ORDER BY follow.user_id
+"""
+TRIM_SQL = """
+    DELETE FROM {timeline} WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY pub_date DESC, recipe_id DESC
+            ) AS feed_rank
+            FROM {timeline}
+        ) AS ranked
+        WHERE ranked.feed_rank > %s
+    )
+"""
+
+
+def fill_timelines(apps, schema_editor):
+    """Ленты по всем подпискам двумя запросами: последние рецепты
+    авторов, затем обрезка лент до FEED_BACKFILL_SIZE записей."""
+    quote_name = schema_editor.quote_name
+    tables = {
+        name: quote_name(apps.get_model(app, model)._meta.db_table)
+        for name, app, model in (
+            ('timeline', 'recipes', 'TimelineEntry'),
+            ('recipe', 'recipes', 'Recipe'),
+            ('follow', 'users', 'Follow'),
+        )
+    }
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            FILL_SQL.format(**tables),
+            (FEED_BACKFILL_SIZE, FEED_FANOUT_LIMIT)
+        )
+        cursor.execute(TRIM_SQL.format(**tables), (FEED_BACKFILL_SIZE,))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0008_shoppinglistexport'),
+        ('users', '0004_follow_follow_user_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Рецепт в ленте',
+                'verbose_name_plural': 'Ленты подписок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.16 on 2026-10-17 05:47
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+import recipes.storage
+
+
+def remove_public_exports(apps, schema_editor):
+    """Прежние выгрузки лежали в публичном MEDIA_ROOT под именем из
+    хэша содержимого: файлы удаляются, задания сформируются заново."""
+    ShoppingListExport = apps.get_model('recipes', 'ShoppingListExport')
+    for name in ShoppingListExport.objects.exclude(
+        file=''
+    ).values_list('file', flat=True).iterator():
+        default_storage.delete(name)
+    ShoppingListExport.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_requestprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_public_exports, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shoppinglistexport',
+            name='file',
+            field=models.FileField(blank=True, storage=recipes.storage.PrivateExportStorage(), upload_to='', verbose_name='Файл'),
+        ),
+    ]
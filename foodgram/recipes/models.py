@@ -1,30 +1,73 @@
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (
     MinValueValidator, RegexValidator, MaxValueValidator
 )
 from django.db import models
 from django.conf import settings
-from django.db.models import Exists, OuterRef
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 
+from recipes.storage import export_storage, recipe_image_storage
 from users.models import User
 
 
 class AnnotationsManager(models.Manager):
-    def add_annotations(self, user):
-        queryset = self.get_queryset().annotate(
-            is_favorited=Exists(
-                Favorite.objects.filter(
-                    user=user,
-                    recipe_id=OuterRef('id'))
-            ),
-            is_in_shopping_cart=Exists(
-                ShoppingCart.objects.filter(
-                    user=user,
-                    recipe_id=OuterRef('id')
+    def with_related(self):
+        """Рецепты со всеми связанными объектами для сериализатора чтения.
+
+        Количество запросов не зависит от размера страницы: автор
+        подгружается JOIN-ом, теги и ингредиенты - отдельными
+        prefetch-запросами. Признак подписки на автора берётся
+        из набора подписок пользователя (recipes.user_state).
+        """
+        return self.get_queryset().defer(
+            'search_vector'
+        ).select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
                 )
             )
         )
 
-        return queryset
+    def previews(self, author_ids, limit=None):
+        """Первые limit рецептов каждого автора одним запросом:
+        {author_id: [recipe, ...]}.
+
+        Рецепты нумеруются оконной функцией ROW_NUMBER() в пределах
+        автора, поэтому запрос один при любом количестве авторов.
+        """
+        recipes = self.get_queryset().filter(
+            author_id__in=author_ids
+        ).only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id'
+        )
+        if limit is None:
+            recipes = recipes.order_by('author_id', 'name', 'id')
+        else:
+            ranked = recipes.order_by().annotate(
+                preview_rank=Window(
+                    RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=(F('name').asc(), F('id').asc())
+                )
+            )
+            sql, params = ranked.query.sql_with_params()
+            recipes = self.raw(
+                f'SELECT * FROM ({sql}) AS ranked '
+                'WHERE ranked.preview_rank <= %s '
+                'ORDER BY ranked.author_id, ranked.preview_rank',
+                (*params, limit)
+            )
+        previews = defaultdict(list)
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        return previews
 
 
 class Ingredient(models.Model):
@@ -103,7 +146,14 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         verbose_name='Фотография рецепта',
-        upload_to='recipes_images/'
+        upload_to='recipes_images/',
+        storage=recipe_image_storage
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии фотографии',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     cooking_time = models.PositiveSmallIntegerField(
         validators=[
@@ -129,12 +179,27 @@ class Recipe(models.Model):
         verbose_name='Список ингредиентов',
         related_name='recipes',
     )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        auto_now_add=True,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
     objects = AnnotationsManager()
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -229,3 +294,232 @@ class ShoppingCart(BaseModel):
                 name='unique_shopping_cart'
             )
         ]
+
+
+class ShoppingListItem(models.Model):
+    """Модель для сводного списка покупок пользователя"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE,
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Общее количество',
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+class ShoppingListExport(models.Model):
+    """Задание на формирование файла со списком покупок"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='shopping_list_exports',
+        on_delete=models.CASCADE,
+    )
+    file_format = models.CharField(
+        verbose_name='Формат',
+        max_length=10,
+    )
+    content_hash = models.CharField(
+        verbose_name='Хэш содержимого',
+        max_length=64,
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        max_length=10,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    file = models.FileField(
+        verbose_name='Файл',
+        storage=export_storage,
+        blank=True,
+    )
+    error = models.TextField(
+        verbose_name='Ошибка',
+        blank=True,
+    )
+    created = models.DateTimeField(
+        verbose_name='Создано',
+        auto_now_add=True,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Обновлено',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списка покупок'
+        ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'file_format', 'content_hash'),
+                name='unique_shopping_list_export'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('status', 'created'),
+                name='export_status_created_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.file_format} {self.status}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='timeline',
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        related_name='timeline_entries',
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор рецепта',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='timeline_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class RequestProfile(models.Model):
+    """Профиль запроса к API: cProfile или выборка стека и журнал SQL"""
+    HEADER = 'header'
+    SLOW = 'slow'
+    TRIGGERS = (
+        (HEADER, 'По заголовку X-Profile'),
+        (SLOW, 'Медленный запрос'),
+    )
+    PSTATS = 'pstats'
+    FOLDED = 'folded'
+    FORMATS = (
+        (PSTATS, 'cProfile (pstats)'),
+        (FOLDED, 'Выборка стека (folded stacks)'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='+',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    trigger = models.CharField(
+        verbose_name='Причина',
+        max_length=10,
+        choices=TRIGGERS,
+    )
+    method = models.CharField(
+        verbose_name='Метод',
+        max_length=10,
+    )
+    path = models.TextField(
+        verbose_name='Адрес',
+    )
+    view = models.CharField(
+        verbose_name='Вид',
+        max_length=settings.NAME_MAX_LENGTH,
+    )
+    status = models.PositiveSmallIntegerField(
+        verbose_name='Код ответа',
+    )
+    duration = models.FloatField(
+        verbose_name='Время, мс',
+    )
+    query_count = models.PositiveIntegerField(
+        verbose_name='SQL-запросов',
+    )
+    query_time = models.FloatField(
+        verbose_name='Время SQL, мс',
+    )
+    profile_format = models.CharField(
+        verbose_name='Формат профиля',
+        max_length=10,
+        choices=FORMATS,
+    )
+    profile = models.BinaryField(
+        verbose_name='Профиль',
+    )
+    report = models.TextField(
+        verbose_name='Отчёт',
+    )
+    created = models.DateTimeField(
+        verbose_name='Создан',
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.method} {self.path} {self.duration:.0f} мс'
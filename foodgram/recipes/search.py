@@ -0,0 +1,209 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from recipes.models import IngredientInRecipe, Recipe
+
+WORD_RE = re.compile(r'\w+')
+# Веса полей рецепта: название, ингредиенты, описание.
+WEIGHTS = {'A': 3, 'B': 2, 'C': 1}
+REBUILD_SQL = """
+    UPDATE recipes_recipe AS recipe SET search_vector =
+        setweight(to_tsvector(%(config)s, recipe.name), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_ingredientinrecipe AS item
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = item.ingredient_id
+            WHERE item.recipe_id = recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s, recipe.text), 'C')
+"""
+REINDEX_SQL = REBUILD_SQL + """
+    WHERE recipe.id = ANY(%(ids)s)
+"""
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.casefold())
+
+
+class PostgresRecipeSearch:
+    """Полнотекстовый поиск по колонке tsvector с GIN-индексом."""
+
+    def reindex(self, recipe_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(REINDEX_SQL, {
+                'config': settings.RECIPE_SEARCH_CONFIG,
+                'ids': list(recipe_ids),
+            })
+
+    def remove(self, recipe_id):
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                REBUILD_SQL, {'config': settings.RECIPE_SEARCH_CONFIG}
+            )
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(
+            query, config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-pub_date', '-id')
+
+
+class MemoryRecipeSearch:
+    """Инвертированный индекс в памяти процесса для SQLite и тестов.
+
+    Слово запроса совпадает со словами индекса, которые с него
+    начинаются; рецепт должен содержать все слова запроса.
+    """
+
+    def __init__(self):
+        self.postings = None
+        self.documents = {}
+        self.words = []
+        self.lock = threading.RLock()
+
+    def index_recipe(self, recipe_id, name, ingredient_names, text):
+        weights = defaultdict(int)
+        for weight, value in (('A', name), ('B', ' '.join(ingredient_names)),
+                              ('C', text)):
+            for word in tokenize(value):
+                weights[word] += WEIGHTS[weight]
+        self.documents[recipe_id] = weights
+        for word, score in weights.items():
+            if word not in self.postings:
+                self.words.insert(bisect_left(self.words, word), word)
+                self.postings[word] = {}
+            self.postings[word][recipe_id] = score
+
+    @staticmethod
+    def read(recipe_ids=None):
+        """(id, название, ингредиенты, описание) рецептов из базы."""
+        items = IngredientInRecipe.objects.all()
+        recipes = Recipe.objects.all()
+        if recipe_ids is not None:
+            items = items.filter(recipe_id__in=recipe_ids)
+            recipes = recipes.filter(id__in=recipe_ids)
+        ingredient_names = defaultdict(list)
+        for recipe_id, name in items.values_list(
+            'recipe_id', 'ingredient__name'
+        ).iterator():
+            ingredient_names[recipe_id].append(name)
+        for recipe_id, name, text in recipes.values_list(
+            'id', 'name', 'text'
+        ).iterator():
+            yield recipe_id, name, ingredient_names[recipe_id], text
+
+    def load(self):
+        self.postings = {}
+        self.documents = {}
+        self.words = []
+        for document in self.read():
+            self.index_recipe(*document)
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.postings is None:
+                self.load()
+
+    def reindex(self, recipe_ids):
+        # Индекс ещё не загружен: load прочитает свежие данные.
+        if self.postings is None:
+            return
+        documents = list(self.read(recipe_ids))
+        with self.lock:
+            for recipe_id in recipe_ids:
+                self._remove(recipe_id)
+            for document in documents:
+                self.index_recipe(*document)
+
+    def remove(self, recipe_id):
+        with self.lock:
+            if self.postings is not None:
+                self._remove(recipe_id)
+
+    def _remove(self, recipe_id):
+        for word in self.documents.pop(recipe_id, ()):
+            self.postings[word].pop(recipe_id, None)
+
+    def rebuild(self):
+        with self.lock:
+            self.load()
+
+    def match(self, term):
+        scores = defaultdict(int)
+        position = bisect_left(self.words, term)
+        while (position < len(self.words)
+               and self.words[position].startswith(term)):
+            for recipe_id, score in self.postings[
+                self.words[position]
+            ].items():
+                scores[recipe_id] += score
+            position += 1
+        return scores
+
+    def search(self, queryset, query):
+        self.ensure_loaded()
+        ranks = None
+        with self.lock:
+            for term in set(tokenize(query)):
+                scores = self.match(term)
+                if ranks is None:
+                    ranks = scores
+                else:
+                    ranks = {
+                        recipe_id: rank + scores[recipe_id]
+                        for recipe_id, rank in ranks.items()
+                        if recipe_id in scores
+                    }
+        if not ranks:
+            return queryset.none()
+        return queryset.filter(id__in=ranks).annotate(
+            rank=Case(
+                *(When(id=recipe_id, then=Value(rank))
+                  for recipe_id, rank in ranks.items()),
+                output_field=IntegerField()
+            )
+        ).order_by('-rank', '-pub_date', '-id')
+
+
+backend = None
+
+
+def get_search_backend():
+    global backend
+    if backend is None:
+        if connection.vendor == 'postgresql':
+            backend = PostgresRecipeSearch()
+        else:
+            backend = MemoryRecipeSearch()
+    return backend
+
+
+def update_search_index(recipe_ids):
+    """Переиндексирует рецепты после фиксации транзакции, прочитав
+    название, описание и ингредиенты из базы."""
+    recipe_ids = set(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(
+            lambda: get_search_backend().reindex(recipe_ids)
+        )
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности."""
+    return get_search_backend().search(queryset, query)
@@ -0,0 +1,157 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import IngredientInRecipe, ShoppingCart, ShoppingListItem
+from users.models import User
+
+
+def get_recipe_amounts(recipe_id):
+    """Количество каждого ингредиента рецепта: {ingredient_id: amount}."""
+    return dict(
+        IngredientInRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+@transaction.atomic
+def apply_delta(user_ids, delta):
+    """Прибавляет delta ({ingredient_id: amount}, amount может быть
+    отрицательным) к сводным спискам покупок пользователей.
+
+    Строки пользователей блокируются, поэтому одновременные изменения
+    корзины одного пользователя применяются по очереди.
+    """
+    delta = {key: value for key, value in delta.items() if value}
+    user_ids = sorted(set(user_ids))
+    if not delta or not user_ids:
+        return
+    list(User.objects.select_for_update().filter(
+        id__in=user_ids
+    ).order_by('id').values_list('id', flat=True))
+    items = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=delta
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, amount in delta.items():
+            item = items.get((user_id, ingredient_id))
+            if item is None:
+                if amount > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount
+                    ))
+                continue
+            item.amount += amount
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.id)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ('amount',))
+    ShoppingListItem.objects.filter(id__in=to_delete).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    apply_delta((user_id,), get_recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    apply_delta((user_id,), {
+        ingredient_id: -amount
+        for ingredient_id, amount in get_recipe_amounts(recipe_id).items()
+    })
+
+
+def recipe_ingredients_changed(recipe_id, old_amounts, new_amounts):
+    """Переносит изменение состава рецепта в списки покупок всех
+    пользователей, у которых рецепт лежит в корзине."""
+    delta = Counter(new_amounts)
+    delta.subtract(old_amounts)
+    user_ids = ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True)
+    apply_delta(user_ids, delta)
+
+
+def iter_shopping_list(user_id):
+    """Сводный список покупок пользователя, по одной строке за раз."""
+    rows = ShoppingListItem.objects.filter(
+        user_id=user_id
+    ).order_by('ingredient__name').values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).iterator()
+    for name, measurement_unit, amount in rows:
+        yield {
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        }
+
+
+def get_live_totals(user_id):
+    """Сводный список, посчитанный заново по корзине пользователя."""
+    return dict(
+        IngredientInRecipe.objects.filter(
+            recipe__shoppingcart__user_id=user_id
+        ).values('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by().values_list('ingredient_id', 'total')
+    )
+
+
+def get_stored_totals(user_id):
+    return dict(
+        ShoppingListItem.objects.filter(
+            user_id=user_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+def diff_shopping_list(user_id):
+    """Расхождения: {ingredient_id: (в таблице, по корзине)}."""
+    stored = get_stored_totals(user_id)
+    live = get_live_totals(user_id)
+    return {
+        ingredient_id: (stored.get(ingredient_id), live.get(ingredient_id))
+        for ingredient_id in stored.keys() | live.keys()
+        if stored.get(ingredient_id) != live.get(ingredient_id)
+    }
+
+
+@transaction.atomic
+def rebuild_shopping_list(user_id):
+    list(User.objects.select_for_update().filter(id=user_id))
+    ShoppingListItem.objects.filter(user_id=user_id).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, amount=total
+        )
+        for ingredient_id, total in get_live_totals(user_id).items()
+    )
+
+
+def fill_shopping_lists(user_ids):
+    """Собирает сводные списки покупок пользователей по их корзинам
+    одним агрегирующим запросом; у пользователей списков быть не должно.
+    Возвращает количество созданных строк."""
+    totals = IngredientInRecipe.objects.filter(
+        recipe__shoppingcart__user_id__in=list(user_ids)
+    ).values(
+        'recipe__shoppingcart__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+    return len(ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(
+            user_id=row['recipe__shoppingcart__user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['total']
+        ) for row in totals.iterator()),
+        batch_size=1000
+    ))
@@ -0,0 +1,191 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart)
+from recipes.search import get_search_backend, update_search_index
+from recipes.shopping_list import (add_recipe, recipe_ingredients_changed,
+                                   remove_recipe)
+from recipes.timeline import backfill, fan_out, restore_author, trim
+from recipes.user_state import STATE_CACHES
+from users.models import Follow, User
+
+# Отправляется командами загрузки справочников после bulk_create,
+# который не вызывает post_save для отдельных объектов.
+reference_data_loaded = Signal()
+# Отправляется после массовой вставки рецептов в обход post_save.
+recipes_bulk_created = Signal()
+# Отправляется после bulk_update/bulk_create ингредиентов рецепта
+# с аргументами recipe_id, old_amounts и new_amounts
+# ({ingredient_id: amount} затронутых строк).
+ingredients_bulk_changed = Signal()
+# Поля рецепта в поисковом индексе (кроме ингредиентов).
+SEARCH_FIELDS = ('name', 'text')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def add_recipe_state(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: STATE_CACHES[sender].invalidate(instance.user_id)
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def discard_recipe_state(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: STATE_CACHES[sender].invalidate(instance.user_id)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver(pre_save, sender=Recipe)
+def check_search_fields(sender, instance, update_fields=None, **kwargs):
+    """Отмечает изменение полей, которые входят в поисковый индекс;
+    сохранение копий изображения и других полей индекс не меняет."""
+    fields = set(SEARCH_FIELDS)
+    if update_fields is not None:
+        fields &= set(update_fields)
+    instance.search_changed = instance.pk is None
+    if instance.pk is None or not fields:
+        return
+    saved = Recipe.objects.filter(pk=instance.pk).values(*fields).first()
+    instance.search_changed = saved is None or any(
+        saved[field] != getattr(instance, field) for field in fields
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    if getattr(instance, 'search_changed', True):
+        update_search_index((instance.pk,))
+
+
+@receiver(pre_save, sender=Ingredient)
+def remember_ingredient_name(sender, instance, **kwargs):
+    instance.saved_name = None
+    if instance.pk is not None:
+        instance.saved_name = Ingredient.objects.filter(
+            pk=instance.pk
+        ).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, **kwargs):
+    if not created and instance.saved_name != instance.name:
+        update_search_index(
+            IngredientInRecipe.objects.filter(
+                ingredient=instance
+            ).values_list('recipe_id', flat=True)
+        )
+
+
+@receiver(recipes_bulk_created)
+def rebuild_search_index(sender, **kwargs):
+    transaction.on_commit(get_search_backend().rebuild)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        add_recipe(instance.user_id, instance.recipe_id)
+
+
+# post_delete: при каскадном удалении рецепта строки корзины и
+# ингредиентов удаляются в любом порядке. Ингредиенты, удалённые
+# раньше корзины, уже вычтены remove_ingredient, а после удаления
+# корзины рецепт не найдётся в ней у remove_ingredient.
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def remember_ingredient(sender, instance, **kwargs):
+    instance.saved_row = None
+    if instance.pk is not None:
+        instance.saved_row = IngredientInRecipe.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def change_ingredient(sender, instance, **kwargs):
+    old_amounts = {}
+    if instance.saved_row is None:
+        update_search_index((instance.recipe_id,))
+    else:
+        recipe_id, ingredient_id, amount = instance.saved_row
+        if (recipe_id, ingredient_id) != (
+            instance.recipe_id, instance.ingredient_id
+        ):
+            update_search_index((recipe_id, instance.recipe_id))
+        if recipe_id == instance.recipe_id:
+            old_amounts = {ingredient_id: amount}
+        else:
+            recipe_ingredients_changed(recipe_id, {ingredient_id: amount}, {})
+    recipe_ingredients_changed(
+        instance.recipe_id, old_amounts,
+        {instance.ingredient_id: instance.amount}
+    )
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def remove_ingredient(sender, instance, **kwargs):
+    update_search_index((instance.recipe_id,))
+    recipe_ingredients_changed(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {}
+    )
+
+
+@receiver(ingredients_bulk_changed)
+def change_ingredients(sender, recipe_id, old_amounts, new_amounts,
+                       **kwargs):
+    if old_amounts.keys() != new_amounts.keys():
+        update_search_index((recipe_id,))
+    recipe_ingredients_changed(recipe_id, old_amounts, new_amounts)
+
+
+@receiver(post_save, sender=Recipe)
+def add_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
+
+
+# Счётчик меняется до backfill_timeline и trim_timeline: они
+# проверяют, не стал ли автор «знаменитостью».
+@receiver(post_save, sender=Follow)
+def add_follower(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(id=instance.author_id).update(
+            followers_count=F('followers_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def remove_follower(sender, instance, **kwargs):
+    User.objects.filter(
+        id=instance.author_id, followers_count__gt=0
+    ).update(followers_count=F('followers_count') - 1)
+    restore_author(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    trim(instance.user_id, instance.author_id)
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+def get_content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - sha256 его содержимого.
+
+    Одинаковые файлы хранятся один раз: если файл с таким содержимым
+    уже есть, он не записывается повторно. Содержимое файла по имени
+    никогда не меняется, поэтому его можно кэшировать навсегда.
+    """
+
+    def get_content_name(self, name, content):
+        path = PurePosixPath(name)
+        return str(
+            path.parent / f'{get_content_hash(content)}{path.suffix.lower()}'
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            # Файл мог долго лежать без ссылок: свежее время изменения
+            # не даёт сборке мусора (MEDIA_GC_GRACE) удалить его до
+            # сохранения рецепта. Если его уже удалили - пишем заново.
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return super().save(name, content, max_length)
+
+
+class PrivateExportStorage(FileSystemStorage):
+    """Выгрузки списков покупок: каталог SHOPPING_LIST_EXPORT_ROOT
+    вне MEDIA_ROOT, у файлов нет публичного URL."""
+
+    @property
+    def base_location(self):
+        return settings.SHOPPING_LIST_EXPORT_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError('У выгрузок списка покупок нет публичного URL')
+
+
+recipe_image_storage = ContentAddressedStorage()
+export_storage = PrivateExportStorage()
@@ -0,0 +1,199 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from recipes.loader import batches
+from recipes.models import Recipe, TimelineEntry
+from users.models import Follow, User
+
+
+def is_celebrity(author_id):
+    """Рецепты авторов с большим числом подписчиков не раскладываются
+    по лентам, а подмешиваются при чтении."""
+    return User.objects.filter(
+        id=author_id, followers_count__gte=settings.FEED_FANOUT_LIMIT
+    ).exists()
+
+
+def get_celebrity_ids(user_id):
+    """Авторы-«знаменитости» среди подписок пользователя: по хранимому
+    числу подписчиков, без подсчёта подписок авторов."""
+    return Follow.objects.filter(
+        user_id=user_id,
+        author__followers_count__gte=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', flat=True)
+
+
+def update_followers_counts():
+    """Пересчитывает User.followers_count после вставки подписок
+    в обход сигналов."""
+    User.objects.update(followers_count=Coalesce(Subquery(
+        Follow.objects.filter(
+            author_id=OuterRef('id')
+        ).order_by().values('author_id').annotate(
+            count=Count('id')
+        ).values('count')
+    ), 0))
+
+
+def fan_out(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    if is_celebrity(recipe.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    entries = TimelineEntry.objects.bulk_create(
+        (TimelineEntry(
+            user_id=user_id,
+            recipe_id=recipe.id,
+            author_id=recipe.author_id,
+            pub_date=recipe.pub_date
+        ) for user_id in follower_ids.iterator()),
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+    if entries:
+        trim_timelines(follower_ids)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    if is_celebrity(author_id):
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(
+            user_id=user_id,
+            recipe_id=recipe_id,
+            author_id=author_id,
+            pub_date=pub_date
+        ) for recipe_id, pub_date in recipes),
+        ignore_conflicts=True
+    )
+    trim_timelines((user_id,))
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты рецепты автора после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def restore_author(author_id):
+    """Автор перестал быть «знаменитостью»: его рецепты, вышедшие без
+    раскладки, добавляются в ленты подписчиков. Вызывается после
+    уменьшения счётчика, поэтому переход через порог - это ровно
+    FEED_FANOUT_LIMIT - 1 подписчик."""
+    if User.objects.filter(
+        id=author_id, followers_count=settings.FEED_FANOUT_LIMIT - 1
+    ).exists():
+        follows = Follow.objects.filter(author_id=author_id)
+        fill(follows)
+        trim_timelines(follows.values('user_id'))
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей только FEED_BACKFILL_SIZE
+    последних записей; более старые удаляются одним DELETE."""
+    ranked = TimelineEntry.objects.filter(
+        user_id__in=user_ids
+    ).order_by().annotate(
+        feed_rank=Window(
+            RowNumber(),
+            partition_by=F('user_id'),
+            order_by=(F('pub_date').desc(), F('recipe_id').desc())
+        )
+    ).values_list('id', 'feed_rank')
+    ranked_sql, ranked_params = ranked.query.sql_with_params()
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT ranked.id FROM ({ranked_sql}) AS ranked '
+            'WHERE ranked.feed_rank > %s)',
+            (*ranked_params, settings.FEED_BACKFILL_SIZE)
+        )
+
+
+def rebuild_timelines(batch_size=1000):
+    update_followers_counts()
+    TimelineEntry.objects.all().delete()
+    user_ids = Follow.objects.order_by('user_id').values_list(
+        'user_id', flat=True
+    ).distinct()
+    for batch in batches(user_ids.iterator(), batch_size):
+        fill_timelines(batch)
+
+
+def fill_timelines(user_ids):
+    """Раскладывает по лентам пользователей последние рецепты всех их
+    подписок (кроме «знаменитостей»). Возвращает количество добавленных
+    записей."""
+    user_ids = list(user_ids)
+    added = fill(Follow.objects.filter(
+        user_id__in=user_ids,
+        author__followers_count__lt=settings.FEED_FANOUT_LIMIT
+    ))
+    trim_timelines(user_ids)
+    return added
+
+
+def fill(follows):
+    """Раскладывает по лентам последние рецепты авторов подписок follows
+    одним INSERT ... SELECT, без запроса на каждую подписку.
+
+    Рецепты сначала нумеруются ROW_NUMBER() в пределах автора, и только
+    первые FEED_BACKFILL_SIZE соединяются с подписками, как при backfill.
+    Строки вставляются по порядку подписчиков: индексы ленты начинаются
+    с user_id, и вставка идёт в соседние страницы. Возвращает количество
+    добавленных записей.
+    """
+    follows = follows.order_by().values_list('user_id', 'author_id')
+    ranked = Recipe.objects.filter(
+        author_id__in=follows.values('author_id')
+    ).order_by().annotate(
+        feed_rank=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc())
+        )
+    ).values_list('id', 'author_id', 'pub_date', 'feed_rank')
+    ranked_sql, ranked_params = ranked.query.sql_with_params()
+    follows_sql, follows_params = follows.query.sql_with_params()
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, recipe_id, author_id, pub_date) '
+            'SELECT follow.user_id, ranked.id, ranked.author_id, '
+            f'ranked.pub_date FROM ({ranked_sql}) AS ranked '
+            f'JOIN ({follows_sql}) AS follow '
+            'ON follow.author_id = ranked.author_id '
+            'WHERE ranked.feed_rank <= %s ORDER BY follow.user_id '
+            'ON CONFLICT DO NOTHING',
+            (*ranked_params, *follows_params, settings.FEED_BACKFILL_SIZE)
+        )
+        return cursor.rowcount
+
+
+def get_feed_sources(user_id, recipes=None):
+    """Источники ленты с ключом ('-pub_date', '-recipe_id'): записи
+    ленты пользователя (индекс timeline_user_pub_date_idx) и рецепты
+    «знаменитостей», на которых он подписан. recipes - рецепты,
+    отобранные фильтрами, или None без фильтров."""
+    entries = TimelineEntry.objects.filter(user_id=user_id).only(
+        'pub_date', 'recipe'
+    )
+    if recipes is not None:
+        entries = entries.filter(recipe__in=recipes.values('id'))
+    sources = [entries]
+    celebrity_ids = list(get_celebrity_ids(user_id))
+    if celebrity_ids:
+        if recipes is None:
+            recipes = Recipe.objects.all()
+        sources.append(recipes.filter(
+            author_id__in=celebrity_ids
+        ).annotate(recipe_id=F('id')).only('pub_date'))
+    return sources
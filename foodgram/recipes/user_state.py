@@ -0,0 +1,128 @@
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+
+class RecipeIdSet:
+    """Отсортированный массив id рецептов пользователя."""
+    typecode = 'q'
+
+    def __init__(self, ids=()):
+        self.ids = array(self.typecode, sorted(ids))
+
+    @classmethod
+    def from_bytes(cls, data):
+        recipe_ids = cls()
+        recipe_ids.ids.frombytes(data)
+        return recipe_ids
+
+    def to_bytes(self):
+        return self.ids.tobytes()
+
+    def __contains__(self, recipe_id):
+        index = bisect_left(self.ids, recipe_id)
+        return index < len(self.ids) and self.ids[index] == recipe_id
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class RecipeStateCache:
+    """Кэш id рецептов, отмеченных пользователем (избранное, покупки),
+    или авторов, на которых он подписан (field='author_id').
+
+    Набор загружается из базы одним запросом при первом обращении.
+    Ключ набора содержит версию пользователя; изменение не правит
+    набор, а меняет версию. Версия читается до запроса к базе, поэтому
+    набор, загруженный одновременно с изменением, записывается под
+    старой версией и больше не читается. Кэш должен быть общим для
+    всех процессов (RECIPE_STATE_CACHE).
+    """
+
+    def __init__(self, model, name, field='recipe_id'):
+        self.model = model
+        self.name = name
+        self.field = field
+
+    @property
+    def cache(self):
+        return caches[settings.RECIPE_STATE_CACHE]
+
+    def get_version_key(self, user_id):
+        return f'recipe-state:{self.name}:{user_id}:version'
+
+    def get_version(self, user_id):
+        key = self.get_version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            # Время, а не 0: после вытеснения ключа версии старые
+            # наборы не должны снова стать актуальными.
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def get_key(self, user_id, version):
+        return f'recipe-state:{self.name}:{user_id}:{version}'
+
+    def get(self, user_id):
+        key = self.get_key(user_id, self.get_version(user_id))
+        data = self.cache.get(key)
+        if data is not None:
+            return RecipeIdSet.from_bytes(data)
+        recipe_ids = RecipeIdSet(
+            self.model.objects.filter(
+                user_id=user_id
+            ).values_list(self.field, flat=True)
+        )
+        self.cache.set(
+            key, recipe_ids.to_bytes(), settings.RECIPE_STATE_CACHE_TIMEOUT
+        )
+        return recipe_ids
+
+    def invalidate(self, user_id):
+        key = self.get_version_key(user_id)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), None)
+
+
+favorites = RecipeStateCache(Favorite, 'favorite')
+shopping_cart = RecipeStateCache(ShoppingCart, 'shopping_cart')
+following = RecipeStateCache(Follow, 'following', field='author_id')
+STATE_CACHES = {
+    Favorite: favorites,
+    ShoppingCart: shopping_cart,
+    Follow: following,
+}
+
+
+def mark_recipes(recipes, user):
+    """Проставляет is_favorited и is_in_shopping_cart уже загруженным
+    рецептам без дополнительных подзапросов."""
+    if not user.is_authenticated:
+        return
+    favorited = favorites.get(user.id)
+    in_cart = shopping_cart.get(user.id)
+    for recipe in recipes:
+        recipe.is_favorited = recipe.id in favorited
+        recipe.is_in_shopping_cart = recipe.id in in_cart
+
+
+def get_following(request):
+    """Id авторов, на которых подписан пользователь запроса.
+
+    Набор берётся из кэша один раз и сохраняется в запросе, поэтому
+    все сериализаторы пользователей в ответе обходятся без запросов.
+    """
+    following_ids = getattr(request, 'following_ids', None)
+    if following_ids is None:
+        following_ids = following.get(request.user.id)
+        request.following_ids = following_ids
+    return following_ids
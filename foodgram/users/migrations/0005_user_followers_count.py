@@ -0,0 +1,32 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:10
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_counts(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    User.objects.update(followers_count=Coalesce(models.Subquery(
+        Follow.objects.filter(
+            author_id=models.OuterRef('id')
+        ).order_by().values('author_id').annotate(
+            count=models.Count('id')
+        ).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_follow_follow_user_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_followers_counts, migrations.RunPython.noop),
+    ]
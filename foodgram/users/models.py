@@ -29,6 +29,13 @@ class User(AbstractUser):
         max_length=settings.NAME_MAX_LENGTH_EMAIL,
         unique=True,
     )
+    # Меняется сигналами подписок (recipes.signals), при массовой
+    # вставке - update_followers_counts.
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
 
@@ -71,6 +78,12 @@ class Follow(models.Model):
                 name='no_self_follow'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('user', '-id'),
+                name='follow_user_id_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user} {self.author}'
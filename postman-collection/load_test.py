@@ -0,0 +1,509 @@
+"""Нагрузочный тест по postman-коллекции.
+
+Запросы коллекции объединяются во взвешенные сценарии (просмотр,
+фильтр по тегам, избранное, корзина, выгрузка, подписки) и
+выполняются параллельно виртуальными пользователями на asyncio
+против запущенного сервера (gunicorn). Для каждого уровня
+параллельности выводятся пропускная способность, задержки и доля
+ошибок по каждому запросу.
+
+    python3 load_test.py --base-url http://127.0.0.1:8000 \\
+        --concurrency 1 4 16 --duration 30
+
+Перед замером регистрируются пользователи loadtest-*; удалить их можно
+по префиксу имени.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import string
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from pathlib import Path
+from urllib.parse import urlsplit
+
+COLLECTION = Path(__file__).with_name('diploma.postman_collection.json')
+VARIABLE_RE = re.compile(r'{{(\w+)}}')
+# Границы корзин гистограммы задержек, мс.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PASSWORD = 'LoadTestPas$word'
+FIXTURE_RECIPES = 100
+
+# Сценарий: вес и запросы коллекции (по имени), выполняемые по порядку
+# с одними и теми же переменными.
+SCENARIOS = {
+    'browse': (50, (
+        'get_recipes_list // No Auth',
+        'get_recipe_detail // No Auth',
+        'get_tag_list // No Auth',
+        'get_recipes_list // User',
+        'get_ingredients_list_with_name_filter // User',
+    )),
+    'filter_by_tags': (15, (
+        'get_recipes_list_with_two_tags_param // User',
+        'get_recipes_list_with_author_param // User',
+    )),
+    'favorite': (10, (
+        'add_to_favorite // User',
+        'get_recipes_list_with_is_favorited_cart_param // User',
+        'remove_from_favorite // User',
+    )),
+    'cart': (10, (
+        'add_to_shopping_cart // User',
+        'get_recipes_list_with_is_in_shopping_cart_param // User',
+        'remove_from_shopping_cart // User',
+    )),
+    'download': (5, (
+        'add_to_shopping_cart // User',
+        'download_shopping_cart // User',
+        'remove_from_shopping_cart // User',
+    )),
+    'subscribe': (10, (
+        'create_subscription // User',
+        'get_subscription_list_with_recipes_limit_param // User',
+        'delete_first_subscription // User',
+    )),
+}
+REGISTER = 'create_first_user'
+LOGIN = 'get_token_for_first_user'
+
+
+class Request:
+    """Запрос коллекции с унаследованной от папок авторизацией."""
+
+    def __init__(self, item, auth):
+        request = item['request']
+        self.name = item['name']
+        self.method = request['method']
+        url = request['url']
+        self.url = url['raw'] if isinstance(url, dict) else url
+        self.endpoint = f'{self.method} {self.url.replace("{{baseUrl}}", "")}'
+        body = request.get('body') or {}
+        self.body = body.get('raw', '') if body.get('mode') == 'raw' else ''
+        self.auth = request.get('auth') or auth
+
+    def render(self, variables):
+        """(метод, путь, заголовки, тело) с подставленными переменными."""
+        def substitute(text):
+            return VARIABLE_RE.sub(
+                lambda match: str(variables[match.group(1)]), text
+            )
+
+        path = substitute(self.url.replace('{{baseUrl}}', ''))
+        headers = {}
+        if self.auth and self.auth['type'] == 'apikey':
+            apikey = {
+                item['key']: item['value'] for item in self.auth['apikey']
+            }
+            headers[apikey['key']] = substitute(apikey['value'])
+        body = b''
+        if self.body and self.method != 'GET':
+            body = substitute(self.body).encode()
+            headers['Content-Type'] = 'application/json'
+        return self.method, path, headers, body
+
+
+def load_collection(path):
+    """{имя запроса: Request}; папки с некорректными запросами
+    (*bad_requests) пропускаются, при повторе имени берётся первый."""
+    requests = {}
+
+    def walk(items, auth):
+        for item in items:
+            if 'item' in item:
+                if 'bad_requests' not in item['name']:
+                    walk(item['item'], item.get('auth') or auth)
+            elif item['name'] not in requests:
+                requests[item['name']] = Request(item, auth)
+
+    collection = json.loads(Path(path).read_text(encoding='utf-8'))
+    walk(collection['item'], collection.get('auth'))
+    return requests
+
+
+class Connection:
+    """Минимальный клиент HTTP/1.1 с keep-alive поверх asyncio."""
+
+    def __init__(self, base_url, timeout):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.ssl = url.scheme == 'https'
+        self.port = url.port or (443 if self.ssl else 80)
+        self.host_header = url.netloc
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        """(статус, тело). Оборванное сервером соединение keep-alive
+        открывается заново один раз."""
+        for attempt in range(2):
+            reused = self.writer is not None
+            if not reused:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        self.host, self.port, ssl=self.ssl
+                    ),
+                    self.timeout
+                )
+            try:
+                return await asyncio.wait_for(
+                    self.exchange(method, path, headers or {}, body),
+                    self.timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                await self.close()
+                raise
+
+    async def exchange(self, method, path, headers, body):
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host_header}',
+            f'Content-Length: {len(body)}',
+            'Accept: */*',
+        ]
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Соединение закрыто сервером')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        keep_alive = (
+            response_headers.get('connection', '').lower() != 'close'
+        )
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            content = b''
+        elif 'chunked' in response_headers.get('transfer-encoding', ''):
+            content = await self.read_chunked()
+        elif 'content-length' in response_headers:
+            content = await self.reader.readexactly(
+                int(response_headers['content-length'])
+            )
+        else:
+            content = await self.reader.read()
+            keep_alive = False
+        if not keep_alive:
+            await self.close()
+        return status, content
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if not size:
+                while (await self.reader.readline()) not in (
+                    b'\r\n', b'\n', b''
+                ):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.timings = []
+        self.errors = Counter()
+
+    def add(self, elapsed_ms, error=None):
+        self.timings.append(elapsed_ms)
+        if error is not None:
+            self.errors[error] += 1
+
+    def histogram(self):
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for elapsed in self.timings:
+            counts[bisect_left(BUCKETS_MS, elapsed)] += 1
+        return counts
+
+    def percentile(self, share):
+        timings = sorted(self.timings)
+        return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+    def summary(self, duration):
+        count = len(self.timings)
+        return {
+            'requests': count,
+            'rps': round(count / duration, 2),
+            'error_rate': round(sum(self.errors.values()) / count, 4),
+            'errors': dict(self.errors),
+            'p50_ms': round(self.percentile(0.5), 2),
+            'p95_ms': round(self.percentile(0.95), 2),
+            'p99_ms': round(self.percentile(0.99), 2),
+            'histogram': self.histogram(),
+        }
+
+
+class Fixtures:
+    """Идентификаторы из базы для подстановки в переменные коллекции.
+
+    Рецепты выбираются с убывающей популярностью: первые в списке
+    (самые новые) чаще.
+    """
+
+    def __init__(self, recipes, tags, letters):
+        self.recipes = recipes
+        self.recipe_weights = list(accumulate(
+            1 / rank for rank in range(1, len(recipes) + 1)
+        ))
+        self.author_ids = sorted(
+            {recipe['author']['id'] for recipe in recipes}
+        )
+        self.tags = tags
+        self.letters = letters
+
+    def get_variables(self, rnd, user):
+        recipe, = rnd.choices(self.recipes, cum_weights=self.recipe_weights)
+        tags = rnd.sample(self.tags, min(3, len(self.tags)))
+        while len(tags) < 3:
+            tags.append(tags[0])
+        authors = [
+            author_id for author_id in self.author_ids
+            if author_id != user['id']
+        ]
+        return {
+            'userToken': user['token'],
+            'secondUserToken': user['token'],
+            'firstRecipeId': recipe['id'],
+            'recipeId': recipe['id'],
+            'userId': recipe['author']['id'],
+            'secondUserId': rnd.choice(authors),
+            'thirdUserId': rnd.choice(authors),
+            'firstTagId': tags[0]['id'],
+            'firstTagSlug': tags[0]['slug'],
+            'secondTagSlug': tags[1]['slug'],
+            'thirdTagSlug': tags[2]['slug'],
+            'ingredientNameFirstLatter': rnd.choice(self.letters),
+        }
+
+
+async def get_json(connection, path, headers=None, method='GET', body=b''):
+    status, content = await connection.request(method, path, headers, body)
+    if status >= 400:
+        raise RuntimeError(f'{method} {path}: {status} {content[:200]!r}')
+    return json.loads(content)
+
+
+async def load_fixtures(base_url, timeout):
+    connection = Connection(base_url, timeout)
+    try:
+        recipes = (await get_json(
+            connection, f'/api/recipes/?limit={FIXTURE_RECIPES}'
+        ))['results']
+        tags = await get_json(connection, '/api/tags/')
+        ingredients = await get_json(connection, '/api/ingredients/')
+    finally:
+        await connection.close()
+    if not recipes or not tags:
+        raise RuntimeError(
+            'Нет рецептов или тегов: наполните базу (generate_fake_data)'
+        )
+    letters = sorted(
+        {item['name'][:1] for item in ingredients if item['name']}
+    )
+    return Fixtures(recipes, tags, letters or list(string.ascii_lowercase))
+
+
+async def create_user(requests, base_url, timeout, run_id, number):
+    """Регистрация и получение токена запросами коллекции."""
+    username = f'loadtest-{run_id}-{number}'
+    variables = {
+        'email': json.dumps(f'{username}@example.org'),
+        'username': json.dumps(username),
+        'password': json.dumps(PASSWORD),
+    }
+    connection = Connection(base_url, timeout)
+    try:
+        method, path, headers, body = requests[REGISTER].render(variables)
+        user = await get_json(connection, path, headers, method, body)
+        method, path, headers, body = requests[LOGIN].render(variables)
+        token = await get_json(connection, path, headers, method, body)
+    finally:
+        await connection.close()
+    return {'id': user['id'], 'token': token['auth_token']}
+
+
+async def virtual_user(requests, scenarios, fixtures, user, options, stats,
+                       deadline, seed):
+    rnd = random.Random(seed)
+    names = list(scenarios)
+    cum_weights = list(accumulate(scenarios[name][0] for name in names))
+    connection = Connection(options.base_url, options.timeout)
+    try:
+        while time.monotonic() < deadline:
+            name, = rnd.choices(names, cum_weights=cum_weights)
+            variables = fixtures.get_variables(rnd, user)
+            for request_name in scenarios[name][1]:
+                request = requests[request_name]
+                started = time.perf_counter()
+                error = None
+                try:
+                    status, _ = await connection.request(
+                        *request.render(variables)
+                    )
+                    if status >= 400:
+                        error = str(status)
+                except (OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError) as exception:
+                    error = type(exception).__name__
+                stats.setdefault(request.endpoint, EndpointStats()).add(
+                    (time.perf_counter() - started) * 1000, error
+                )
+                if options.think:
+                    await asyncio.sleep(rnd.expovariate(1 / options.think))
+    finally:
+        await connection.close()
+
+
+async def run_level(requests, scenarios, fixtures, users, concurrency,
+                    options):
+    stats = {}
+    started = time.monotonic()
+    deadline = started + options.duration
+    await asyncio.gather(*(
+        virtual_user(
+            requests, scenarios, fixtures, users[number], options, stats,
+            deadline, options.seed + number
+        ) for number in range(concurrency)
+    ))
+    duration = time.monotonic() - started
+    total = EndpointStats()
+    for endpoint_stats in stats.values():
+        total.timings.extend(endpoint_stats.timings)
+        total.errors.update(endpoint_stats.errors)
+    return {
+        'concurrency': concurrency,
+        'duration': round(duration, 2),
+        'total': total.summary(duration) if total.timings else None,
+        'endpoints': {
+            endpoint: endpoint_stats.summary(duration)
+            for endpoint, endpoint_stats in sorted(stats.items())
+        },
+    }
+
+
+def print_level(level):
+    print(f'\nПараллельность {level["concurrency"]}, '
+          f'{level["duration"]:.0f} с')
+    print(f'{"запрос":62} {"rps":>8} {"ошибки":>7} '
+          f'{"p50":>8} {"p95":>8} {"p99":>8}')
+    rows = list(level['endpoints'].items())
+    if level['total']:
+        rows.append(('ВСЕГО', level['total']))
+    for endpoint, summary in rows:
+        print(
+            f'{endpoint[:62]:62} {summary["rps"]:8.1f} '
+            f'{summary["error_rate"]:7.1%} {summary["p50_ms"]:8.1f} '
+            f'{summary["p95_ms"]:8.1f} {summary["p99_ms"]:8.1f}'
+        )
+    if not level['total']:
+        return
+    histogram = level['total']['histogram']
+    widest = max(histogram) or 1
+    bounds = [f'<{bound}' for bound in BUCKETS_MS] + [f'>={BUCKETS_MS[-1]}']
+    print('Задержки, мс:')
+    for bound, count in zip(bounds, histogram):
+        print(f'{bound:>7} {count:8} {"#" * round(40 * count / widest)}')
+
+
+def parse_weights(values):
+    weights = {}
+    for value in values or ():
+        name, _, weight = value.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'Нет сценария {name}')
+        weights[name] = int(weight)
+    return weights
+
+
+async def main(options):
+    requests = load_collection(options.collection)
+    weights = parse_weights(options.weight)
+    scenarios = {
+        name: (weights.get(name, weight), steps)
+        for name, (weight, steps) in SCENARIOS.items()
+        if weights.get(name, weight) > 0
+    }
+    missing = {
+        step for _, steps in scenarios.values() for step in steps
+    } - requests.keys()
+    if missing:
+        raise RuntimeError(f'Нет запросов в коллекции: {sorted(missing)}')
+    fixtures = await load_fixtures(options.base_url, options.timeout)
+    run_id = int(time.time())
+    users = await asyncio.gather(*(
+        create_user(
+            requests, options.base_url, options.timeout, run_id, number
+        ) for number in range(max(options.concurrency))
+    ))
+    levels = []
+    for concurrency in options.concurrency:
+        level = await run_level(
+            requests, scenarios, fixtures, users, concurrency, options
+        )
+        print_level(level)
+        levels.append(level)
+    print(f'\n{"параллельность":>14} {"rps":>8} {"p95":>8} {"ошибки":>7}')
+    for level in levels:
+        total = level['total'] or {'rps': 0, 'p95_ms': 0, 'error_rate': 0}
+        print(f'{level["concurrency"]:14} {total["rps"]:8.1f} '
+              f'{total["p95_ms"]:8.1f} {total["error_rate"]:7.1%}')
+    if options.report:
+        Path(options.report).write_text(json.dumps(
+            {'scenarios': scenarios, 'levels': levels},
+            ensure_ascii=False, indent=2
+        ))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=(1, 4, 16),
+        help='Уровни параллельности (виртуальных пользователей)'
+    )
+    parser.add_argument(
+        '--duration', type=float, default=30,
+        help='Длительность каждого уровня, с'
+    )
+    parser.add_argument(
+        '--think', type=float, default=0,
+        help='Средняя пауза между запросами пользователя, с'
+    )
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument(
+        '--weight', nargs='+', metavar='СЦЕНАРИЙ=ВЕС',
+        help=f'Веса сценариев: {", ".join(SCENARIOS)}'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', help='Файл для отчёта в JSON')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(parse_args()))
+    except (RuntimeError, OSError, argparse.ArgumentTypeError) as error:
+        sys.exit(f'Ошибка: {error}')